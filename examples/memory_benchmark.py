@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory benchmark: bytes of the loaded policy tree per rule
+
+Usage: python examples/memory_benchmark.py [number of policies] [rules per policy]
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import gc
+import json
+import sys
+import tracemalloc
+
+# Local source imports
+from sabac import PAP
+
+
+def generate_policies(policies: int, rules: int) -> str:
+    """
+    Generates policy JSON similar to real multi-tenant policies
+    """
+    items = []
+    for policy_index in range(policies):
+        items.append({
+            'description': f"Tenant {policy_index} policy",
+            'target': {'tenant.id': policy_index, 'resource.type': 'document'},
+            'algorithm': 'DENY_UNLESS_PERMIT',
+            'rules': [
+                {
+                    'description': f"Rule {rule_index}",
+                    'effect': 'PERMIT' if rule_index % 4 else 'DENY',
+                    'target': {
+                        'action': ['view', 'update', 'delete', 'share'][rule_index % 4],
+                        'subject.role': ['reader', 'editor', 'owner'][rule_index % 3],
+                    },
+                    'advices': [
+                        {'action': 'log', 'fulfill_on': 'DENY', 'attributes': {'level': 'warning'}}
+                    ],
+                }
+                for rule_index in range(rules)
+            ],
+        })
+    return json.dumps({'algorithm': 'DENY_UNLESS_PERMIT', 'items': items})
+
+
+def measure(policies: int = 1000, rules: int = 100) -> float:
+    """
+    :return: Bytes allocated by the policy tree per rule
+    """
+    data = generate_policies(policies, rules)
+    gc.collect()
+    tracemalloc.start()
+    pap = PAP()
+    pap.add_items(json.loads(data)['items'])
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert pap.root_policy_set.item_count == policies
+    return size / (policies * rules)
+
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:3]]
+    print(f"Bytes per rule: {measure(*arguments):.0f}")
+# EOF
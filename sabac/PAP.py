@@ -10,23 +10,59 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
-import json
+import copy
+import threading
 from dataclasses import dataclass
 from typing import Optional
 
 from .algorithm import deny_unless_permit
+from .optimizer import OptimizationReport, optimize_policy_set
 from .policy_set import PolicySet
+from .provenance import register_tree
+from .streaming import load_policy_set
 
 
 @dataclass(init=False)
 class PAP:
+    """
+    Policy administration point
+    Policy tree is never modified in place: updates build a new items list (or a new tree)
+    and replace the reference, so evaluations that are in progress keep using a consistent tree.
+    """
     root_policy_set: Optional[PolicySet] = None
+    # Incremented on every policy change (used to invalidate data cached for the previous policies)
+    version: int = 0
 
     def __init__(self, algorithm=deny_unless_permit):
+        self._lock = threading.Lock()
+        self.version = 0
         self.root_policy_set = PolicySet(algorithm=algorithm)  # Policy and policy sets are collected here
 
     def add_item(self, data):
-        self.root_policy_set.add_item(data)
+        with self._lock:
+            self.root_policy_set.add_item(data)
+            self.version += 1
+
+    def add_items(self, data_list):
+        """
+        Adds several items as a single policy change (faster than adding them one by one)
+        """
+        with self._lock:
+            self.root_policy_set.add_items(data_list)
+            self.version += 1
+
+    def optimize(self) -> OptimizationReport:
+        """
+        Replaces policy tree with its optimized copy
+        :return: Report of the changes made by optimizer
+        """
+        with self._lock:
+            policy_set = copy.deepcopy(self.root_policy_set)
+            register_tree(policy_set)
+            report = optimize_policy_set(policy_set)
+            self.root_policy_set = policy_set
+            self.version += 1
+        return report
 
     def reload(self):  # pragma: no cover
         raise NotImplementedError("Base PAP class abstract reload method called.")
@@ -36,17 +72,34 @@ class PAP:
 class FilePAP(PAP):
     file_name: Optional[str] = None
     encoding: str = 'UTF-8'
+    optimization_report: Optional[OptimizationReport] = None
+    lazy_threshold: Optional[int] = None
 
-    def __init__(self, file_name, algorithm=deny_unless_permit, encoding='UTF-8'):
+    def __init__(self, file_name, algorithm=deny_unless_permit, encoding='UTF-8', optimize=False,
+                 lazy_threshold: Optional[int] = None):
+        """
+        :param file_name: JSON file with policies
+        :param algorithm: Root policy set algorithm
+        :param encoding: File encoding
+        :param optimize: Optimize policy tree after loading (see optimizer module)
+        :param lazy_threshold: Minimal JSON size (in bytes) of policy items that are materialized
+            only when their target matches a request (see streaming module). None - all items are loaded.
+        """
         PAP.__init__(self, algorithm=algorithm)
+        self.optimize_on_load = optimize
+        self.lazy_threshold = lazy_threshold
         self.load(file_name, encoding)
 
     def load(self, file_name, encoding='UTF-8'):
         self.file_name = file_name
         self.encoding = encoding
-        json_file = open(file_name, encoding=encoding)
-        data = json.load(json_file)
-        self.root_policy_set = PolicySet(json_data=data)
+        # Items are built while the file is read, so the whole JSON document is never kept in memory
+        policy_set = load_policy_set(file_name, encoding, lazy_threshold=self.lazy_threshold)
+        if self.optimize_on_load:
+            self.optimization_report = optimize_policy_set(policy_set)
+        # New tree is built completely before it replaces the old one
+        self.root_policy_set = policy_set
+        self.version += 1
 
     def reload(self):
         self.load(self.file_name, self.encoding)
@@ -10,14 +10,48 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
+from concurrent.futures import Executor
+from typing import Optional
+
+from .bitmap import BitmapMatcher
+from .coverage import PolicyCoverage
+from .ordering import AdaptiveOrdering
 from .PAP import PAP
 from .PIP import PIP
+from .request import Request
 
 
 class PDP:
-    """Policy decision point"""
+    """
+    Policy decision point
+    PDP keeps no per-request state, so one instance may be used by many threads at once.
+    """
+
+    def __init__(
+        self,
+        pap_instance=None,
+        pip_instance=None,
+        executor: Optional[Executor] = None,
+        ordering: Optional[AdaptiveOrdering] = None,
+        coverage: Optional[PolicyCoverage] = None,
+        matcher: Optional[BitmapMatcher] = None
+    ):
+        """
+        :param pap_instance: Policy Administration Point
+        :param pip_instance: Policy Information Point
+        :param executor: Optional executor (e.g. ThreadPoolExecutor). If set, children of policy sets
+            are evaluated concurrently, that hides latency of slow information providers.
+        :param ordering: Optional AdaptiveOrdering instance. If set, children of order-insensitive
+            policies and policy sets are periodically reordered using runtime hit statistics.
+        :param coverage: Optional PolicyCoverage instance that records coverage of (sampled) requests
+        :param matcher: Optional BitmapMatcher instance. If set, targets of policy elements with equality,
+            @in and != constraints are matched with bitmaps before evaluation and rejected elements are skipped.
+        """
+        self.executor = executor
+        self.ordering = ordering
+        self.coverage = coverage
+        self.matcher = matcher
 
-    def __init__(self, pap_instance=None, pip_instance=None):
         # Setting Policy Administration Point
         if pap_instance is not None:
             self.PAP = pap_instance
@@ -30,7 +64,48 @@ class PDP:
         else:   # pragma: no cover
             self.PIP = PIP()  # Using empty PIP as a stub
 
-    def evaluate(self, request):
+    def start_request(self, request):
+        """
+        Prepares request for evaluation
+        :return: Root policy set that should be used for the request evaluation
+        """
         request.PDP = self
-        return self.PAP.root_policy_set.evaluate(request)
+        root_policy_set = self.PAP.root_policy_set
+        if self.coverage is not None and self.coverage.start_request(root_policy_set):
+            request.coverage = self.coverage
+        elif self.matcher is not None:
+            request.target_bitmap = self.matcher.get_request_bitmap(
+                root_policy_set, request, getattr(self.PAP, 'version', None)
+            )
+        return root_policy_set
+
+    def evaluate(self, request, deadline: Optional[float] = None):
+        """
+        :param request: Request object
+        :param deadline: Optional time.monotonic() value overriding the request deadline.
+            If it is exceeded, the remaining policy elements and attribute fetches are skipped
+            and the result is indeterminate unless the decision is already final.
+        """
+        if deadline is not None:
+            request.deadline = deadline
+        return self.start_request(request).evaluate(request)
+
+    def explain(self, request):
+        """
+        Replays the decision for already evaluated request with provenance recording.
+        Attributes resolved during the original evaluation are reused, so information providers
+        are not called again. Allows keeping provenance recording off the hot path.
+        :return: Response with policy list
+        """
+        replay_request = Request(attributes=dict(request.attributes), return_policy_id_list=True)
+        return self.evaluate(replay_request)
+
+    async def evaluate_async(self, request, deadline: Optional[float] = None):
+        """
+        Evaluates request with root policy set children running as asyncio tasks in the PDP executor
+        (or in the default event loop executor if PDP has no executor)
+        """
+        if deadline is not None:
+            request.deadline = deadline
+        return await self.start_request(request).evaluate_async(request, self.executor)
 # EOF
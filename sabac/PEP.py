@@ -11,29 +11,72 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
+import itertools
 import logging
-from typing import List, Dict
+import time
+from typing import Any, Callable, List, Dict, Iterable, Iterator, Optional
 
+from .audit import DecisionLog
 from .constants import *
 from .exceptions import TestFailedException
+from .incremental import EvaluationContext
 from .request import Request
+from .session import EvaluationSession
 from .response import Response
 
+# Number of items that are evaluated together by PEP.filter
+DEFAULT_FILTER_CHUNK_SIZE = 100
+
 
 class PEP:
     """
     Policy Enforcement Point
     """
-    def __init__(self, pdp_instance, pep_type: PolicyEnforcementPointType = PolicyEnforcementPointType.DENY_BIASED):
+    def __init__(
+        self,
+        pdp_instance,
+        pep_type: PolicyEnforcementPointType = PolicyEnforcementPointType.DENY_BIASED,
+        decision_log: Optional[DecisionLog] = None
+    ):
+        """
+        :param pdp_instance: Policy Decision Point
+        :param pep_type: Policy Enforcement Point type
+        :param decision_log: Optional DecisionLog that receives every decision
+        """
         self.PDP = pdp_instance
         self.type = pep_type
+        self.decision_log = decision_log
 
-    def get_result(self, context, return_policy_id_list=False, debug=False):
+    def get_result(
+        self,
+        context,
+        return_policy_id_list=False,
+        debug=False,
+        timeout: Optional[float] = None,
+        evaluation_context: Optional[EvaluationContext] = None
+    ):
         """
         Returns result object.
+        :param context: Policy context (dict) or prepared request (e.g. ObjectRequest)
+        :param timeout: Optional evaluation time budget in seconds (see Request.deadline)
+        :param evaluation_context: Optional EvaluationContext of a request stream,
+            outcomes of previous requests of the stream are reused (see incremental module)
         """
-        request = Request(attributes=context, return_policy_id_list=return_policy_id_list)
-        result = self.PDP.evaluate(request)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if isinstance(context, Request):
+            request = context
+            request.return_policy_id_list = request.return_policy_id_list or return_policy_id_list
+            if deadline is not None:
+                request.deadline = deadline
+        else:
+            request = Request(attributes=context, return_policy_id_list=return_policy_id_list, deadline=deadline)
+        started = time.perf_counter()
+        if evaluation_context is not None:
+            result = evaluation_context.evaluate(request)
+        else:
+            result = self.PDP.evaluate(request)
+        if self.decision_log is not None:
+            self.decision_log.record(request, result, time.perf_counter() - started)
         if debug:  # pragma: no cover
             logging.debug("SABAC request: %s, \nresult: %s.", request, result)
         return result
@@ -63,20 +106,70 @@ class PEP:
         else:  # pragma: no cover
             raise ValueError('Unexpected PDP evaluation result: %s.' % result)
 
-    def evaluate(self, context, return_policy_id_list=False, debug=False):
+    def evaluate(
+        self,
+        context,
+        return_policy_id_list=False,
+        debug=False,
+        timeout: Optional[float] = None,
+        evaluation_context: Optional[EvaluationContext] = None
+    ):
         """
         Policy Enforcement Point evaluation.
-        :param context: Policy context
+        :param context: Policy context (dict) or prepared request (e.g. ObjectRequest)
         :param return_policy_id_list: Should request result contain a list of policies that were used
             during making the decision
         :param debug: Debug output
+        :param timeout: Optional evaluation time budget in seconds.
+            Evaluation that exceeds it gives indeterminate result that is enforced according to PEP type.
+        :param evaluation_context: Optional EvaluationContext of a request stream (see get_result)
         :return:
             True if a policy evaluation result is permit,
             False if deny
         """
-        result = self.get_result(context, return_policy_id_list, debug)
+        result = self.get_result(context, return_policy_id_list, debug, timeout, evaluation_context)
         return self.evaluate_result(result)
 
+    def session(self, fixed_context: dict) -> EvaluationSession:
+        """
+        Creates evaluation session for requests that share attributes (e.g. many checks of the same subject).
+        Constraints of the fixed attributes are decided once, so every request evaluates only the rest of the tree.
+        :param fixed_context: Attributes shared by all session requests (usually subject and environment)
+        :return: Session with evaluate(context) and get_result(context) methods
+        """
+        session = EvaluationSession(self, fixed_context)
+        session.build()
+        return session
+
+    def filter(
+        self,
+        items: Iterable,
+        base_context: dict,
+        item_to_context: Callable[[Any], dict],
+        chunk_size: int = DEFAULT_FILTER_CHUNK_SIZE
+    ) -> Iterator:
+        """
+        Lazily filters items (e.g. ORM query results) by policy decisions.
+        Items are read in chunks: provider attributes of a chunk are fetched in bulk (see EvaluationSession.prefetch)
+        and attributes of the base context are resolved once, so only a single chunk is kept in memory.
+        :param items: Iterable of items
+        :param base_context: Attributes shared by all requests (usually subject and environment)
+        :param item_to_context: Function that returns request attributes of an item (e.g. resource attributes)
+        :param chunk_size: Number of items that are read at once
+        :return: Generator of permitted items (in the original order)
+        """
+        session = self.session(base_context)
+        iterator = iter(items)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                return
+            contexts = [dict(item_to_context(item)) for item in chunk]
+            session.prefetch(contexts)
+            for item, context in zip(chunk, contexts):
+                if session.evaluate(context):
+                    yield item
+
     @staticmethod
     def parse_expected_test_result(test: dict):
         result = True
@@ -92,7 +185,43 @@ class PEP:
                 )
         return result
 
-    def run_tests(self, tests:List[Dict]) -> List:
+    def run_test(self, test: dict) -> Optional[dict]:
+        """
+        Runs a single policy test.
+        Test is evaluated once with policy list recording, so the trace of a failed test is available
+        without re-evaluation.
+        :param test: Test in the format described in run_tests
+        :return: Failure description or None if the test passed
+        """
+        try:
+            expected_result = self.parse_expected_test_result(test)
+        except TestFailedException as e:
+            return {
+                'reason': e.reason,
+                'message': e.message,
+                'test': test
+            }
+
+        if 'context' not in test:
+            return {
+                'reason': TestFailReasons.BAD_FORMAT,
+                'message': "Test has no defined context",
+                'test': test
+            }
+
+        result = self.get_result(test['context'], return_policy_id_list=True)
+        if self.evaluate_result(result) != expected_result:
+            logging.debug("SABAC test failed: %s, \nresult: %s.", test, result)
+            return {
+                'reason': TestFailReasons.FAILED,
+                'message': "Test failed",
+                'test': test,
+                'decision': result.decision,
+                'trace': result.policy_list
+            }
+        return None
+
+    def run_tests(self, tests: Iterable[Dict]) -> List:
         """
         :return:
         :param tests: List of tests in the following format:
@@ -108,49 +237,23 @@ class PEP:
         """
         result = []
         for test in tests:
-            expected_result = None
-            try:
-                expected_result = self.parse_expected_test_result(test)
-            except TestFailedException as e:
-                result.append({
-                    'reason': e.reason,
-                    'message': e.message,
-                    'test': test
-                })
-            if 'context' in test:
-                permit = self.evaluate(test['context'])
-                if permit != expected_result:
-                    # Rerunning with debug
-                    self.evaluate(
-                        context=test['context'],
-                        return_policy_id_list=True,
-                        debug=True
-                    )
-                    result.append({
-                        'reason': TestFailReasons.FAILED,
-                        'message': "Test failed",
-                        'test': test
-                    })
-            else:
-                result.append({
-                    'reason': TestFailReasons.BAD_FORMAT,
-                    'message': "Test has no defined context",
-                    'test': test
-                })
+            failure = self.run_test(test)
+            if failure is not None:
+                result.append(failure)
         return result
 
 
 class DenyBiasedPEP(PEP):
-    def __init__(self, pdp_instance):
-        PEP.__init__(self, pdp_instance=pdp_instance, pep_type=PolicyEnforcementPointType.DENY_BIASED)
+    def __init__(self, pdp_instance, **kwargs):
+        PEP.__init__(self, pdp_instance=pdp_instance, pep_type=PolicyEnforcementPointType.DENY_BIASED, **kwargs)
 
 
 class PermitBiasedPEP(PEP):
-    def __init__(self, pdp_instance):
-        PEP.__init__(self, pdp_instance=pdp_instance, pep_type=PolicyEnforcementPointType.PERMIT_BIASED)
+    def __init__(self, pdp_instance, **kwargs):
+        PEP.__init__(self, pdp_instance=pdp_instance, pep_type=PolicyEnforcementPointType.PERMIT_BIASED, **kwargs)
 
 
 class BasePEP(PEP):
-    def __init__(self, pdp_instance):
-        PEP.__init__(self, pdp_instance=pdp_instance, pep_type=PolicyEnforcementPointType.BASE)
+    def __init__(self, pdp_instance, **kwargs):
+        PEP.__init__(self, pdp_instance=pdp_instance, pep_type=PolicyEnforcementPointType.BASE, **kwargs)
 # EOF
@@ -15,21 +15,47 @@ __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
 import logging
+import threading
 import uuid
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Callable, Dict, Set
 
+from .diagnostics import AttributeDiagnostics
+from .exceptions import DeadlineExceededException
 from .expression_evaluators import expression_evaluators
 from .operator_evaluators import operator_evaluators
 from .information_provider import InformationProvider
 from .request import Request
+from .coalescing import FetchCoalescer, is_coalesced
+from .resilience import ProviderGuard, is_guarded
 from .utils import get_object_by_path
 
 
 class PIP:
-    """Policy Information Point"""
-    def __init__(self):
+    """
+    Policy Information Point
+    Provider registry is updated by replacing its containers (copy-on-write),
+    so any number of threads may fetch attributes while providers are being added.
+    """
+    def __init__(
+        self,
+        on_provider_state_change: Optional[Callable] = None,
+        diagnostics: Optional[AttributeDiagnostics] = None
+    ):
+        """
+        :param on_provider_state_change: Callback for provider circuit state transitions,
+            called as on_provider_state_change(provider, old_state, new_state)
+        :param diagnostics: AttributeDiagnostics instance that collects unresolvable attributes
+            (new instance is created by default)
+        """
         self._information_providers = []
         self._providers_by_provided_attribute = {}
+        self._provider_guards = {}
+        self._fetch_coalescers = {}
+        # Names of attributes known to be unresolvable with policy version they were found for
+        self._unresolvable_attributes = {}
+        self._lock = threading.Lock()
+        self.on_provider_state_change = on_provider_state_change
+        self.diagnostics = diagnostics if diagnostics is not None else AttributeDiagnostics()
 
     def evaluate_expression(self, expression: Any, request: Request) -> Any:
         if isinstance(expression, dict) and len(expression) == 1:
@@ -153,11 +179,108 @@ class PIP:
         """
         if not issubclass(provider, InformationProvider):
             raise ValueError("Only subclass of class InformationProvider could be added to PIP.")
-        self._information_providers.append(provider)
+        with self._lock:
+            # Building new containers to avoid modification of the ones that may be in use by readers
+            providers_by_provided_attribute = dict(self._providers_by_provided_attribute)
+            # Adding to reversed index
+            for provided_attribute in provider.provided_attributes:
+                providers_by_provided_attribute[provided_attribute] = \
+                    providers_by_provided_attribute.get(provided_attribute, []) + [provider]
+            if is_guarded(provider):
+                provider_guards = dict(self._provider_guards)
+                provider_guards[provider] = ProviderGuard(provider, self.on_provider_state_change)
+                self._provider_guards = provider_guards
+            if is_coalesced(provider):
+                fetch_coalescers = dict(self._fetch_coalescers)
+                fetch_coalescers[provider] = FetchCoalescer(provider, self._provider_guards.get(provider))
+                self._fetch_coalescers = fetch_coalescers
+            self._information_providers = self._information_providers + [provider]
+            self._providers_by_provided_attribute = providers_by_provided_attribute
+            self._unresolvable_attributes = {}
+
+    def get_providers(self, attribute_name: str) -> List[InformationProvider]:
+        """
+        :return: Providers of the attribute
+        """
+        return self._providers_by_provided_attribute.get(attribute_name, [])
+
+    def get_attribute_dependencies(self, attribute_name: str) -> Set[str]:
+        """
+        :return: Names of attributes that the attribute value may depend on (including the attribute itself):
+            attributes required by its providers (recursively) and objects that contain it (for dotted names)
+        """
+        result = set()
+        names = [attribute_name]
+        while names:
+            name = names.pop()
+            if name in result:
+                continue
+            result.add(name)
+            parts = name.split('.')
+            names.extend('.'.join(parts[:length]) for length in range(1, len(parts)))
+            for provider in self.get_providers(name):
+                names.extend(provider.required_attributes)
+        return result
+
+    @staticmethod
+    def get_policy_version(request: Request) -> Optional[int]:
+        pdp = getattr(request, 'PDP', None)
+        if pdp is None:
+            return None
+        return pdp.PAP.version
 
-        # Adding to reversed index
-        for provided_attribute in provider.provided_attributes:
-            self._providers_by_provided_attribute.setdefault(provided_attribute, []).append(provider)
+    def fetch_from_provider(self, provider, attribute_name: str, request: Request) -> Any:
+        """
+        Fetches attribute value from the provider enforcing its protection settings.
+        Identical concurrent fetches of coalesced providers share a single provider call.
+        """
+        coalescer = self._fetch_coalescers.get(provider)
+        if coalescer is not None:
+            return coalescer.fetch(
+                request,
+                attribute_name,
+                lambda coalesced_request: self._fetch_with_guard(provider, attribute_name, coalesced_request)
+            )
+        return self._fetch_with_guard(provider, attribute_name, request)
+
+    def _fetch_with_guard(self, provider, attribute_name: str, request: Request) -> Any:
+        guard = self._provider_guards.get(provider)
+        if guard is None:
+            return provider.fetch(request)
+        return guard.fetch(request, attribute_name)
+
+    def fetch_many(self, provider, attribute_name: str, attributes_list: List[dict]) -> List[Any]:
+        """
+        Fetches provider values for several sets of required attributes at once enforcing its protection settings
+        :param attributes_list: Required attribute values for every fetch
+        :return: Values in the same order
+        """
+        guard = self._provider_guards.get(provider)
+        if guard is None:
+            results = provider.fetch_many(attributes_list)
+        else:
+            results = guard.call(
+                lambda: provider.fetch_many(attributes_list),
+                attribute_name,
+                [provider.fallback_value] * len(attributes_list)
+            )
+        if len(results) != len(attributes_list):
+            raise ValueError(
+                f"Information provider {provider.__name__} returned {len(results)} values "
+                f"for {len(attributes_list)} keys."
+            )
+        return results
+
+    def get_provider_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: Circuit state and call counters of protected and coalesced providers by provider name
+        """
+        result = {}
+        for provider, guard in self._provider_guards.items():
+            result[provider.__name__] = guard.get_metrics()
+        for provider, coalescer in self._fetch_coalescers.items():
+            result.setdefault(provider.__name__, {}).update(coalescer.get_metrics())
+        return result
 
     def fetch_attribute(
         self,
@@ -176,8 +299,12 @@ class PIP:
         """
         # Avoiding search for known attributes
         result = None
+        providers_by_provided_attribute = self._providers_by_provided_attribute
         if attribute_name in request.attributes:
             result = request.attributes[attribute_name]
+        elif attribute_name in self._unresolvable_attributes \
+                and self._unresolvable_attributes[attribute_name] == self.get_policy_version(request):
+            self.diagnostics.record_missing(attribute_name, request, attribute_fetch_stack)
         # FixMe: Restore loop checking
         # elif isinstance(attribute_fetch_stack, list):
         #     if attribute_name in attribute_fetch_stack:
@@ -186,27 +313,29 @@ class PIP:
         #             f"while fetching attribute '{attribute_name}': {attribute_fetch_stack}"
         #         )
         # Attribute is absent in context
-        elif attribute_name not in self._providers_by_provided_attribute:
+        elif attribute_name not in providers_by_provided_attribute:
             # There is no direct match for this attribute - will try to resolve
             attribute_name_parts = attribute_name.split('.')
             if len(attribute_name_parts) > 1:
                 # Attribute is complex - trying to resolve
                 result = get_object_by_path(request.attributes, attribute_name_parts)
             else:
-                # There is no way to get this attribute
-                logging.warning(
-                    f"No information providers found for attribute '{attribute_name}'."
-                    f" Request data:{request}."
-                    f" Attribute fetch stack: {attribute_fetch_stack}"
-                )
-                import traceback
-                traceback.print_stack()
+                # There is no way to get this attribute (until providers or policies are changed)
+                unresolvable_attributes = self._unresolvable_attributes
+                unresolvable_attributes[attribute_name] = self.get_policy_version(request)
+                self.diagnostics.record_missing(attribute_name, request, attribute_fetch_stack)
         else:
-            for provider in self._providers_by_provided_attribute[attribute_name]:
+            for provider in providers_by_provided_attribute[attribute_name]:
+                if request.is_expired():
+                    raise DeadlineExceededException(
+                        attribute_name=attribute_name,
+                        message=f"Attribute `{attribute_name}` was not fetched: request deadline exceeded."
+                    )
                 # Fetching all required attributes first
                 for required_attribute in provider.required_attributes:
                     if required_attribute not in request.attributes:
                         # Searching for the required attribute
+                        # (the value is stored in the request layer, the original context is not modified)
                         new_fetch_stack = self._new_attribute_fetch_stack(attribute_name, attribute_fetch_stack)
                         request.attributes[required_attribute] = self.fetch_attribute(
                             required_attribute,
@@ -215,7 +344,7 @@ class PIP:
                         )
 
                 # Now all required attributes should be present in context
-                result = provider.fetch(request)
+                result = self.fetch_from_provider(provider, attribute_name, request)
                 if result is not None:
                     break
         return result
@@ -15,8 +15,17 @@ __email__ = "yuriy.petrovskiy@gmail.com"
 from .PIP import PIP, InformationProvider
 from .PEP import DenyBiasedPEP, PermitBiasedPEP, BasePEP, PEP
 from .PDP import PDP
+from .ordering import AdaptiveOrdering
+from .bitmap import BitmapMatcher
+from .incremental import EvaluationContext
+from .coverage import PolicyCoverage
+from .audit import DecisionLog, JSONLWriter, BinaryWriter
 from .PAP import PAP, FilePAP
-from .request import Request
+from .tenancy import LazyTenantPAP
+from .database import SQLitePAP
+from .request import Request, ObjectRequest
+from .policy_testing import PolicyTestRunner
+from .sharding import ShardedPDP
 from .algorithm import *
 from .constants import *
 
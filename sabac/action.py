@@ -11,12 +11,19 @@ __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
 import logging
+import weakref
 from dataclasses import dataclass, field
 from typing import Any, Optional, Dict
 
+from .compact import intern_value
 from .constants import RESULT_PERMIT, RESULT_DENY, PERMIT_SHORTCUTS, DENY_SHORTCUTS, RuleEvaluationResult
+from .utils import add_slots, freeze
 
+# Actions shared by policy elements, by class and frozen JSON data (see Action.get_shared)
+_shared_actions = weakref.WeakValueDictionary()
 
+
+@add_slots(weakref=True)
 @dataclass(init=False)
 class Action:
     action: Optional[str] = None
@@ -27,13 +34,16 @@ class Action:
         if not isinstance(json_data, dict):  # pragma: no cover
             raise ValueError("Dict should be provided by json_data attribute.")
 
+        self.action = None
+        self.fulfill_on = None
+        self.attributes = None
         self.extract_action_from_json(json_data)
         self.extract_condition_from_json(json_data)
         self.extract_attributes_from_json(json_data)
 
     def extract_action_from_json(self, json_data):
         if 'action' in json_data:
-            self.action = json_data['action']
+            self.action = intern_value(json_data['action'])
         else:  # pragma: no cover
             raise ValueError("'action' attribute should be defined. %s" % json_data)
 
@@ -54,9 +64,28 @@ class Action:
                 logging.warning("Action element fulfill_on initialized with incorrect value: '%s'.", condition)
                 self.fulfill_on = condition
 
+    @classmethod
+    def get_shared(cls, json_data) -> "Action":
+        """
+        Returns action for JSON data that is shared by all policy elements with identical action data.
+        Shared actions should not be modified.
+        """
+        key = (cls, freeze(json_data))
+        action = _shared_actions.get(key)
+        if action is None:
+            action = _shared_actions.setdefault(key, cls(json_data))
+        return action
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'action': self.action,
+            'fulfill_on': self.fulfill_on.name if isinstance(self.fulfill_on, RuleEvaluationResult) else self.fulfill_on,
+            'attributes': self.attributes,
+        }
+
     def extract_attributes_from_json(self, json_data):
         if 'attributes' in json_data:
-            self.attributes = json_data['attributes']
+            self.attributes = intern_value(json_data['attributes'])
         else:  # pragma: no cover
             raise ValueError("attributes should be defined.")
 
@@ -67,11 +96,11 @@ class Obligation(Action):
         obligation should be executed if PEP understands, and it can and will discharge those obligations
         So if obligation is set and a policy evaluation result is matched with a required result, it is added to the result.
     """
-    pass
+    __slots__ = ()
 
 
 class Advice(Action):
-    pass
+    __slots__ = ()
 
 
 @dataclass()
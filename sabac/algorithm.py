@@ -11,7 +11,7 @@ __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
 import logging
-from typing import Tuple
+from typing import Tuple, Optional, Callable
 
 from .constants import *
 
@@ -87,7 +87,8 @@ def permit_unless_deny(old_response, new_response) -> Tuple[Response, bool]:
     result = new_response.copy()
 
     # Adding advices, obligations and used policies to the current response
-    result.join_data(old_response, prepend=True)
+    if old_response is not None:
+        result.join_data(old_response, prepend=True)
     if new_response.decision == RESULT_DENY:
         return result, True
     elif new_response.decision in [
@@ -122,6 +123,11 @@ def only_one_applicable(old_value, new_value):
     raise NotImplementedError()  # pragma: no cover
 
 
+# Algorithms whose decision does not depend on the order of the combined elements
+# (if obligations and advices are not taken into account)
+ORDER_INSENSITIVE_ALGORITHMS = (deny_unless_permit, permit_unless_deny)
+
+
 POLICY_ALGORITHMS = {
     'DENY_OVERRIDES': deny_overrides,
     'PERMIT_OVERRIDES': permit_overrides,
@@ -145,6 +151,16 @@ POLICY_SET_ALGORITHMS = {
 }
 
 
+def get_algorithm_name(algorithm: Callable) -> Optional[str]:
+    """
+    Returns name of a combining algorithm function (as used in JSON) or None for unknown functions
+    """
+    for algorithm_name, algorithm_function in POLICY_SET_ALGORITHMS.items():
+        if algorithm_function is algorithm:
+            return algorithm_name
+    return None
+
+
 def get_algorithm_by_name(algorithm_name: str = None, default_algorithm_name=DEFAULT_ALGORITHM_NAME):
     if algorithm_name in POLICY_SET_ALGORITHMS:
         return POLICY_SET_ALGORITHMS[algorithm_name]
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Decision audit log
+
+Decisions are put into a bounded in-memory buffer by PEP and written by a background thread in batches,
+so logging does not add file I/O to the request latency.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import atexit
+import json
+import logging
+import marshal
+import os
+import random
+import struct
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set
+
+from .policy_element import get_referenced_attributes
+from .utils import get_object_by_path
+
+BACKPRESSURE_DROP = 'drop'
+BACKPRESSURE_BLOCK = 'block'
+
+
+def to_basic(value: Any) -> Any:
+    """
+    Converts value to basic types (dict, list, str, int, float, bool, None) supported by all writers
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    elif isinstance(value, Enum):
+        return value.name
+    elif isinstance(value, dict):
+        return {str(key): to_basic(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple, set)):
+        return [to_basic(item) for item in value]
+    elif hasattr(value, 'to_json'):
+        return to_basic(value.to_json())
+    return str(value)
+
+
+class RotatingFileWriter:
+    """
+    Base class for decision log writers. File is rotated when it reaches max_bytes:
+    file_name -> file_name.1 -> ... -> file_name.<backup_count>
+    """
+    mode = 'ab'
+
+    def __init__(self, file_name: str, max_bytes: int = 0, backup_count: int = 5):
+        """
+        :param file_name: Log file name
+        :param max_bytes: Maximal file size (0 - no rotation)
+        :param backup_count: Number of rotated files to keep
+        """
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = open(file_name, self.mode)
+
+    def encode(self, record: Dict[str, Any]) -> bytes:
+        raise NotImplementedError()  # pragma: no cover
+
+    def write_batch(self, records: List[Dict[str, Any]]) -> None:
+        data = b''.join(self.encode(record) for record in records)
+        if self.max_bytes and self._file.tell() > 0 and self._file.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def rotate(self) -> None:
+        self._file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.file_name}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.file_name}.{index + 1}")
+            os.replace(self.file_name, f"{self.file_name}.1")
+        else:
+            os.remove(self.file_name)
+        self._file = open(self.file_name, self.mode)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JSONLWriter(RotatingFileWriter):
+    """
+    Writes one JSON object per line
+    """
+    def encode(self, record: Dict[str, Any]) -> bytes:
+        return json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('UTF-8') + b'\n'
+
+
+class BinaryWriter(RotatingFileWriter):
+    """
+    Writes records as marshal data prefixed with 4-byte little-endian length (see read_binary_log).
+    Marshal format depends on Python version, so logs should be read by the same Python version.
+    """
+    def encode(self, record: Dict[str, Any]) -> bytes:
+        data = marshal.dumps(record)
+        return struct.pack('<I', len(data)) + data
+
+
+def read_binary_log(file_name: str) -> List[Dict[str, Any]]:
+    """
+    Reads records written by BinaryWriter
+    """
+    result = []
+    with open(file_name, 'rb') as log_file:
+        data = log_file.read()
+    position = 0
+    while position < len(data):
+        length, = struct.unpack_from('<I', data, position)
+        position += 4
+        result.append(marshal.loads(data[position:position + length]))
+        position += length
+    return result
+
+
+class DecisionLog:
+    """
+    Asynchronous buffered decision log.
+    Records are written when batch_size records are collected or flush_interval passed.
+    Remaining records are written on close() (called automatically at interpreter exit).
+
+    Only attributes used by the policies (and attributes resolved during evaluation) are logged.
+    They are converted to basic types by the calling thread, so objects owned by the caller
+    are never accessed by the background thread.
+    Writer errors are logged and counted (records of the failed batch are lost), the log keeps working.
+    """
+
+    def __init__(
+        self,
+        writer: RotatingFileWriter,
+        capacity: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        sample_rate: float = 1.0,
+        backpressure: str = BACKPRESSURE_DROP
+    ):
+        """
+        :param writer: Writer instance (e.g. JSONLWriter or BinaryWriter)
+        :param capacity: Maximal number of buffered records
+        :param batch_size: Maximal number of records written at once
+        :param flush_interval: Maximal time (in seconds) a record stays in the buffer
+        :param sample_rate: Part of decisions (0..1) that are logged
+        :param backpressure: What to do if buffer is full: 'drop' the new record or 'block' until there is space
+        """
+        if backpressure not in (BACKPRESSURE_DROP, BACKPRESSURE_BLOCK):
+            raise ValueError(f"Unknown backpressure policy `{backpressure}`.")
+        self.writer = writer
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.backpressure = backpressure
+        self.dropped = 0
+        self.written = 0
+        # Number of batches that the writer failed to write
+        self.errors = 0
+        # Root policy set, PAP version and names of the attributes used by its policies
+        self._used_names: Optional[tuple] = None
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='sabac-decision-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def get_used_names(self, pdp) -> Set[str]:
+        """
+        :return: Names of attributes referenced by the policies and attributes required by their providers
+        """
+        root_policy_set = pdp.PAP.root_policy_set
+        version = getattr(pdp.PAP, 'version', None)
+        used_names = self._used_names
+        if used_names is None or used_names[0] is not root_policy_set or used_names[1] != version:
+            names = set()
+            pending = list(get_referenced_attributes(root_policy_set))
+            while pending:
+                name = pending.pop()
+                if name not in names:
+                    names.add(name)
+                    for provider in pdp.PIP.get_providers(name):
+                        pending.extend(provider.required_attributes)
+            used_names = self._used_names = (root_policy_set, version, names)
+        return used_names[2]
+
+    def get_used_attributes(self, request) -> Dict[str, Any]:
+        """
+        :return: Attributes used during the request evaluation converted to basic types
+        """
+        attributes = request.attributes
+        pdp = getattr(request, 'PDP', None)
+        if pdp is None:
+            return to_basic(dict(attributes))
+        result = {}
+        for name in self.get_used_names(pdp):
+            if name in attributes:
+                result[name] = to_basic(attributes[name])
+            elif isinstance(name, str) and '.' in name:
+                value = get_object_by_path(attributes, name.split('.'))
+                if value is not None:
+                    result[name] = to_basic(value)
+        for name, value in request.resolved_attributes.items():
+            if name not in result:
+                result[str(name)] = to_basic(value)
+        return result
+
+    def record(self, request, response, elapsed: Optional[float] = None) -> bool:
+        """
+        Puts a decision to the buffer. Never waits for a writer thread that is stopped.
+        :return: True if the decision was buffered, False if it was skipped by sampling or dropped
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self._closed:
+            return False
+        record = {
+            'time': time.time(),
+            'decision': response.decision.name,
+            'attributes': self.get_used_attributes(request),
+            'polices': [[element_id, result.name] for element_id, result in response.polices],
+            'obligations': to_basic(list(response.obligations)),
+            'advices': to_basic(list(response.advices)),
+            'elapsed': elapsed,
+        }
+        with self._condition:
+            while True:
+                if self._closed:
+                    return False
+                if len(self._buffer) < self.capacity:
+                    break
+                if self.backpressure == BACKPRESSURE_DROP or not self._thread.is_alive():
+                    self.dropped += 1
+                    return False
+                self._condition.wait(self.flush_interval)
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def _take_batch(self) -> list:
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        # Waking up producers that are waiting for space
+        self._condition.notify_all()
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                batch = self._take_batch()
+                closed = self._closed
+            if batch:
+                self._write(batch)
+            if closed and not batch:
+                return
+
+    def _write(self, batch: list) -> None:
+        with self._write_lock:
+            try:
+                self.writer.write_batch(batch)
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Decision log batch of {len(batch)} records was not written: {e.__class__.__name__}: {e}")
+            else:
+                self.written += len(batch)
+
+    def flush(self) -> None:
+        """
+        Writes all buffered records (in the calling thread)
+        """
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self) -> None:
+        """
+        Stops the background writer. All records buffered before close are written.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        try:
+            self.writer.close()
+        except Exception as e:
+            logging.error(f"Decision log writer was not closed: {e.__class__.__name__}: {e}")
+        atexit.unregister(self.close)
+# EOF
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bitmap matching of policy element targets
+
+Every rule, policy and policy set of the tree whose target starts with equality, @in or != constraints
+of constant values gets a bit position. For every (attribute, value) pair of these constraints
+a bitmap (Python int) of the elements whose constraint is satisfied by the value is precomputed,
+elements that do not constrain the attribute are "don't care" elements.
+Before evaluation the bitmap of rejected targets is calculated for the request using a few
+wide bitwise operations per request attribute, so rejected children of policies and policy sets
+are replaced with NotApplicableElement placeholders (see policy_element.MAX_PLACEHOLDERS)
+and only surviving elements are checked by the regular context_match.
+
+Only attributes present in the request context are used. Constraint of an element is used only if all
+constraints before it are indexed and their attributes are present, so targets that would be indeterminate
+because of unavailable attributes (or would need other attributes to be fetched) are never rejected.
+
+Bitmaps are rebuilt when the root policy set or PAP version is changed.
+Targets of the policy elements should not be replaced without PAP version change (or BitmapMatcher.reset call).
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import threading
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .policy_element import MAX_PLACEHOLDERS, NotApplicableElement
+
+_placeholders = [NotApplicableElement(description="Items rejected by bitmap") for _ in range(MAX_PLACEHOLDERS)]
+
+
+def is_constant(value: Any) -> bool:
+    """
+    Checks if value could be used as a bitmap key: hashable and equal to itself (not NaN)
+    """
+    if isinstance(value, (dict, list)):
+        return False
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return value == value
+
+
+def get_bitmap_constraint(constraint: Any) -> Optional[Tuple[bool, tuple]]:
+    """
+    :return: (constraint is satisfied by equal values, values) or None if constraint could not be indexed.
+        Constraints that are satisfied by not equal values are != constraints.
+    """
+    if not isinstance(constraint, dict):
+        return (True, (constraint,)) if is_constant(constraint) else None
+    if len(constraint) != 1:
+        return None
+    operator, operand = next(iter(constraint.items()))
+    if operator in ('==', '!=') and (operand is None or isinstance(operand, str)):
+        return operator == '==', (operand,)
+    if operator == '@in' and isinstance(operand, list) and all(is_constant(item) for item in operand):
+        return True, tuple(operand)
+    return None
+
+
+def to_bitmap(positions: Iterable[int]) -> int:
+    data = bytearray()
+    for position in positions:
+        byte = position >> 3
+        if byte >= len(data):
+            data.extend(bytes(byte + 1 - len(data)))
+        data[byte] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+class TargetBitmaps:
+    """
+    Bitmaps of the policy tree targets
+    """
+
+    def __init__(self, root_policy_set, version: Any = None):
+        self.root_policy_set = root_policy_set
+        self.version = version
+        # Bit positions by element ids (elements are kept, so ids are not reused)
+        self.positions: Dict[int, int] = {}
+        self.elements: list = []
+        equal: Dict[str, Dict[Any, List[int]]] = {}
+        not_equal: Dict[str, Dict[Any, List[int]]] = {}
+        not_equal_all: Dict[str, List[int]] = {}
+        constrained: Dict[str, List[int]] = {}
+        # Elements that have constraint of the second attribute before the constraint of the first one
+        preceding: Dict[str, Dict[str, List[int]]] = {}
+
+        stack = list(getattr(root_policy_set, 'children', ()))
+        while stack:
+            element = stack.pop()
+            stack.extend(getattr(element, 'children', ()))
+            target = getattr(element, 'target', None)
+            if id(element) in self.positions or not target or not isinstance(target, Mapping):
+                continue
+            position = len(self.elements)
+            previous_attributes = []
+            for attribute, constraint in target.items():
+                bitmap_constraint = get_bitmap_constraint(constraint)
+                if bitmap_constraint is None:
+                    break
+                is_equal, values = bitmap_constraint
+                for value in values:
+                    by_value = (equal if is_equal else not_equal).setdefault(attribute, {})
+                    by_value.setdefault(value, []).append(position)
+                if not is_equal:
+                    not_equal_all.setdefault(attribute, []).append(position)
+                constrained.setdefault(attribute, []).append(position)
+                for previous_attribute in previous_attributes:
+                    preceding.setdefault(attribute, {}).setdefault(previous_attribute, []).append(position)
+                previous_attributes.append(attribute)
+            if previous_attributes:
+                self.positions[id(element)] = position
+                self.elements.append(element)
+
+        self.constrained = {attribute: to_bitmap(positions) for attribute, positions in constrained.items()}
+        self.equal = {
+            attribute: {value: to_bitmap(positions) for value, positions in by_value.items()}
+            for attribute, by_value in equal.items()
+        }
+        self.not_equal = {
+            attribute: {value: to_bitmap(positions) for value, positions in by_value.items()}
+            for attribute, by_value in not_equal.items()
+        }
+        self.not_equal_all = {attribute: to_bitmap(positions) for attribute, positions in not_equal_all.items()}
+        self.preceding = {
+            attribute: {previous: to_bitmap(positions) for previous, positions in by_attribute.items()}
+            for attribute, by_attribute in preceding.items()
+        }
+
+    def get_rejected(self, request) -> int:
+        """
+        :return: Bitmap of elements whose targets do not match the request
+        """
+        context = request.attributes
+        # Values of the absent attributes are unknown until they are fetched
+        absent = [
+            attribute for attribute in self.constrained
+            if attribute not in context or isinstance(context[attribute], dict)
+        ]
+        rejected = 0
+        for attribute, constrained in self.constrained.items():
+            if attribute in absent:
+                continue
+            value = context[attribute]
+            not_equal_all = self.not_equal_all.get(attribute, 0)
+            try:
+                satisfied = self.equal.get(attribute, {}).get(value, 0)
+                satisfied |= not_equal_all & ~self.not_equal.get(attribute, {}).get(value, 0)
+            except TypeError:
+                # Unhashable value is not equal to any constant
+                satisfied = not_equal_all
+            mismatched = constrained & ~satisfied
+            if mismatched and absent:
+                preceding = self.preceding.get(attribute, {})
+                for absent_attribute in absent:
+                    mismatched &= ~preceding.get(absent_attribute, 0)
+            rejected |= mismatched
+        return rejected
+
+
+class RequestBitmap:
+    """
+    Elements rejected for a request
+    """
+    __slots__ = ('positions', 'rejected')
+
+    def __init__(self, positions: Dict[int, int], rejected: int):
+        self.positions = positions
+        self.rejected = rejected.to_bytes((rejected.bit_length() + 7) >> 3, 'little')
+
+    def is_rejected(self, element) -> bool:
+        position = self.positions.get(id(element))
+        if position is None or position >> 3 >= len(self.rejected):
+            return False
+        return bool(self.rejected[position >> 3] >> (position & 7) & 1)
+
+    def filter(self, children: list) -> list:
+        """
+        :return: Children that are not rejected followed by placeholders for the rejected ones
+        """
+        result = [child for child in children if not self.is_rejected(child)]
+        excluded = len(children) - len(result)
+        if not excluded:
+            return children
+        return result + _placeholders[:min(excluded, MAX_PLACEHOLDERS)]
+
+
+class BitmapMatcher:
+    """
+    Alternative target matching engine for large policy trees (see module description).
+    Set as PDP matcher, it is not used for requests recorded for coverage.
+    """
+
+    def __init__(self):
+        self._bitmaps: Optional[TargetBitmaps] = None
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        """
+        Drops bitmaps, so they are rebuilt for the next request
+        """
+        self._bitmaps = None
+
+    def get_bitmaps(self, root_policy_set, version: Any = None) -> TargetBitmaps:
+        bitmaps = self._bitmaps
+        if bitmaps is None or bitmaps.root_policy_set is not root_policy_set or bitmaps.version != version:
+            with self._lock:
+                bitmaps = self._bitmaps
+                if bitmaps is None or bitmaps.root_policy_set is not root_policy_set or bitmaps.version != version:
+                    bitmaps = self._bitmaps = TargetBitmaps(root_policy_set, version)
+        return bitmaps
+
+    def get_request_bitmap(self, root_policy_set, request, version: Any = None) -> Optional[RequestBitmap]:
+        """
+        :return: Elements rejected for the request or None if no element is rejected
+        """
+        bitmaps = self.get_bitmaps(root_policy_set, version)
+        rejected = bitmaps.get_rejected(request)
+        return RequestBitmap(bitmaps.positions, rejected) if rejected else None
+# EOF
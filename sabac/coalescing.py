@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Coalescing of identical concurrent information provider fetches
+
+Provider that declares `coalesce = True` promises that its result depends only on its required attributes.
+Concurrent fetches with the same required attribute values then share a single provider call (singleflight).
+If provider also declares `batch_window`, fetches with different values that arrive within the window
+are combined into one `fetch_many` call (like DataLoader does).
+
+Asyncio evaluation (PDP.evaluate_async) runs policy elements and therefore attribute fetches
+in executor threads, so the same coalescing applies to it.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .exceptions import DeadlineExceededException
+from .utils import freeze
+
+
+def is_coalesced(provider) -> bool:
+    return provider.coalesce or provider.batch_window is not None
+
+
+class PendingFetch:
+    """
+    Provider call shared by all requests with the same key
+    """
+    def __init__(self, attributes: Dict[str, Any]):
+        self.attributes = attributes
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+    def set_result(self, result: Any) -> None:
+        self.result = result
+        self.done.set()
+
+    def set_error(self, error: BaseException) -> None:
+        self.error = error
+        self.done.set()
+
+
+class FetchCoalescer:
+    """
+    Shares in-flight fetches of a single provider and optionally combines them into batches
+    """
+
+    def __init__(self, provider, guard=None):
+        """
+        :param provider: InformationProvider subclass
+        :param guard: Optional ProviderGuard used for provider calls
+        """
+        self.provider = provider
+        self.guard = guard
+        self.counters = {'fetches': 0, 'coalesced': 0, 'provider_calls': 0, 'batches': 0}
+        self._condition = threading.Condition()
+        # In-flight and pending fetches by key
+        self._fetches: Dict[Any, PendingFetch] = {}
+        # Fetches waiting for the next batch
+        self._batch: List[Tuple[Any, PendingFetch]] = []
+
+    def get_key(self, request) -> Any:
+        """
+        :return: Hashable representation of required attribute values or None if values are not hashable
+        """
+        values = tuple(freeze(request.attributes.get(name)) for name in self.provider.required_attributes)
+        try:
+            hash(values)
+        except TypeError:
+            return None
+        return values
+
+    def fetch(self, request, attribute_name: str, fetch_function) -> Any:
+        """
+        Fetches provider value for the request or waits for the same fetch made by another request
+        :param request: Request object
+        :param attribute_name: Name of fetched attribute (for error messages)
+        :param fetch_function: Function that makes a single (protected) provider call for the request
+        """
+        key = self.get_key(request)
+        if key is None:
+            return fetch_function(request)
+
+        batched = self.provider.batch_window is not None
+        with self._condition:
+            self.counters['fetches'] += 1
+            pending = self._fetches.get(key)
+            is_owner = pending is None
+            if is_owner:
+                attributes = {name: request.attributes.get(name) for name in self.provider.required_attributes}
+                pending = self._fetches[key] = PendingFetch(attributes)
+                if batched:
+                    self._batch.append((key, pending))
+                    is_batch_leader = len(self._batch) == 1
+                    if len(self._batch) >= self.provider.max_batch_size:
+                        self._condition.notify_all()
+            else:
+                self.counters['coalesced'] += 1
+
+        if not is_owner:
+            return self.wait(pending, request, attribute_name)
+        elif not batched:
+            try:
+                self._count_call()
+                pending.set_result(fetch_function(request))
+            except BaseException as e:
+                pending.set_error(e)
+            finally:
+                self._forget([key])
+            return self.get_result(pending)
+        elif is_batch_leader:
+            batch = self.collect_batch(request.get_remaining_time())
+            if request.get_remaining_time() == 0:
+                # Leader fails at its deadline, while other fetches of the batch are made by another thread
+                threading.Thread(target=self.run_batches, args=(batch, attribute_name), daemon=True).start()
+                self.raise_deadline_exceeded(request, attribute_name)
+            self.run_batches(batch, attribute_name)
+        return self.wait(pending, request, attribute_name)
+
+    def collect_batch(self, remaining_time: Optional[float]) -> List[Tuple[Any, PendingFetch]]:
+        """
+        Waits for the batch window (or the full batch), but not longer than the leader request remaining time
+        :return: Collected keys and their fetches
+        """
+        timeout = self.provider.batch_window
+        if remaining_time is not None:
+            timeout = min(timeout, remaining_time)
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._batch) >= self.provider.max_batch_size, timeout=timeout)
+            batch, self._batch = self._batch, []
+        return batch
+
+    def run_batches(self, batch: List[Tuple[Any, PendingFetch]], attribute_name: str) -> None:
+        """
+        Fetches all collected keys (in chunks of the maximal batch size)
+        """
+        max_batch_size = self.provider.max_batch_size
+        for start in range(0, len(batch), max_batch_size):
+            chunk = batch[start:start + max_batch_size]
+            attributes_list = [pending.attributes for _, pending in chunk]
+            try:
+                self._count_call(batch=True)
+                if self.guard is None:
+                    results = self.provider.fetch_many(attributes_list)
+                else:
+                    results = self.guard.call(
+                        lambda: self.provider.fetch_many(attributes_list),
+                        attribute_name,
+                        [self.provider.fallback_value] * len(chunk)
+                    )
+                if len(results) != len(chunk):
+                    raise ValueError(
+                        f"Information provider {self.provider.__name__} returned {len(results)} values "
+                        f"for {len(chunk)} keys."
+                    )
+                for (_, pending), result in zip(chunk, results):
+                    pending.set_result(result)
+            except BaseException as e:
+                for _, pending in chunk:
+                    pending.set_error(e)
+            finally:
+                self._forget([key for key, _ in chunk])
+
+    def wait(self, pending: PendingFetch, request, attribute_name: str) -> Any:
+        if not pending.done.wait(request.get_remaining_time()):
+            self.raise_deadline_exceeded(request, attribute_name)
+        return self.get_result(pending)
+
+    @staticmethod
+    def raise_deadline_exceeded(request, attribute_name: str) -> None:
+        request.deadline_exceeded = True
+        raise DeadlineExceededException(
+            attribute_name=attribute_name,
+            message=f"Attribute `{attribute_name}` was not fetched: request deadline exceeded."
+        )
+
+    @staticmethod
+    def get_result(pending: PendingFetch) -> Any:
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _count_call(self, batch: bool = False) -> None:
+        with self._condition:
+            self.counters['provider_calls'] += 1
+            if batch:
+                self.counters['batches'] += 1
+
+    def _forget(self, keys: List[Any]) -> None:
+        # Completed fetches are not cached: next request with the same key calls the provider again
+        with self._condition:
+            for key in keys:
+                self._fetches.pop(key, None)
+
+    def get_metrics(self) -> Dict[str, int]:
+        with self._condition:
+            return dict(self.counters)
+# EOF
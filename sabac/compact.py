@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Memory-compact representation of policy data
+
+Large policy trees (100k+ rules) repeat the same attribute names and constants many times:
+- strings are interned, so every attribute name or string constant is stored once;
+- targets and conditions are stored as Constraints: a tuple of attribute names shared by all elements
+  with the same set of names and a tuple of their constraints;
+- identical obligations and advices are shared (see Action.get_shared);
+- policy element classes have __slots__ (see utils.add_slots).
+
+Benchmark: examples/memory_benchmark.py
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import sys
+from collections.abc import ItemsView, Mapping
+from typing import Any, Dict, Iterator, Tuple
+
+# Shared attribute name tuples
+_names: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+
+def intern_value(value: Any) -> Any:
+    """
+    Returns JSON-like value with all strings (including dict keys) interned
+    """
+    value_type = type(value)
+    if value_type is str:
+        return sys.intern(value)
+    elif value_type is dict:
+        return {intern_value(key): intern_value(item) for key, item in value.items()}
+    elif value_type is list:
+        return [intern_value(item) for item in value]
+    return value
+
+
+class ConstraintsItemsView(ItemsView):
+    """
+    Items view of Constraints that iterates names and constraints tuples directly
+    """
+    __slots__ = ()
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        return zip(self._mapping.names, self._mapping.constraints)
+
+
+class Constraints(Mapping):
+    """
+    Read-only mapping of attribute names to constraints (policy element target or rule condition)
+    """
+    __slots__ = ('names', 'constraints')
+
+    def __init__(self, requirements: Mapping):
+        names = tuple(intern_value(name) for name in requirements)
+        self.names = _names.setdefault(names, names)
+        self.constraints = tuple(intern_value(constraint) for constraint in requirements.values())
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return self.constraints[self.names.index(name)]
+        except ValueError:
+            raise KeyError(name) from None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def items(self) -> ConstraintsItemsView:
+        # Faster than the generic items view: used for every target check
+        return ConstraintsItemsView(self)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+# EOF
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Policy coverage measurement
+
+Records for every rule, policy and policy set:
+- how many times its target matched and did not match;
+- how many times its condition was true and false (rules only);
+- how many times its result was the final decision of its parent.
+Counters are kept in compact arrays indexed by element slots assigned when the tree is bound.
+Paths are computed from the current tree when counters are reported, so they follow children
+reordered during evaluation (e.g. by AdaptiveOrdering).
+Coverage could be sampled, merged (e.g. from several processes) and exported as JSON
+or as an annotated copy of the policy JSON.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import random
+from array import array
+from typing import Any, Dict, List
+
+COVERAGE_COUNTERS = ['target_matched', 'target_not_matched', 'condition_true', 'condition_false', 'decisive']
+
+TARGET_MATCHED, TARGET_NOT_MATCHED, CONDITION_TRUE, CONDITION_FALSE, DECISIVE = range(len(COVERAGE_COUNTERS))
+
+ROOT_PATH = '#'
+
+
+def iter_elements(element, path: str = ROOT_PATH):
+    """
+    Yields (path, element) pairs for an element and all its descendants in document order
+    """
+    yield path, element
+    children_name = 'items' if element.element_type == 'policy_set' else 'rules'
+    for index, child in enumerate(getattr(element, 'children', [])):
+        yield from iter_elements(child, f"{path}/{children_name}/{index}")
+
+
+class PolicyCoverage:
+    """
+    Counters are updated without locking, so they are approximate under concurrent evaluation.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        """
+        :param sample_rate: Part of requests (0..1) that are recorded
+        """
+        self.sample_rate = sample_rate
+        self.sampled_requests = 0
+        self.root = None
+        # Counter slots by element ID
+        self._slots: Dict[int, int] = {}
+        self._counters: List[array] = [array('Q') for _ in COVERAGE_COUNTERS]
+
+    def bind(self, root) -> None:
+        """
+        Maps elements of a policy tree to counters.
+        Counters collected for the previous tree are kept for elements with the same path.
+        """
+        previous = self.get_counters()
+        self.root = root
+        self._slots = {}
+        for _, element in iter_elements(root):
+            self._slots.setdefault(element.element_id, len(self._slots))
+        self._counters = [array('Q', bytes(8 * len(self._slots))) for _ in COVERAGE_COUNTERS]
+        self.add_counters(previous)
+
+    def iter_slots(self):
+        """
+        Yields (path, element, slot) for elements of the current tree
+        """
+        if self.root is None:
+            return
+        for path, element in iter_elements(self.root):
+            slot = self._slots.get(element.element_id)
+            if slot is not None:
+                yield path, element, slot
+
+    def start_request(self, root) -> bool:
+        """
+        Decides if request should be recorded
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if root is not self.root:
+            self.bind(root)
+        self.sampled_requests += 1
+        return True
+
+    def record(self, element, counter: int) -> None:
+        slot = self._slots.get(element.element_id)
+        if slot is not None:
+            self._counters[counter][slot] += 1
+
+    def record_target(self, element, matched: bool) -> None:
+        self.record(element, TARGET_MATCHED if matched else TARGET_NOT_MATCHED)
+
+    def record_condition(self, element, value: bool) -> None:
+        self.record(element, CONDITION_TRUE if value else CONDITION_FALSE)
+
+    def record_decision(self, element) -> None:
+        self.record(element, DECISIVE)
+
+    def reset(self) -> None:
+        self.sampled_requests = 0
+        self._counters = [array('Q', bytes(8 * len(self._slots))) for _ in COVERAGE_COUNTERS]
+
+    # Export and merging
+
+    def get_counters(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for path, element, slot in self.iter_slots():
+            element_counters = {'description': element.description}
+            for counter, counter_name in enumerate(COVERAGE_COUNTERS):
+                element_counters[counter_name] = self._counters[counter][slot]
+            result[path] = element_counters
+        return result
+
+    def add_counters(self, counters: Dict[str, Dict[str, Any]]) -> None:
+        slots = {path: slot for path, _, slot in self.iter_slots()}
+        for path, element_counters in counters.items():
+            slot = slots.get(path)
+            if slot is None:
+                continue
+            for counter, counter_name in enumerate(COVERAGE_COUNTERS):
+                self._counters[counter][slot] += element_counters.get(counter_name, 0)
+
+    def merge(self, other: "PolicyCoverage") -> None:
+        """
+        Adds counters of another coverage (e.g. collected by another process) to this one
+        """
+        self.sampled_requests += other.sampled_requests
+        self.add_counters(other.get_counters())
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'sampled_requests': self.sampled_requests,
+            'elements': self.get_counters(),
+        }
+
+    def merge_json(self, json_data: Dict[str, Any]) -> None:
+        """
+        Adds counters from a coverage report (see to_json)
+        """
+        self.sampled_requests += json_data.get('sampled_requests', 0)
+        self.add_counters(json_data.get('elements', {}))
+
+    def get_uncovered(self) -> List[str]:
+        """
+        :return: Paths of elements that were never decisive
+        """
+        return [
+            path for path, _, slot in self.iter_slots()
+            if self._counters[DECISIVE][slot] == 0
+        ]
+
+    def annotate(self) -> Dict[str, Any]:
+        """
+        Returns policy JSON with coverage counters added to every element as '_coverage'
+        """
+        return self._annotate(self.root, ROOT_PATH, self.get_counters())
+
+    def _annotate(self, element, path: str, counters: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        result = element.to_json()
+        children_name = 'items' if element.element_type == 'policy_set' else 'rules'
+        children = getattr(element, 'children', [])
+        if children:
+            result[children_name] = [
+                self._annotate(child, f"{path}/{children_name}/{index}", counters)
+                for index, child in enumerate(children)
+            ]
+        element_counters = dict(counters.get(path, {}))
+        element_counters.pop('description', None)
+        result['_coverage'] = element_counters
+        return result
+# EOF
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SQLite-backed Policy Administration Point
+
+Top-level items of the root policy set are stored in a SQLite database as JSON.
+Every item is indexed by the first indexed attribute (e.g. 'subject.role', 'resource.type' or 'action')
+that its target requires to be equal to a constant (or to be in a list of constants).
+Items without such constraints are candidates for every request.
+
+For every request only candidate items are loaded (and kept in an LRU cache).
+Other items can not be applicable to the request, so they are replaced with NotApplicableElement placeholders
+(see sharding module): decisions are identical to the fully loaded tree for order-insensitive root algorithms.
+Candidate items are combined in the order they were added, like items of PolicySet.
+If optimization is enabled, every item is optimized when it is loaded (see optimizer.optimize_items).
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .algorithm import deny_unless_permit, get_algorithm_name
+from .exceptions import AttributeUnavailableException
+from .optimizer import OptimizationReport, optimize_items
+from .PAP import PAP
+from .policy_element import NotApplicableElement
+from .policy_set import PolicySet
+from .response import Response
+from .sharding import MAX_PLACEHOLDERS, normalize_shard_value
+
+DEFAULT_INDEXED_ATTRIBUTES = ('subject.id', 'subject.role', 'resource.type', 'action')
+
+# Maximal number of SQL query parameters (SQLite limit for old versions is 999)
+MAX_QUERY_PARAMETERS = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS policies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS policy_index (
+    policy_id INTEGER NOT NULL REFERENCES policies(id) ON DELETE CASCADE,
+    attribute TEXT,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS policy_index_lookup ON policy_index(attribute, value);
+CREATE INDEX IF NOT EXISTS policy_index_policy ON policy_index(policy_id);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def get_index_entries(item_data: dict, indexed_attributes: Sequence[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    :return: (attribute, normalized value) pairs of the item. [(None, None)] if item is not indexed.
+    """
+    target = item_data.get('target')
+    if isinstance(target, dict):
+        for attribute in indexed_attributes:
+            if attribute not in target:
+                continue
+            constraint = target[attribute]
+            if isinstance(constraint, dict) and list(constraint) == ['@in'] and isinstance(constraint['@in'], list):
+                values = constraint['@in']
+            elif isinstance(constraint, (dict, list)):
+                continue
+            else:
+                values = [constraint]
+            normalized_values = [normalize_shard_value(value) for value in values]
+            if None not in normalized_values:
+                return [(attribute, value) for value in sorted(set(normalized_values))]
+    return [(None, None)]
+
+
+class DatabaseRootPolicySet(PolicySet):
+    """
+    Root policy set that combines its own (in-memory) items with candidate items of the database
+    """
+    database_pap: Optional["SQLitePAP"] = None
+
+    def get_request_items(self, request) -> list:
+        return self.items + self.database_pap.get_request_items(request)
+
+    def evaluate(self, request) -> Response:
+        try:
+            return PolicySet.evaluate(self, request)
+        except AttributeUnavailableException as e:  # pragma: no cover
+            logging.warning(f"Candidate policies of the request could not be determined: {e.message}")
+            return Response(request, decision=self.indeterminate_decision)
+
+
+class SQLitePAP(PAP):
+    def __init__(
+        self,
+        database: str = ':memory:',
+        algorithm=deny_unless_permit,
+        indexed_attributes: Sequence[str] = DEFAULT_INDEXED_ATTRIBUTES,
+        max_cached: Optional[int] = 10000,
+        optimize: bool = False
+    ):
+        """
+        :param database: SQLite database file name
+        :param algorithm: Root policy set algorithm
+        :param indexed_attributes: Attributes used for candidate lookup, in order of preference
+        :param max_cached: Maximal number of loaded items kept in memory (None - not limited)
+        :param optimize: Optimize items when they are loaded (see optimizer module)
+        """
+        PAP.__init__(self, algorithm=algorithm)
+        self.root_policy_set = DatabaseRootPolicySet(algorithm=algorithm)
+        self.root_policy_set.database_pap = self
+        self.database = database
+        self.indexed_attributes = tuple(indexed_attributes)
+        self.max_cached = max_cached
+        self.optimize_on_load = optimize
+        # Changes made by optimizer in all loaded items
+        self.optimization_report = OptimizationReport()
+        self.statistics = {'queries': 0, 'candidates': 0, 'loads': 0, 'hits': 0}
+        # Connection is shared by threads, so it is used only with the database lock held
+        self._database_lock = threading.RLock()
+        self._connection = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        self._transaction_depth = 0
+        # IDs of items changed by the current transaction (None - all items)
+        self._changed_ids: Optional[set] = set()
+        self._cache: "OrderedDict[int, Any]" = OrderedDict()
+        # Data that depends only on the policy version
+        self._cached_version = None
+        self._item_count = 0
+        self._index_attributes: List[str] = []
+        self._placeholders = [
+            NotApplicableElement(description="Policies that are not candidates") for _ in range(MAX_PLACEHOLDERS)
+        ]
+        self.create_schema()
+
+    def create_schema(self) -> None:
+        with self._database_lock:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    self._connection.execute(statement)
+            row = self._connection.execute("SELECT value FROM settings WHERE name = 'indexed_attributes'").fetchone()
+            if row is None or json.loads(row[0]) != list(self.indexed_attributes):
+                self.reindex()
+
+    # Updates
+
+    @contextmanager
+    def transaction(self) -> Iterator["SQLitePAP"]:
+        """
+        Groups updates: they are applied together when the block exits or discarded if it raises an exception.
+        Evaluations wait until the transaction is finished.
+        """
+        with self._database_lock:
+            if self._transaction_depth == 0:
+                self._connection.execute('BEGIN')
+            self._transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._connection.execute('ROLLBACK')
+                    self._invalidate()
+                raise
+            else:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._connection.execute('COMMIT')
+                    self._invalidate()
+
+    def _invalidate(self) -> None:
+        # Items that were not changed stay cached
+        if self._changed_ids is None:
+            self._cache = OrderedDict()
+        else:
+            for policy_id in self._changed_ids:
+                self._cache.pop(policy_id, None)
+        self._changed_ids = set()
+        self._cached_version = None
+        self.version += 1
+
+    def _insert(self, item_data: dict) -> int:
+        cursor = self._connection.execute('INSERT INTO policies (data) VALUES (?)', (json.dumps(item_data),))
+        policy_id = cursor.lastrowid
+        self._index(policy_id, item_data)
+        return policy_id
+
+    def _index(self, policy_id: int, item_data: dict) -> None:
+        self._connection.executemany(
+            'INSERT INTO policy_index (policy_id, attribute, value) VALUES (?, ?, ?)',
+            [(policy_id, attribute, value) for attribute, value in get_index_entries(item_data, self.indexed_attributes)]
+        )
+
+    @staticmethod
+    def validate_item(item_data: Any) -> dict:
+        if not isinstance(item_data, dict) or ('rules' not in item_data and 'items' not in item_data):
+            raise ValueError(f"Policy or policy set expected, got: {item_data}.")
+        return item_data
+
+    def add_item(self, data: dict) -> int:
+        """
+        :return: ID of the stored item
+        """
+        with self.transaction():
+            return self._insert(self.validate_item(data))
+
+    def add_items(self, data_list: List[dict]) -> List[int]:
+        """
+        :return: IDs of the stored items
+        """
+        with self.transaction():
+            return [self._insert(self.validate_item(data)) for data in data_list]
+
+    def update_item(self, policy_id: int, data: dict) -> None:
+        with self.transaction():
+            cursor = self._connection.execute(
+                'UPDATE policies SET data = ? WHERE id = ?', (json.dumps(self.validate_item(data)), policy_id)
+            )
+            if cursor.rowcount == 0:
+                raise ValueError(f"Policy {policy_id} does not exist.")
+            self._mark_changed(policy_id)
+            self._connection.execute('DELETE FROM policy_index WHERE policy_id = ?', (policy_id,))
+            self._index(policy_id, data)
+
+    def remove_item(self, policy_id: int) -> None:
+        with self.transaction():
+            cursor = self._connection.execute('DELETE FROM policies WHERE id = ?', (policy_id,))
+            if cursor.rowcount == 0:
+                raise ValueError(f"Policy {policy_id} does not exist.")
+            self._mark_changed(policy_id)
+
+    def _mark_changed(self, policy_id: int) -> None:
+        if self._changed_ids is not None:
+            self._changed_ids.add(policy_id)
+
+    def get_item_data(self, policy_id: int) -> dict:
+        with self._database_lock:
+            row = self._connection.execute('SELECT data FROM policies WHERE id = ?', (policy_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Policy {policy_id} does not exist.")
+        return json.loads(row[0])
+
+    def reindex(self) -> None:
+        """
+        Rebuilds index (e.g. after indexed attributes were changed)
+        """
+        with self.transaction():
+            self._connection.execute('DELETE FROM policy_index')
+            for policy_id, data in self._connection.execute('SELECT id, data FROM policies').fetchall():
+                self._index(policy_id, json.loads(data))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO settings (name, value) VALUES ('indexed_attributes', ?)",
+                (json.dumps(list(self.indexed_attributes)),)
+            )
+
+    # Import and export
+
+    def import_json(self, data: Union[dict, list, str], replace: bool = False) -> int:
+        """
+        Imports items of a root policy set in JSON format (dict with items, list of items or JSON string)
+        :param replace: Remove all stored items first
+        :return: Number of imported items
+        """
+        if isinstance(data, str):
+            data = json.loads(data)
+        items = data.get('items', []) if isinstance(data, dict) else data
+        with self.transaction():
+            if replace:
+                self._connection.execute('DELETE FROM policies')
+                self._changed_ids = None
+            for item_data in items:
+                self._insert(self.validate_item(item_data))
+        return len(items)
+
+    def import_file(self, file_name: str, encoding: str = 'UTF-8', replace: bool = False) -> int:
+        with open(file_name, encoding=encoding) as json_file:
+            return self.import_json(json.load(json_file), replace=replace)
+
+    def iter_items(self) -> Iterator[Tuple[int, dict]]:
+        """
+        :return: Iterator of (ID, JSON data) of stored items in order they are combined
+        """
+        last_id = 0
+        while True:
+            with self._database_lock:
+                rows = self._connection.execute(
+                    'SELECT id, data FROM policies WHERE id > ? ORDER BY id LIMIT ?', (last_id, MAX_QUERY_PARAMETERS)
+                ).fetchall()
+            if not rows:
+                return
+            for policy_id, data in rows:
+                yield policy_id, json.loads(data)
+            last_id = rows[-1][0]
+
+    def export_json(self) -> dict:
+        """
+        :return: Root policy set in JSON format
+        """
+        result = self.root_policy_set.to_json()
+        result['algorithm'] = get_algorithm_name(self.root_policy_set.algorithm)
+        result['items'] = result.get('items', []) + [data for _, data in self.iter_items()]
+        return result
+
+    # Evaluation
+
+    def _refresh(self) -> None:
+        # Called with the database lock held
+        if self._cached_version != self.version:
+            self._item_count = self._connection.execute('SELECT COUNT(*) FROM policies').fetchone()[0]
+            self._index_attributes = [
+                row[0] for row in self._connection.execute(
+                    'SELECT DISTINCT attribute FROM policy_index WHERE attribute IS NOT NULL'
+                )
+            ]
+            self._cached_version = self.version
+
+    def get_request_values(self, request, attributes: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        :return: Normalized request values of indexed attributes (None if value could not be used for lookup).
+            Attributes with None value are omitted: items indexed by them are not applicable.
+        """
+        result = {}
+        for attribute in attributes:
+            try:
+                value = request.PDP.PIP.get_attribute_value(attribute, request)
+            except AttributeUnavailableException:
+                # Items indexed by the attribute are evaluated and report it themselves
+                result[attribute] = None
+                continue
+            request.attributes[attribute] = value
+            if value is not None:
+                result[attribute] = normalize_shard_value(value)
+        return result
+
+    def get_candidate_ids(self, request) -> List[int]:
+        with self._database_lock:
+            self._refresh()
+            attributes = list(self._index_attributes)
+        values = self.get_request_values(request, attributes)
+
+        queries = ['SELECT policy_id FROM policy_index WHERE attribute IS NULL']
+        parameters = []
+        for attribute, value in values.items():
+            if value is None:
+                queries.append('SELECT policy_id FROM policy_index WHERE attribute = ?')
+                parameters.append(attribute)
+            else:
+                queries.append('SELECT policy_id FROM policy_index WHERE attribute = ? AND value = ?')
+                parameters.extend((attribute, value))
+        with self._database_lock:
+            self.statistics['queries'] += 1
+            return [
+                row[0] for row in self._connection.execute(
+                    f"SELECT DISTINCT policy_id FROM ({' UNION ALL '.join(queries)}) ORDER BY policy_id", parameters
+                )
+            ]
+
+    def load_items(self, policy_ids: List[int]) -> list:
+        """
+        :return: Items with given IDs (loaded from the database if they are not cached)
+        """
+        with self._database_lock:
+            version = self.version
+            items = {}
+            for policy_id in policy_ids:
+                item = self._cache.get(policy_id)
+                if item is not None:
+                    self._cache.move_to_end(policy_id)
+                    items[policy_id] = item
+            self.statistics['hits'] += len(items)
+            missing_ids = [policy_id for policy_id in policy_ids if policy_id not in items]
+            rows = []
+            for start in range(0, len(missing_ids), MAX_QUERY_PARAMETERS):
+                chunk = missing_ids[start:start + MAX_QUERY_PARAMETERS]
+                rows += self._connection.execute(
+                    f"SELECT id, data FROM policies WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall()
+
+        # Items are built without the lock
+        loaded_items = {policy_id: PolicySet.create_policy_item(json.loads(data)) for policy_id, data in rows}
+        report = optimize_items(list(loaded_items.values())) if self.optimize_on_load and loaded_items else None
+        items.update(loaded_items)
+        with self._database_lock:
+            if report is not None:
+                self.optimization_report.merge(report)
+            self.statistics['loads'] += len(loaded_items)
+            if version == self.version:
+                self._cache.update(loaded_items)
+                while self.max_cached is not None and len(self._cache) > self.max_cached:
+                    self._cache.popitem(last=False)
+        return [items[policy_id] for policy_id in policy_ids if policy_id in items]
+
+    def get_request_items(self, request) -> list:
+        """
+        :return: Candidate items of the request followed by placeholders for other items
+        """
+        candidate_ids = self.get_candidate_ids(request)
+        items = self.load_items(candidate_ids)
+        with self._database_lock:
+            self.statistics['candidates'] += len(items)
+            excluded = self._item_count - len(items)
+        return items + self._placeholders[:min(max(excluded, 0), MAX_PLACEHOLDERS)]
+
+    def get_statistics(self) -> Dict[str, Any]:
+        with self._database_lock:
+            self._refresh()
+            result = dict(self.statistics)
+            result['items'] = self._item_count
+            result['cached_items'] = len(self._cache)
+        return result
+
+    def close(self) -> None:
+        with self._database_lock:
+            self._connection.close()
+
+    def optimize(self) -> OptimizationReport:
+        """
+        Enables optimization of items. Cached items are dropped, so they are optimized when they are loaded again.
+        :return: Report of the changes made by optimizer in loaded items (it is updated by later loads)
+        """
+        with self._database_lock:
+            self.optimize_on_load = True
+            self._cache.clear()
+            self.version += 1
+        return self.optimization_report
+# EOF
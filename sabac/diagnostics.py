@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Aggregated diagnostics of attributes that PIP could not resolve
+
+Every occurrence is counted, but a warning is logged only for the first occurrence of an attribute
+and then at most once per report interval, so misconfigured policies do not flood logs.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+@dataclass
+class MissingAttribute:
+    attribute_name: str
+    count: int = 0
+    # Count at the moment of the last logged report
+    reported_count: int = 0
+    first_seen: float = 0.0
+    last_seen: float = 0.0
+    last_reported: float = 0.0
+    # Names of request attributes and attribute fetch stack of the first occurrence
+    first_context: List[str] = field(default_factory=list)
+    first_fetch_stack: Optional[List[str]] = None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'attribute_name': self.attribute_name,
+            'count': self.count,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'first_context': self.first_context,
+            'first_fetch_stack': self.first_fetch_stack,
+        }
+
+
+class AttributeDiagnostics:
+    def __init__(self, report_interval: float = 60.0, level: int = logging.WARNING):
+        """
+        :param report_interval: Minimal time in seconds between log reports for the same attribute
+        :param level: Logging level of reports
+        """
+        self.report_interval = report_interval
+        self.level = level
+        self._missing: Dict[str, MissingAttribute] = {}
+        self._lock = threading.Lock()
+
+    def record_missing(self, attribute_name: str, request, attribute_fetch_stack: Optional[List[str]] = None) -> None:
+        """
+        Counts an occurrence of unresolvable attribute
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._missing.get(attribute_name)
+            if entry is None:
+                entry = self._missing[attribute_name] = MissingAttribute(
+                    attribute_name=attribute_name,
+                    first_seen=now,
+                    first_context=sorted(str(key) for key in request.attributes),
+                    first_fetch_stack=list(attribute_fetch_stack) if attribute_fetch_stack else None,
+                )
+            entry.count += 1
+            entry.last_seen = now
+            if entry.reported_count and now - entry.last_reported < self.report_interval:
+                return
+            occurrences = entry.count - entry.reported_count
+            total = entry.reported_count = entry.count
+            entry.last_reported = now
+
+        logging.log(
+            self.level,
+            f"No information providers found for attribute '{attribute_name}' "
+            f"({occurrences} occurrence(s) since the last report, {total} in total). "
+            f"First seen with request attributes: {entry.first_context}, "
+            f"attribute fetch stack: {entry.first_fetch_stack}."
+        )
+
+    def get_missing_attributes(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: Statistics of unresolvable attributes by attribute name
+        """
+        with self._lock:
+            return {name: entry.to_json() for name, entry in self._missing.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._missing = {}
+# EOF
@@ -20,4 +20,21 @@ from .constants import TestFailReasons
 class TestFailedException(Exception):
     reason: TestFailReasons
     message: str
+
+
+@dataclass()
+class AttributeUnavailableException(Exception):
+    """
+    Attribute value could not be determined (e.g. information provider failed).
+    Policy element that requires such attribute is evaluated as indeterminate.
+    """
+    attribute_name: str
+    message: str
+
+
+@dataclass()
+class DeadlineExceededException(AttributeUnavailableException):
+    """
+    Attribute was not fetched because the request deadline was exceeded
+    """
 # EOF
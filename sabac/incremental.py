@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental evaluation of request streams
+
+Requests of a stream often differ by a few attributes (e.g. one subject checks many resources).
+Evaluation context remembers outcomes of targets and conditions together with the attributes they depend on
+(attributes read during the match, attributes required by their providers and objects that contain them).
+When the next request changes some attributes, only outcomes that depend on them are dropped,
+other outcomes (and attributes resolved by PIP) are reused without evaluation.
+
+Attribute values are compared with the previous request values, so objects passed as attribute values
+should not be modified in place between requests. Provider values are considered stable within the context.
+Outcomes are dropped when policies are changed.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import threading
+from collections import ChainMap
+from collections.abc import Mapping
+from typing import Any, Dict, Optional, Set, Tuple
+
+from .policy_element import PolicyElement
+from .response import Response
+
+
+class RecordingAttributes(ChainMap):
+    """
+    Request attributes that record names of attributes read by the current thread
+    """
+
+    def __init__(self, *maps):
+        ChainMap.__init__(self, *maps)
+        self._local = threading.local()
+
+    def start_recording(self) -> Optional[set]:
+        """
+        :return: Names recorded by the outer recording (restored by stop_recording)
+        """
+        previous = getattr(self._local, 'reads', None)
+        self._local.reads = set()
+        return previous
+
+    def stop_recording(self, previous: Optional[set]) -> set:
+        """
+        :return: Names of attributes read since start_recording
+        """
+        reads = self._local.reads
+        self._local.reads = previous
+        if previous is not None:
+            previous |= reads
+        return reads
+
+    def __getitem__(self, key):
+        reads = getattr(self._local, 'reads', None)
+        if reads is not None:
+            reads.add(key)
+        return ChainMap.__getitem__(self, key)
+
+    def __contains__(self, key):
+        reads = getattr(self._local, 'reads', None)
+        if reads is not None:
+            reads.add(key)
+        return ChainMap.__contains__(self, key)
+
+
+class EvaluationContext:
+    """
+    Evaluation context of a request stream (see module description).
+    Context evaluates one request at a time.
+    """
+
+    def __init__(self, pdp):
+        """
+        :param pdp: Policy Decision Point
+        """
+        self.pdp = pdp
+        # Original and resolved attributes of the previous request
+        self._attributes: Optional[dict] = None
+        self._resolved: dict = {}
+        # Outcomes by requirements (target or condition) id: requirements, match result
+        self._outcomes: Dict[int, Tuple[Any, bool]] = {}
+        # Ids of requirements with outcomes by names of attributes they depend on
+        self._dependents: Dict[str, Set[int]] = {}
+        self._dependencies: Dict[str, Set[str]] = {}
+        self._policies: Optional[tuple] = None
+        # Numbers of reused and evaluated outcomes
+        self.reused = 0
+        self.evaluated = 0
+
+    def reset(self) -> None:
+        """
+        Drops all outcomes and resolved attributes
+        """
+        self._attributes = None
+        self._resolved = {}
+        self._outcomes = {}
+        self._dependents = {}
+        self._dependencies = {}
+
+    def get_dependencies(self, attribute_name: str) -> Set[str]:
+        dependencies = self._dependencies.get(attribute_name)
+        if dependencies is None:
+            dependencies = self._dependencies[attribute_name] = \
+                self.pdp.PIP.get_attribute_dependencies(attribute_name)
+        return dependencies
+
+    def get_changed_attributes(self, attributes: Mapping) -> Set[str]:
+        """
+        :return: Names of attributes that were added, removed or changed since the previous request
+        """
+        previous = self._attributes
+        result = set()
+        for name in previous.keys() | attributes.keys():
+            if name not in previous or name not in attributes:
+                result.add(name)
+            elif previous[name] is not attributes[name] and previous[name] != attributes[name]:
+                result.add(name)
+        return result
+
+    def invalidate(self, changed: Set[str]) -> None:
+        """
+        Drops outcomes that depend on the changed attributes
+        """
+        outcomes = self._outcomes
+        for name in changed:
+            for key in self._dependents.pop(name, ()):
+                outcomes.pop(key, None)
+
+    def start_request(self, request) -> None:
+        """
+        Prepares request for evaluation in the context
+        """
+        pap = self.pdp.PAP
+        policies = (pap.root_policy_set, getattr(pap, 'version', None))
+        resolved = {}
+        if self._policies is None or policies[0] is not self._policies[0] or policies[1] != self._policies[1]:
+            self.reset()
+            self._policies = policies
+        elif self._attributes is not None:
+            changed = self.get_changed_attributes(request.context)
+            self.invalidate(changed)
+            for name, value in self._resolved.items():
+                if name not in request.context and self.get_dependencies(name).isdisjoint(changed):
+                    resolved[name] = value
+        request.attributes = RecordingAttributes(resolved, request.context)
+        request.evaluation_context = self
+
+    def evaluate(self, request, deadline: Optional[float] = None) -> Response:
+        """
+        Same as PDP.evaluate, but reuses outcomes of the previous requests of the context
+        """
+        self.start_request(request)
+        try:
+            return self.pdp.evaluate(request, deadline)
+        finally:
+            self._attributes = dict(request.context)
+            self._resolved = dict(request.resolved_attributes)
+
+    def match(self, requirements: Mapping, request) -> bool:
+        """
+        Same as PolicyElement.context_match, but reuses the outcome if attributes it depends on were not changed
+        """
+        key = id(requirements)
+        outcome = self._outcomes.get(key)
+        if outcome is not None and outcome[0] is requirements:
+            self.reused += 1
+            return outcome[1]
+
+        attributes = request.attributes
+        previous = attributes.start_recording()
+        try:
+            result = PolicyElement.context_match(requirements, request)
+        finally:
+            reads = attributes.stop_recording(previous)
+        self.evaluated += 1
+        # Shared requirements that were matched earlier in this request are taken from the match cache
+        # without reading attributes, so their dependencies are unknown
+        if reads:
+            dependents = self._dependents
+            for name in reads:
+                for dependency in self.get_dependencies(name):
+                    dependents.setdefault(dependency, set()).add(key)
+            self._outcomes[key] = (requirements, result)
+        return result
+# EOF
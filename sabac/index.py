@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Indexes of policy set items by target constraints
+
+Policy set with many items indexes them by the attribute that most of the item targets constrain.
+For a request only candidate items (items whose constraint of the indexed attribute may match the request value)
+and items that do not constrain the indexed attribute are combined (in document order).
+Index uses only attribute values present in the request (or contained in request objects): if the value
+should be fetched from a provider, all items are combined, so index does not add provider calls.
+Other items are not applicable, so they are replaced with NotApplicableElement placeholders
+(see policy_element.MAX_PLACEHOLDERS).
+
+Indexes are not used when coverage is recorded, so coverage statistics include all items.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .operator_evaluators import get_order_kind, get_order_value
+from .policy_element import MAX_PLACEHOLDERS, NotApplicableElement
+from .utils import get_object_by_path
+
+# Policy sets with fewer items are not indexed
+MIN_INDEXED_ITEMS = 8
+
+_placeholders = [NotApplicableElement(description="Items excluded by index") for _ in range(MAX_PLACEHOLDERS)]
+
+REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+GLOB_SPECIAL_CHARACTERS = frozenset('*?[')
+
+
+def get_glob_prefix(pattern: str) -> str:
+    """
+    :return: Literal prefix of values matched by a shell-style pattern
+    """
+    for position, character in enumerate(pattern):
+        if character in GLOB_SPECIAL_CHARACTERS:
+            return pattern[:position]
+    return pattern
+
+
+def get_regex_prefix(pattern: str) -> str:
+    """
+    :return: Literal prefix of values matched by a regular expression (empty if the expression is not anchored)
+    """
+    if not pattern.startswith('^') or '|' in pattern:
+        return ''
+    for position in range(1, len(pattern)):
+        character = pattern[position]
+        if character in REGEX_SPECIAL_CHARACTERS:
+            if character in '*?{':
+                # Previous character is optional
+                position -= 1
+            return pattern[1:max(position, 1)]
+    return pattern[1:]
+
+
+class ItemIndex:
+    """
+    Base class of indexes. Not specialized instance does not filter items.
+    """
+
+    def __init__(self, items: list, attribute: Optional[str] = None):
+        self.items = items
+        self.attribute = attribute
+        # Positions of items that are candidates for any value of the attribute
+        self.unindexed: List[int] = []
+
+    @classmethod
+    def get_keys(cls, constraint: Any) -> Optional[list]:
+        """
+        :return: Index keys of the item constraint or None if the constraint could not be indexed
+        """
+        return None
+
+    def add(self, position: int, keys: list) -> None:
+        raise NotImplementedError()  # pragma: no cover
+
+    def get_positions(self, value: Any) -> Iterable[int]:
+        """
+        :return: Positions of indexed items that may match the attribute value
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    @classmethod
+    def get_indexed_counts(cls, items: list) -> Dict[str, int]:
+        """
+        :return: Number of items that could be indexed by every attribute
+        """
+        result = {}
+        for item in items:
+            target = getattr(item, 'target', None)
+            if target:
+                for attribute, constraint in target.items():
+                    if cls.get_keys(constraint) is not None:
+                        result[attribute] = result.get(attribute, 0) + 1
+        return result
+
+    @classmethod
+    def build(cls, items: list, attribute: str) -> "ItemIndex":
+        index = cls(items, attribute)
+        for position, item in enumerate(items):
+            target = getattr(item, 'target', None)
+            keys = cls.get_keys(target[attribute]) if target and attribute in target else None
+            if keys is None:
+                index.unindexed.append(position)
+            else:
+                index.add(position, keys)
+        return index
+
+    def get_request_items(self, request) -> list:
+        if self.attribute is None:
+            return self.items
+        # Index never fetches attributes from providers: items fetch them (and report failures) themselves
+        attributes = request.attributes
+        if self.attribute in attributes:
+            value = attributes[self.attribute]
+        elif '.' in self.attribute and not request.PDP.PIP.get_providers(self.attribute):
+            value = get_object_by_path(attributes, self.attribute.split('.'))
+            if value is None:
+                return self.items
+            # Keeping value in a request because it is used by item targets
+            attributes[self.attribute] = value
+        else:
+            return self.items
+
+        positions = set(self.get_positions(value))
+        positions.update(self.unindexed)
+        result = [self.items[position] for position in sorted(positions)]
+        excluded = len(self.items) - len(result)
+        return result + _placeholders[:min(excluded, MAX_PLACEHOLDERS)]
+
+
+class TrieNode:
+    __slots__ = ('children', 'positions')
+
+    def __init__(self):
+        self.children: Dict[str, TrieNode] = {}
+        self.positions: List[int] = []
+
+
+class PrefixTrieIndex(ItemIndex):
+    """
+    Index of string values by prefixes: equality, @in, @startswith, @glob and anchored @regex constraints
+    """
+
+    def __init__(self, items: list, attribute: Optional[str] = None):
+        ItemIndex.__init__(self, items, attribute)
+        self.root = TrieNode()
+
+    @classmethod
+    def get_keys(cls, constraint: Any) -> Optional[list]:
+        if isinstance(constraint, str):
+            keys = [constraint]
+        elif isinstance(constraint, dict) and len(constraint) == 1:
+            operator, operand = next(iter(constraint.items()))
+            operands = operand if isinstance(operand, list) else [operand]
+            if not operands or not all(isinstance(item, str) for item in operands):
+                return None
+            if operator in ('@in', '@startswith'):
+                keys = operands
+            elif operator == '@glob':
+                keys = [get_glob_prefix(item) for item in operands]
+            elif operator == '@regex':
+                keys = [get_regex_prefix(item) for item in operands]
+            else:
+                return None
+        else:
+            return None
+        # Item with an empty prefix is a candidate for any value
+        return keys if all(keys) else None
+
+    def add(self, position: int, keys: list) -> None:
+        for key in keys:
+            node = self.root
+            for character in key:
+                child = node.children.get(character)
+                if child is None:
+                    child = node.children[character] = TrieNode()
+                node = child
+            node.positions.append(position)
+
+    def get_positions(self, value: Any) -> Iterable[int]:
+        result = []
+        if not isinstance(value, str):
+            return result
+        node = self.root
+        for character in value:
+            node = node.children.get(character)
+            if node is None:
+                break
+            result.extend(node.positions)
+        return result
+
+
+# Interval: lower bound, lower bound is included, upper bound, upper bound is included, item position.
+# None bound means that the interval is not bounded from that side.
+Interval = Tuple[Any, bool, Any, bool, int]
+
+
+def contains(interval: Interval, value: Any) -> bool:
+    lower, lower_included, upper, upper_included, _ = interval
+    if lower is not None and (value < lower or (value == lower and not lower_included)):
+        return False
+    if upper is not None and (value > upper or (value == upper and not upper_included)):
+        return False
+    return True
+
+
+class IntervalNode:
+    """
+    Node of a centered interval tree: intervals that contain the center value are kept in the node,
+    intervals that are below or above it - in the left or the right subtree
+    """
+    __slots__ = ('center', 'by_lower', 'by_upper', 'left', 'right')
+
+    def __init__(self, intervals: List[Interval]):
+        bounds = sorted(bound for interval in intervals for bound in (interval[0], interval[2]) if bound is not None)
+        self.center = center = bounds[len(bounds) // 2]
+        left = [interval for interval in intervals if interval[2] is not None and interval[2] < center]
+        right = [interval for interval in intervals if interval[0] is not None and interval[0] > center]
+        overlapping = [
+            interval for interval in intervals
+            if (interval[2] is None or interval[2] >= center) and (interval[0] is None or interval[0] <= center)
+        ]
+        # Unbounded intervals first, then the ones that include more values
+        self.by_lower = sorted(
+            overlapping, key=lambda interval: (interval[0] is not None, interval[0], not interval[1])
+        )
+        self.by_upper = sorted(
+            overlapping, key=lambda interval: (interval[2] is None, interval[2], interval[3]), reverse=True
+        )
+        self.left = IntervalNode(left) if left else None
+        self.right = IntervalNode(right) if right else None
+
+    def find(self, value: Any, result: List[int]) -> None:
+        """
+        Adds positions of intervals that contain the value to the result
+        """
+        node = self
+        while node is not None:
+            if value < node.center:
+                # Upper bounds of the node intervals are not less than the center
+                for interval in node.by_lower:
+                    if interval[0] is not None and (value < interval[0] or (value == interval[0] and not interval[1])):
+                        break
+                    result.append(interval[4])
+                node = node.left
+            elif value > node.center:
+                for interval in node.by_upper:
+                    if interval[2] is not None and (value > interval[2] or (value == interval[2] and not interval[3])):
+                        break
+                    result.append(interval[4])
+                node = node.right
+            else:
+                result.extend(interval[4] for interval in node.by_lower if contains(interval, value))
+                return
+
+
+class IntervalIndex(ItemIndex):
+    """
+    Index of ordered values by ranges: @gt, @gte, @lt, @lte, @between and numeric equality (or @in) constraints.
+    Lookup time is logarithmic in the number of indexed items (plus the number of found items).
+    """
+
+    def __init__(self, items: list, attribute: Optional[str] = None):
+        ItemIndex.__init__(self, items, attribute)
+        self._intervals: Dict[str, List[Interval]] = {}
+        # Interval trees by value kind (see operator_evaluators.get_order_kind), built on first lookup
+        self._trees: Optional[Dict[str, IntervalNode]] = None
+
+    @classmethod
+    def get_keys(cls, constraint: Any) -> Optional[list]:
+        """
+        :return: (kind, lower bound, lower bound is included, upper bound, upper bound is included) tuples
+        """
+        if isinstance(constraint, (int, float)) and get_order_kind(constraint) is not None:
+            return [('number', constraint, True, constraint, True)]
+        if not isinstance(constraint, dict) or len(constraint) != 1:
+            return None
+        operator, operand = next(iter(constraint.items()))
+        if operator == '@in':
+            if not isinstance(operand, list) or not operand:
+                return None
+            keys = [cls.get_keys(item) for item in operand if get_order_kind(item) == 'number']
+            return [key[0] for key in keys] if len(keys) == len(operand) else None
+        if operator == '@between':
+            if not isinstance(operand, list) or len(operand) != 2:
+                return None
+            lower, upper = operand
+        elif operator in ('@gt', '@gte'):
+            lower, upper = operand, None
+        elif operator in ('@lt', '@lte'):
+            lower, upper = None, operand
+        else:
+            return None
+        kind = get_order_kind(lower if lower is not None else upper)
+        if kind is None or (lower is not None and upper is not None and get_order_kind(upper) != kind):
+            return None
+        lower = get_order_value(lower) if lower is not None else None
+        upper = get_order_value(upper) if upper is not None else None
+        return [(kind, lower, operator != '@gt', upper, operator != '@lt')]
+
+    def add(self, position: int, keys: list) -> None:
+        for kind, lower, lower_included, upper, upper_included in keys:
+            self._intervals.setdefault(kind, []).append((lower, lower_included, upper, upper_included, position))
+        self._trees = None
+
+    def get_positions(self, value: Any) -> Iterable[int]:
+        trees = self._trees
+        if trees is None:
+            trees = self._trees = {kind: IntervalNode(intervals) for kind, intervals in self._intervals.items()}
+        result = []
+        if isinstance(value, bool):
+            # Booleans are equal to numbers (True == 1), but never match range operators
+            value = int(value)
+        tree = trees.get(get_order_kind(value))
+        if tree is not None:
+            tree.find(get_order_value(value), result)
+        return result
+
+
+# Index classes that are tried for every policy set
+INDEX_CLASSES = [PrefixTrieIndex, IntervalIndex]
+
+
+def build_index(items: list) -> ItemIndex:
+    """
+    Builds index by the attribute that allows to index most of the items
+    """
+    best_class = None
+    best_attribute = None
+    best_count = MIN_INDEXED_ITEMS - 1
+    for index_class in INDEX_CLASSES:
+        for attribute, count in index_class.get_indexed_counts(items).items():
+            if count > best_count:
+                best_class, best_attribute, best_count = index_class, attribute, count
+    if best_class is None:
+        return ItemIndex(items)
+    return best_class.build(items, best_attribute)
+# EOF
@@ -11,15 +11,35 @@ __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import Any, ClassVar, Optional, List
 
 
 @dataclass
 class InformationProvider:
     """
         Base class for information providers
+        Protection settings (see resilience module) could be overridden by subclasses.
     """
     provided_attributes: Optional[List] = None
+    required_attributes: ClassVar[List[str]] = []
+
+    # Maximal fetch duration in seconds (None - not limited)
+    timeout: ClassVar[Optional[float]] = None
+    # Maximal number of simultaneous fetches (None - not limited)
+    max_concurrency: ClassVar[Optional[int]] = None
+    # Number of consecutive failures that opens the circuit (None - no circuit breaker)
+    failure_threshold: ClassVar[Optional[int]] = None
+    # Time in seconds before a trial call is allowed for an open circuit
+    recovery_timeout: ClassVar[float] = 30.0
+    # Result of a failed fetch: 'indeterminate' or 'fallback' (fallback_value is used as attribute value)
+    failure_outcome: ClassVar[str] = 'indeterminate'
+    fallback_value: ClassVar[Any] = None
+
+    # Result depends only on required attributes, so concurrent identical fetches may share one call
+    coalesce: ClassVar[bool] = False
+    # Time in seconds to collect fetches for a single fetch_many call (None - no batching)
+    batch_window: ClassVar[Optional[float]] = None
+    max_batch_size: ClassVar[int] = 100
 
     def __init__(self):
         self.provided_attributes = None
@@ -31,4 +51,14 @@ class InformationProvider:
     @classmethod
     def fetch_value(cls, request):
         raise NotImplementedError()
+
+    @classmethod
+    def fetch_many(cls, attributes_list: List[dict]) -> List[Any]:
+        """
+        Fetches values for several sets of required attributes at once (used if batch_window is set).
+        Should be overridden by providers whose backend supports bulk queries.
+        :param attributes_list: Required attribute values for every fetch
+        :return: Values in the same order
+        """
+        return [cls.fetch_value(attributes) for attributes in attributes_list]
 # EOF
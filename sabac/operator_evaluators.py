@@ -10,13 +10,113 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
+import fnmatch
+import functools
 import logging
+import re
 import uuid
+from collections.abc import Mapping
 from types import GeneratorType
-from typing import Optional, Any
+from typing import Any, List, Optional, Pattern
 
 from .request import Request
 
+# Operators with patterns that are compiled when policies are loaded
+PATTERN_OPERATORS = ('@glob', '@regex')
+
+# Ordered comparison operators
+RANGE_OPERATORS = ('@gt', '@gte', '@lt', '@lte', '@between')
+
+# Maximal number of compiled patterns kept in cache (patterns of loaded policies and dynamic ones)
+MAX_COMPILED_PATTERNS = 1024
+
+
+@functools.lru_cache(maxsize=MAX_COMPILED_PATTERNS)
+def _compile_pattern(operator: str, pattern: str) -> Pattern:
+    try:
+        return re.compile(fnmatch.translate(pattern) if operator == '@glob' else pattern)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern of operator {operator} '{pattern}': {e}.") from None
+
+
+def compile_pattern(operator: str, pattern: str) -> Pattern:
+    """
+    Returns compiled pattern of @glob or @regex operator (recently used patterns are cached)
+    May raise exceptions:
+        ValueError - if pattern is invalid
+    """
+    if not isinstance(pattern, str):
+        raise ValueError(f"Pattern of operator {operator} should be a string ({pattern!r} given).")
+    return _compile_pattern(operator, pattern)
+
+
+def get_order_kind(value: Any) -> Optional[str]:
+    """
+    Returns kind of value for ordered comparison: values of different kinds are never compared.
+    Versions are lists (or tuples) of numbers, e.g. [1, 10, 2].
+    """
+    if isinstance(value, bool):
+        return None
+    elif isinstance(value, (int, float)):
+        return 'number'
+    elif isinstance(value, str):
+        return 'string'
+    elif isinstance(value, (list, tuple)) and value and all(get_order_kind(item) == 'number' for item in value):
+        return 'version'
+    return None
+
+
+def get_order_value(value: Any) -> Any:
+    """
+    Returns value that could be compared with other values of the same kind
+    """
+    return tuple(value) if isinstance(value, list) else value
+
+
+def validate_range_operand(operator: str, operand: Any) -> None:
+    """
+    May raise exceptions:
+        ValueError - if operand of a range operator could not be used for ordered comparison
+    """
+    if isinstance(operand, dict):
+        # Expression is calculated during evaluation
+        return
+    if operator == '@between':
+        if not isinstance(operand, list) or len(operand) != 2:
+            raise ValueError(f"Operand of operator @between should be a list of two bounds ({operand!r} given).")
+        if not isinstance(operand[0], dict) and not isinstance(operand[1], dict):
+            if get_order_kind(operand[0]) is None or get_order_kind(operand[0]) != get_order_kind(operand[1]):
+                raise ValueError(f"Bounds of operator @between should be of the same ordered type ({operand!r} given).")
+            if get_order_value(operand[0]) > get_order_value(operand[1]):
+                raise ValueError(f"Lower bound of operator @between is greater than upper bound ({operand!r} given).")
+        else:
+            for bound in operand:
+                validate_range_operand('@gte', bound)
+    elif get_order_kind(operand) is None:
+        raise ValueError(
+            f"Operand of operator {operator} should be a number, a string or a version ({operand!r} given)."
+        )
+
+
+def prepare_constraints(constraint: Any) -> None:
+    """
+    Compiles constant patterns and validates range operands of a target, a condition or a constraint.
+    Patterns that are calculated by expressions are compiled on first use.
+    May raise exceptions:
+        ValueError - if constraint could not be evaluated
+    """
+    if not isinstance(constraint, (dict, Mapping)):
+        return
+    for key, value in constraint.items():
+        if key in PATTERN_OPERATORS:
+            for pattern in (value if isinstance(value, list) else [value]):
+                if not isinstance(pattern, dict):
+                    compile_pattern(key, pattern)
+        elif key in RANGE_OPERATORS:
+            validate_range_operand(key, value)
+        else:
+            prepare_constraints(value)
+
 
 def calculate_operator_eval(
         policy_information_point,
@@ -236,6 +336,135 @@ def not_operator_eval(
     return result
 
 
+def get_string_operands(
+        policy_information_point,
+        attribute_name: str,
+        operand: Any,
+        request: Request
+) -> List[str]:
+    """
+    Returns list of string operands of pattern operators (operand may be a string, a list or an expression)
+    """
+    if isinstance(operand, dict) and len(operand) == 1:
+        operand = policy_information_point.evaluate_expression(operand, request)
+    result = []
+    for item in (operand if isinstance(operand, list) else [operand]):
+        if isinstance(item, dict) and len(item) == 1:
+            item = policy_information_point.evaluate_expression(item, request)
+        if isinstance(item, str):
+            result.append(item)
+        else:
+            logging.warning(
+                "Only strings could be used as patterns (%s given for %s).", item.__class__.__name__, attribute_name
+            )
+    return result
+
+
+def startswith_operator_eval(
+        policy_information_point,
+        attribute_name: str,
+        attribute_value: Any,
+        operand: Any,
+        request: Request
+) -> Optional[bool]:
+    if not isinstance(attribute_value, str):
+        return False
+    prefixes = get_string_operands(policy_information_point, attribute_name, operand, request)
+    return attribute_value.startswith(tuple(prefixes))
+
+
+def glob_operator_eval(
+        policy_information_point,
+        attribute_name: str,
+        attribute_value: Any,
+        operand: Any,
+        request: Request
+) -> Optional[bool]:
+    """
+    Shell-style pattern (fnmatch) that should match the whole (case-sensitive) value
+    """
+    if not isinstance(attribute_value, str):
+        return False
+    return any(
+        compile_pattern('@glob', pattern).match(attribute_value) is not None
+        for pattern in get_string_operands(policy_information_point, attribute_name, operand, request)
+    )
+
+
+def regex_operator_eval(
+        policy_information_point,
+        attribute_name: str,
+        attribute_value: Any,
+        operand: Any,
+        request: Request
+) -> Optional[bool]:
+    """
+    Regular expression that should match any part of the value (use ^ and $ to match the whole value)
+    """
+    if not isinstance(attribute_value, str):
+        return False
+    return any(
+        compile_pattern('@regex', pattern).search(attribute_value) is not None
+        for pattern in get_string_operands(policy_information_point, attribute_name, operand, request)
+    )
+
+
+def compare_ordered(policy_information_point, attribute_value: Any, operand: Any, request: Request) -> Optional[int]:
+    """
+    :return: Negative number, zero or positive number if the attribute value is less than, equal to or greater
+        than the operand. None if values could not be compared.
+    """
+    if isinstance(operand, dict) and len(operand) == 1:
+        operand = policy_information_point.evaluate_expression(operand, request)
+    kind = get_order_kind(attribute_value)
+    if kind is None or kind != get_order_kind(operand):
+        return None
+    attribute_value = get_order_value(attribute_value)
+    operand = get_order_value(operand)
+    return (attribute_value > operand) - (attribute_value < operand)
+
+
+def gt_operator_eval(policy_information_point, attribute_name: str, attribute_value: Any, operand: Any,
+                     request: Request) -> Optional[bool]:
+    comparison = compare_ordered(policy_information_point, attribute_value, operand, request)
+    return comparison is not None and comparison > 0
+
+
+def gte_operator_eval(policy_information_point, attribute_name: str, attribute_value: Any, operand: Any,
+                      request: Request) -> Optional[bool]:
+    comparison = compare_ordered(policy_information_point, attribute_value, operand, request)
+    return comparison is not None and comparison >= 0
+
+
+def lt_operator_eval(policy_information_point, attribute_name: str, attribute_value: Any, operand: Any,
+                     request: Request) -> Optional[bool]:
+    comparison = compare_ordered(policy_information_point, attribute_value, operand, request)
+    return comparison is not None and comparison < 0
+
+
+def lte_operator_eval(policy_information_point, attribute_name: str, attribute_value: Any, operand: Any,
+                      request: Request) -> Optional[bool]:
+    comparison = compare_ordered(policy_information_point, attribute_value, operand, request)
+    return comparison is not None and comparison <= 0
+
+
+def between_operator_eval(policy_information_point, attribute_name: str, attribute_value: Any, operand: Any,
+                          request: Request) -> Optional[bool]:
+    """
+    Inclusive range: [lower bound, upper bound]
+    """
+    if isinstance(operand, dict) and len(operand) == 1:
+        operand = policy_information_point.evaluate_expression(operand, request)
+    if not isinstance(operand, list) or len(operand) != 2:
+        logging.warning(
+            f"Operand of operator @between should be a list of two bounds ({operand!r} given for {attribute_name})."
+        )
+        return False
+    lower = compare_ordered(policy_information_point, attribute_value, operand[0], request)
+    upper = compare_ordered(policy_information_point, attribute_value, operand[1], request)
+    return lower is not None and upper is not None and lower >= 0 and upper <= 0
+
+
 operator_evaluators = {
     '@': calculate_operator_eval,
     '==': equals_operator_eval,
@@ -244,5 +473,13 @@ operator_evaluators = {
     '@in': contained_in_operator_eval,
     '@UUID': uuid_operator_eval,
     '@not': not_operator_eval,
+    '@startswith': startswith_operator_eval,
+    '@glob': glob_operator_eval,
+    '@regex': regex_operator_eval,
+    '@gt': gt_operator_eval,
+    '@gte': gte_operator_eval,
+    '@lt': lt_operator_eval,
+    '@lte': lte_operator_eval,
+    '@between': between_operator_eval,
 }
 # EOF
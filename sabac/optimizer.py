@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Policy optimizer
+
+Transforms a loaded policy tree into an equivalent one that is cheaper to evaluate:
+- identical targets and conditions are replaced by a single shared object (hash-consing),
+  shared constraints are evaluated once per request;
+- constant expressions (@UUID, @STR) in @in/@contains operands are calculated once;
+- rules and policies that can never be reached (after unconditional final decision) are removed;
+- sibling policies with identical targets are merged.
+Decision (PERMIT or not PERMIT) is never changed by the optimizer.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .algorithm import deny_unless_permit, permit_unless_deny
+from .constants import RESULT_PERMIT, RESULT_DENY, RuleEvaluationResult
+from .expression_evaluators import expression_evaluators
+from .policy import Policy
+from .policy_element import PolicyElement, SharedConstraint
+from .policy_set import PolicySet
+from .rule import Rule
+from .utils import freeze
+
+# Expressions that could be calculated without request data if their operand is a constant
+FOLDABLE_EXPRESSIONS = ['@UUID', '@STR']
+
+# Decision that is final for the algorithm
+FINAL_DECISIONS = {
+    deny_unless_permit: RESULT_PERMIT,
+    permit_unless_deny: RESULT_DENY,
+}
+
+
+@dataclass
+class OptimizationReport:
+    shared_constraints: int = 0
+    folded_expressions: int = 0
+    removed_elements: int = 0
+    merged_policies: int = 0
+    changes: List[str] = field(default_factory=list)
+
+    def add_change(self, message: str) -> None:
+        self.changes.append(message)
+
+    def merge(self, other: "OptimizationReport") -> None:
+        """
+        Adds changes of another report (e.g. of items optimized separately)
+        """
+        self.shared_constraints += other.shared_constraints
+        self.folded_expressions += other.folded_expressions
+        self.removed_elements += other.removed_elements
+        self.merged_policies += other.merged_policies
+        self.changes.extend(other.changes)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'shared_constraints': self.shared_constraints,
+            'folded_expressions': self.folded_expressions,
+            'removed_elements': self.removed_elements,
+            'merged_policies': self.merged_policies,
+            'changes': self.changes,
+        }
+
+
+def element_name(element: PolicyElement) -> str:
+    return f"{element.__class__.__name__} '{element.description}'"
+
+
+class PolicyOptimizer:
+    def __init__(self):
+        self.report = OptimizationReport()
+        self._shared_constraints: Dict[Any, SharedConstraint] = {}
+        self._constraint_usage: Dict[Any, int] = {}
+
+    def optimize(self, policy_set: PolicySet) -> OptimizationReport:
+        """
+        Optimizes policy set in place and returns the report
+        """
+        self.optimize_element(policy_set)
+        self.report.shared_constraints = sum(1 for usage in self._constraint_usage.values() if usage > 1)
+        return self.report
+
+    def optimize_items(self, items: list) -> OptimizationReport:
+        """
+        Optimizes root policy set items in place. Items themselves are kept (only their content is changed),
+        so the number of root items is the same.
+        """
+        for item in items:
+            if isinstance(item, (Policy, Rule)):
+                self.optimize_element(item)
+        self.report.shared_constraints = sum(1 for usage in self._constraint_usage.values() if usage > 1)
+        return self.report
+
+    def optimize_element(self, element: PolicyElement) -> None:
+        element.target = self.share_constraint(element.target)
+        if isinstance(element, Rule):
+            element.condition = self.share_constraint(element.condition)
+        elif isinstance(element, PolicySet):
+            for item in element.items:
+                self.optimize_element(item)
+            element.items = self.merge_policies(element, self.remove_unreachable(element, element.items))
+        elif isinstance(element, Policy):
+            for rule in element.rules:
+                self.optimize_element(rule)
+            element.rules = self.remove_unreachable(element, element.rules)
+
+    # Constraints
+
+    def share_constraint(self, requirements: Optional[Mapping]) -> Optional[Mapping]:
+        if not requirements or not isinstance(requirements, Mapping):
+            return requirements
+
+        folded = {key: self.fold_constraint(constraint) for key, constraint in requirements.items()}
+        key = freeze(folded)
+        self._constraint_usage[key] = self._constraint_usage.get(key, 0) + 1
+        if key not in self._shared_constraints:
+            self._shared_constraints[key] = SharedConstraint(folded)
+        return self._shared_constraints[key]
+
+    def fold_constraint(self, constraint: Any) -> Any:
+        if not isinstance(constraint, dict) or len(constraint) != 1:
+            return constraint
+
+        operator, operand = next(iter(constraint.items()))
+        if operator == '@not':
+            return {operator: self.fold_constraint(operand)}
+        elif operator in ('@in', '@contains'):
+            if isinstance(operand, list):
+                return {operator: [self.fold_expression(item) for item in operand]}
+            elif isinstance(operand, dict):
+                folded_operand = self.fold_expression(operand)
+                # Non-list result of @in operand expression is not equivalent to the same constant
+                if folded_operand is not operand and (operator == '@contains' or isinstance(folded_operand, list)):
+                    return {operator: folded_operand}
+        return constraint
+
+    def fold_expression(self, expression: Any) -> Any:
+        if not isinstance(expression, dict) or len(expression) != 1:
+            return expression
+
+        expression_type, value = next(iter(expression.items()))
+        if expression_type in FOLDABLE_EXPRESSIONS and not isinstance(value, dict):
+            # Constant expressions do not use PIP and request
+            self.report.folded_expressions += 1
+            return expression_evaluators[expression_type](None, value, None)
+        return expression
+
+    # Structure
+
+    def remove_unreachable(self, parent: Policy, children: list) -> list:
+        """
+        Removes children that follow a child that always produces the final decision of the parent algorithm
+        """
+        final_decision = FINAL_DECISIONS.get(parent.algorithm)
+        if final_decision is None:
+            return children
+
+        for index, child in enumerate(children):
+            if self.always_decides(child, final_decision):
+                removed = children[index + 1:]
+                if removed:
+                    self.report.removed_elements += len(removed)
+                    self.report.add_change(
+                        f"Removed {len(removed)} unreachable element(s) after {element_name(child)} "
+                        f"in {element_name(parent)}."
+                    )
+                return children[:index + 1]
+        return children
+
+    @staticmethod
+    def always_decides(element: PolicyElement, decision: RuleEvaluationResult) -> bool:
+        if element.target:
+            return False
+        if isinstance(element, Rule):
+            return element.condition is None and element.effect == decision
+        if isinstance(element, Policy) and FINAL_DECISIONS.get(element.algorithm) == decision:
+            return any(PolicyOptimizer.always_decides(child, decision) for child in element.children)
+        return False
+
+    def merge_policies(self, policy_set: PolicySet, items: list) -> list:
+        """
+        Merges adjacent policies with identical targets if they use the same order-insensitive algorithm
+        as the parent policy set and have no actions.
+        Parent should keep at least two items, otherwise a not applicable result could be changed to deny.
+        """
+        if policy_set.algorithm not in FINAL_DECISIONS:
+            return items
+
+        result = []
+        merged = 0
+        for item in items:
+            previous = result[-1] if result else None
+            if (
+                len(items) - merged > 2
+                and self.is_mergeable(policy_set, previous)
+                and self.is_mergeable(policy_set, item)
+                and freeze(previous.target) == freeze(item.target)
+            ):
+                previous.rules = previous.rules + item.rules
+                previous.description = '; '.join(
+                    description for description in (previous.description, item.description) if description
+                ) or None
+                merged += 1
+                self.report.merged_policies += 1
+                self.report.add_change(
+                    f"Merged {element_name(item)} into policy with identical target in {element_name(policy_set)}."
+                )
+            else:
+                result.append(item)
+        return result
+
+    @staticmethod
+    def is_mergeable(policy_set: PolicySet, item: Any) -> bool:
+        return (
+            isinstance(item, Policy) and not isinstance(item, PolicySet)
+            and item.algorithm is policy_set.algorithm
+            and not item.obligations and not item.advices
+        )
+
+
+def optimize_policy_set(policy_set: PolicySet) -> OptimizationReport:
+    """
+    Optimizes policy tree in place
+    :param policy_set: Root of a policy tree. Should not be used for evaluation while it is optimized.
+    :return: Report of the changes
+    """
+    report = PolicyOptimizer().optimize(policy_set)
+    add_report_summary(report)
+    return report
+
+
+def optimize_items(items: list) -> OptimizationReport:
+    """
+    Optimizes items of a root policy set that are loaded separately (e.g. by lazy PAPs) in place
+    :param items: Items that are not used for evaluation yet
+    :return: Report of the changes
+    """
+    report = PolicyOptimizer().optimize_items(items)
+    add_report_summary(report)
+    return report
+
+
+def add_report_summary(report: OptimizationReport) -> None:
+    if report.shared_constraints:
+        report.add_change(f"{report.shared_constraints} constraint(s) shared between several elements.")
+    if report.folded_expressions:
+        report.add_change(f"{report.folded_expressions} constant expression(s) calculated.")
+# EOF
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Adaptive ordering of policy elements
+
+For order-insensitive algorithms position of a decisive element affects only the amount of work,
+so children of policies and policy sets could be reordered to check cheap, likely decisive elements first.
+Statistics are collected during evaluation and children are reordered periodically.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from .algorithm import ORDER_INSENSITIVE_ALGORITHMS
+from .response import Response
+
+
+@dataclass
+class ChildStatistics:
+    evaluations: int = 0
+    decisions: int = 0
+    cost: float = 0.0
+
+    @property
+    def average_cost(self) -> Optional[float]:
+        return self.cost / self.evaluations if self.evaluations else None
+
+
+@dataclass
+class ParentStatistics:
+    parent: weakref.ref
+    reorderable: bool
+    evaluations: int = 0
+    children: Dict[int, ChildStatistics] = field(default_factory=dict)
+    # Children list that `reorderable` was computed for (it is replaced when children are changed)
+    children_list: Optional[list] = None
+
+
+def has_actions(element) -> bool:
+    """
+    Checks if element or any of its descendants has obligations or advices
+    """
+    if element.obligations or element.advices:
+        return True
+    return any(has_actions(child) for child in getattr(element, 'children', []))
+
+
+class AdaptiveOrdering:
+    """
+    Collects hit statistics for children of policies and policy sets and reorders them.
+    Only children of order-insensitive algorithms without obligations and advices are reordered.
+    Counters are updated without locking, so they are approximate under concurrent evaluation.
+    """
+
+    def __init__(self, reorder_interval: int = 1000):
+        """
+        :param reorder_interval: Number of parent evaluations between reorderings
+        """
+        self.reorder_interval = reorder_interval
+        self._parents: Dict[int, ParentStatistics] = {}
+        self._lock = threading.Lock()
+
+    def get_parent_statistics(self, parent) -> ParentStatistics:
+        statistics = self._parents.get(id(parent))
+        children = parent.children
+        if statistics is None or statistics.parent() is not parent:
+            statistics = ParentStatistics(parent=weakref.ref(parent), reorderable=False)
+            self._parents[id(parent)] = statistics
+        if statistics.children_list is not children:
+            statistics.reorderable = (
+                parent.algorithm in ORDER_INSENSITIVE_ALGORITHMS
+                and not any(has_actions(child) for child in children)
+            )
+            statistics.children_list = children
+        return statistics
+
+    def is_reorderable(self, parent) -> bool:
+        return self.get_parent_statistics(parent).reorderable
+
+    def combine(self, parent, request, children) -> Optional[Response]:
+        """
+        Same as Policy.combine, but collects statistics for children
+        """
+        statistics = self.get_parent_statistics(parent)
+        response = None
+        is_final = False
+        for child in children:
+            if request.is_expired():
+                break
+            started = time.perf_counter()
+            child_response = child.evaluate(request)
+            response, is_final = parent.algorithm(old_response=response, new_response=child_response)
+
+            child_statistics = statistics.children.get(id(child))
+            if child_statistics is None:
+                child_statistics = statistics.children.setdefault(id(child), ChildStatistics())
+            child_statistics.evaluations += 1
+            child_statistics.cost += time.perf_counter() - started
+            if is_final:
+                child_statistics.decisions += 1
+                if request.coverage is not None:
+                    request.coverage.record_decision(child)
+                break
+
+        statistics.evaluations += 1
+        if statistics.evaluations >= self.reorder_interval:
+            self.reorder(parent)
+        return parent.check_deadline(request, response, is_final)
+
+    def reorder(self, parent) -> None:
+        """
+        Sorts children by the expected cost of reaching the final decision and resets the statistics
+        """
+        with self._lock:
+            statistics = self.get_parent_statistics(parent)
+            if statistics.evaluations == 0 or not statistics.reorderable:
+                return
+
+            costs = [child.average_cost for child in statistics.children.values() if child.evaluations]
+            default_cost = sum(costs) / len(costs) if costs else 1.0
+
+            def score(child) -> float:
+                child_statistics = statistics.children.get(id(child), ChildStatistics())
+                average_cost = child_statistics.average_cost
+                if average_cost is None:
+                    average_cost = default_cost
+                # Smoothed probability of the final decision per unit of cost
+                return (child_statistics.decisions + 1) / (child_statistics.evaluations + 2) / (average_cost + 1e-9)
+
+            # New list replaces the old one, so evaluations in progress are not affected
+            parent.children = statistics.children_list = sorted(parent.children, key=score, reverse=True)
+            statistics.evaluations = 0
+            statistics.children = {}
+
+    def get_statistics(self, parent) -> List[Dict]:
+        """
+        Returns current statistics of parent children in their current order
+        """
+        statistics = self.get_parent_statistics(parent)
+        result = []
+        for child in parent.children:
+            child_statistics = statistics.children.get(id(child), ChildStatistics())
+            result.append({
+                'description': child.description,
+                'evaluations': child_statistics.evaluations,
+                'decisions': child_statistics.decisions,
+                'average_cost': child_statistics.average_cost,
+            })
+        return result
+# EOF
@@ -30,13 +30,17 @@ from .algorithm import *
 from .rule import Rule
 from .policy_element import PolicyElement
 from .response import Response
+from .utils import add_slots
 
 
+@add_slots
 @dataclass()
 class Policy(PolicyElement):
     algorithm: Optional[Callable] = None
     rules: List[Rule] = field(default_factory=list)
 
+    element_type = 'policy'
+
     def update_algorithm_from_json(self, json_data):
         if 'algorithm' in json_data:
             algorithm = json_data['algorithm']
@@ -51,8 +55,7 @@ class Policy(PolicyElement):
     def update_rules_from_json(self, json_data):
         if 'rules' in json_data:
             if isinstance(json_data['rules'], list) and len(json_data['rules']) > 0:
-                for rule_data in json_data['rules']:
-                    self.rules.append(Rule(rule_data))
+                self.rules = [Rule(rule_data) for rule_data in json_data['rules']]
             else:
                 logging.warning("Policy should have at least one rule.")
         else:
@@ -64,9 +67,9 @@ class Policy(PolicyElement):
         self.update_rules_from_json(json_data)
 
     def to_json(self):
-        result = super().to_json()
+        result = PolicyElement.to_json(self)
         if self.algorithm:
-            result['algorithm'] = self.algorithm
+            result['algorithm'] = get_algorithm_name(self.algorithm)
         if len(self.rules) > 0:
             rules_data = []
             for rule in self.rules:
@@ -74,25 +77,73 @@ class Policy(PolicyElement):
             result['rules'] = rules_data
         return result
 
-    def evaluate(self, request):
-        if not self.check_target(request):
-            return Response(request, decision=RESULT_NOT_APPLICABLE)
+    @property
+    def children(self) -> list:
+        """Child elements that are combined by the algorithm"""
+        return self.rules
+
+    @children.setter
+    def children(self, value: list):
+        self.rules = value
+
+    def get_request_children(self, request) -> list:
+        """
+        Rules that are combined for the request: rules with targets rejected by the PDP matcher
+        are replaced with placeholders (see bitmap module)
+        """
+        if request.target_bitmap is None:
+            return self.rules
+        return request.target_bitmap.filter(self.rules)
+
+    def combine(self, request, children) -> Optional[Response]:
+        """
+        Evaluates children one by one (in document order) and combines their results using the algorithm
+        :param request: Request object
+        :param children: Child elements to evaluate
+        :return: Combined response or None if there was nothing to combine
+        """
+        ordering = getattr(request.PDP, 'ordering', None)
+        if ordering is not None and ordering.is_reorderable(self):
+            return ordering.combine(self, request, children)
 
-        # If we reached this - the target is matched with context
         response = None
-        for rule in self.rules:
-            element_result = rule.evaluate(request)
-            response, is_final = self.algorithm(old_response=response, new_response=element_result)
+        is_final = False
+        for child in children:
+            if request.is_expired():
+                break
+            child_response = child.evaluate(request)
+            response, is_final = self.algorithm(old_response=response, new_response=child_response)
             if is_final:
                 # It is a final result - skipping the rest
+                if request.coverage is not None:
+                    request.coverage.record_decision(child)
                 break
+        return self.check_deadline(request, response, is_final)
+
+    def check_deadline(self, request, response: Optional[Response], is_final: bool) -> Optional[Response]:
+        """
+        Replaces a non-final combined response with indeterminate one if any part of the request
+        was skipped because of the deadline: skipped elements could have changed the decision.
+        """
+        if is_final or not request.deadline_exceeded:
+            return response
+        result = Response(request, decision=self.indeterminate_decision)
+        if response is not None:
+            result.join_data(response)
+        return result
+
+    def evaluate(self, request):
+        target_matched = self.safe_check_target(request)
+        if target_matched is None:
+            return Response(request, decision=self.indeterminate_decision)
+        elif not target_matched:
+            return Response(request, decision=RESULT_NOT_APPLICABLE)
+
+        # If we reached this - the target is matched with context
+        response = self.combine(request, self.get_request_children(request))
 
         if request.return_policy_id_list and response.decision != RESULT_NOT_APPLICABLE:
-            response.polices.append({
-                'element': 'policy',
-                'description': self.description,
-                'result': response.decision
-            })
+            response.polices.append((self.element_id, response.decision))
 
         return response
 # EOF
@@ -4,7 +4,7 @@
 Base class for Policy, Rule and PolicySet
 
 Object structure:
-- target - dict
+- target - dict (stored as Constraints, see compact module)
 - description - text
 - obligations
 - advices
@@ -16,24 +16,53 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
+import logging
+from collections.abc import Mapping
 from dataclasses import dataclass, field, InitVar
-from typing import Optional, List
+from typing import Any, Optional, Sequence, Set
 
 from .action import Obligation, Advice
+from .compact import Constraints
+from .constants import RuleEvaluationResult, RESULT_INDETERMINATE_DP, RESULT_NOT_APPLICABLE
+from .exceptions import AttributeUnavailableException
+from .expression_evaluators import expression_evaluators
+from .operator_evaluators import prepare_constraints
+from .provenance import register_element
+from .response import Response
+from .utils import add_slots
 
+# Maximal number of NotApplicableElement placeholders that replace removed not applicable items:
+# results of implemented algorithms do not depend on the number of not applicable results beyond that
+MAX_PLACEHOLDERS = 2
 
+
+class SharedConstraint(dict):
+    """
+    Requirements dict that is used by several policy elements (see optimizer).
+    Its match result is calculated once per request and kept in the request match cache.
+    """
+    pass
+
+
+@add_slots(weakref=True)
 @dataclass(repr=False)
 class PolicyElement:
     """
     Abstract class that includes common elements for rules, policies and policy sets
     """
     description: Optional[str] = None
-    target: Optional[str] = None
-    obligations: List[Obligation] = field(default_factory=list)
-    advices: List[Advice] = field(default_factory=list)
+    target: Optional[Mapping] = None
+    # Tuples of shared actions
+    obligations: Sequence[Obligation] = ()
+    advices: Sequence[Advice] = ()
     json_data: InitVar[Optional[dict]] = None
+    # Compact ID used for decision provenance (see provenance module)
+    element_id: int = field(default=0, init=False, compare=False, repr=False)
+
+    element_type = 'element'
 
     def __post_init__(self, json_data: Optional[dict] = None):
+        register_element(self)
         if json_data is not None:
             self.update_from_json(json_data)
 
@@ -48,11 +77,11 @@ class PolicyElement:
         if self.description:
             result['description'] = self.description
         if self.target:
-            result['target'] = self.target
+            result['target'] = dict(self.target)
         if self.obligations:
-            result['obligations'] = self.obligations
+            result['obligations'] = [obligation.to_json() for obligation in self.obligations]
         if self.advices:
-            result['advices'] = self.advices
+            result['advices'] = [advice.to_json() for advice in self.advices]
         return result
 
     def update_from_json(self, json_data):
@@ -60,13 +89,14 @@ class PolicyElement:
             self.description = json_data['description']
         if 'target' in json_data:
             if isinstance(json_data['target'], dict):
-                self.target = json_data['target']
+                self.target = Constraints(json_data['target'])
+                prepare_constraints(self.target)
             else:
                 ValueError("Target should be a dict")
 
         def add_list_from_json(field, class_):
             if field in json_data:
-                setattr(self, field, [class_(obj) for obj in json_data[field]])
+                setattr(self, field, tuple(class_.get_shared(obj) for obj in json_data[field]))
 
         add_list_from_json('obligations', Obligation)
         add_list_from_json('advices', Advice)
@@ -74,6 +104,21 @@ class PolicyElement:
     def evaluate(self, context):
         raise NotImplementedError("Unable to evaluate %s." % self.__class__.__name__)
 
+    @property
+    def indeterminate_decision(self) -> RuleEvaluationResult:
+        """Decision of the element if it could not be evaluated"""
+        return RESULT_INDETERMINATE_DP
+
+    def safe_check_target(self, request) -> Optional[bool]:
+        """
+        Same as check_target, but returns None if target could not be evaluated because of unavailable attributes
+        """
+        try:
+            return self.check_target(request)
+        except AttributeUnavailableException as e:
+            logging.warning(f"Target of {self.element_type} {self.description} is indeterminate: {e.message}")
+            return None
+
     def check_target(self, request):
         """
         Checks if the target is applicable
@@ -88,10 +133,17 @@ class PolicyElement:
         if not hasattr(self, 'target') or not self.target:
             # Empty target may be used to group policy elements
             # logging.warning("No target: %s", self)
-            return True
-        elif not isinstance(self.target, dict):
+            result = True
+        elif not isinstance(self.target, Mapping):
             raise ValueError("Incorrect target: %s" % self.target)
-        return self.context_match(self.target, request)
+        elif request.evaluation_context is not None:
+            result = request.evaluation_context.match(self.target, request)
+        else:
+            result = self.context_match(self.target, request)
+
+        if request.coverage is not None:
+            request.coverage.record_target(self, result)
+        return result
 
     @staticmethod
     def context_match(policy_element_requirements, request) -> bool:
@@ -107,7 +159,15 @@ class PolicyElement:
         - resource - attribute related to the resource that is to be accessed
         - action - attributes related to action that is to be done
         """
+        cache_key = None
+        if isinstance(policy_element_requirements, SharedConstraint):
+            cache_key = id(policy_element_requirements)
+            if cache_key in request.match_cache:
+                return request.match_cache[cache_key]
+
         result = True
+        # Request attributes are a per-request layer over the original context,
+        # so values written here are never visible to the caller or to other requests
         context = request.attributes
         for policy_key, policy_constraint in policy_element_requirements.items():
             if policy_key not in context:
@@ -115,7 +175,7 @@ class PolicyElement:
                 # Requesting attribute value from PDP/PIP
                 attribute_value = request.PDP.PIP.get_attribute_value(policy_key, request)
                 # Keeping value in a request because it could be requested by other policy elements later
-                request.attributes[policy_key] = attribute_value
+                context[policy_key] = attribute_value
 
             if isinstance(policy_constraint, dict):
                 # We have some advanced comparison
@@ -139,6 +199,9 @@ class PolicyElement:
                 # Key exists, but value is wrong
                 result = False
                 break
+
+        if cache_key is not None:
+            request.match_cache[cache_key] = result
         return result
 
     def handle_actions(self, response):
@@ -151,4 +214,55 @@ class PolicyElement:
                 if advice.fulfill_on == response.decision:
                     response.add_advice(advice)
         return response
+
+
+@add_slots
+@dataclass(repr=False)
+class NotApplicableElement(PolicyElement):
+    """
+    Placeholder for policy elements removed from a tree (e.g. by sharding) that are known to be not applicable.
+    Some algorithms depend on the number of combined results (deny_unless_permit returns the first
+    not applicable result as is), so such elements are replaced with placeholders instead of being dropped.
+    """
+    element_type = 'placeholder'
+
+    def evaluate(self, request):
+        return Response(request, decision=RESULT_NOT_APPLICABLE)
+
+
+def get_references(constraint: Any) -> Set[str]:
+    """
+    :return: Names of attributes that may be read by expressions of the constraint
+    """
+    result = set()
+    values = [constraint]
+    while values:
+        value = values.pop()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key in expression_evaluators and isinstance(item, str):
+                    result.add(item)
+                else:
+                    values.append(item)
+        elif isinstance(value, list):
+            values.extend(value)
+    return result
+
+
+def get_referenced_attributes(root_policy_set: PolicyElement) -> Set[str]:
+    """
+    :return: Names of attributes used by targets and conditions of the policy tree
+        (items that are not loaded yet are not inspected)
+    """
+    result = set()
+    elements = [root_policy_set]
+    while elements:
+        element = elements.pop()
+        for requirements in (element.target, getattr(element, 'condition', None)):
+            if isinstance(requirements, Mapping):
+                for key, constraint in requirements.items():
+                    result.add(key)
+                    result |= get_references(constraint)
+        elements.extend(getattr(element, 'children', ()))
+    return result
 # EOF
@@ -24,20 +24,42 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
+import asyncio
 import logging
+import threading
+from concurrent.futures import Executor, TimeoutError as FutureTimeoutError
 from dataclasses import dataclass, field
-from typing import Optional, Union, List
+from typing import Any, Optional, Union, List
 
 from .constants import RESULT_NOT_APPLICABLE
+from .index import MIN_INDEXED_ITEMS, build_index
 from .policy import Policy
 from .policy_element import PolicyElement
 from .algorithm import get_algorithm_by_name, POLICY_SET_ALGORITHMS
 from .response import Response
+from .utils import add_slots
 
+# Marks threads that evaluate a policy set child.
+# Nested policy sets are evaluated sequentially there, so workers never wait for the tasks queued after them.
+_worker_state = threading.local()
 
+
+def _evaluate_in_worker(item, request) -> Response:
+    _worker_state.active = True
+    try:
+        return item.evaluate(request)
+    finally:
+        _worker_state.active = False
+
+
+@add_slots
 @dataclass()
 class PolicySet(Policy):
     items: List[Union[Policy, "PolicySet"]] = field(default_factory=list)
+    # Index of items by target constraints (see index module), built for the current items on first use
+    index: Any = field(default=None, compare=False, repr=False)
+
+    element_type = 'policy_set'
 
     @staticmethod
     def get_algorithm_from_json(json_data: dict):
@@ -69,21 +91,123 @@ class PolicySet(Policy):
         if len(json_data.get('items', [])) == 0:  # pragma: no cover
             logging.warning("Policy set should have at least one policy.")
 
+    @property
+    def children(self) -> list:
+        return self.items
+
+    @children.setter
+    def children(self, value: list):
+        self.items = value
+
+    def get_request_items(self, request) -> list:
+        """
+        Items that are combined for the request: candidate items of the index (that are not rejected
+        by the PDP matcher) followed by placeholders for not applicable items
+        """
+        items = self.items
+        if len(items) >= MIN_INDEXED_ITEMS and request.coverage is None:
+            index = self.index
+            if index is None or index.items is not items:
+                index = self.index = build_index(items)
+            items = index.get_request_items(request)
+        if request.target_bitmap is not None:
+            items = request.target_bitmap.filter(items)
+        return items
+
+    def combine_concurrently(self, request, children, executor: Executor) -> Optional[Response]:
+        """
+        Evaluates children concurrently using the executor.
+        Results are combined in document order, so the combined response is the same as for the sequential
+        evaluation. Work that was not started yet is cancelled as soon as the combined result is final.
+        """
+        futures = [executor.submit(_evaluate_in_worker, child, request) for child in children]
+        result = None
+        is_final = False
+        try:
+            for child, future in zip(children, futures):
+                try:
+                    child_result = future.result(timeout=request.get_remaining_time())
+                except FutureTimeoutError:
+                    request.deadline_exceeded = True
+                    break
+                result, is_final = self.algorithm(result, child_result)
+                if is_final:
+                    if request.coverage is not None:
+                        request.coverage.record_decision(child)
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+        return self.check_deadline(request, result, is_final)
+
+    async def combine_async(self, request, children, executor: Optional[Executor] = None) -> Optional[Response]:
+        """
+        Asyncio version of combine_concurrently.
+        Every child is evaluated as a separate task in the executor (default loop executor if None).
+        """
+        loop = asyncio.get_running_loop()
+        tasks = [
+            asyncio.ensure_future(loop.run_in_executor(executor, _evaluate_in_worker, child, request))
+            for child in children
+        ]
+        result = None
+        is_final = False
+        try:
+            for child, task in zip(children, tasks):
+                try:
+                    child_result = await asyncio.wait_for(task, request.get_remaining_time())
+                except asyncio.TimeoutError:
+                    request.deadline_exceeded = True
+                    break
+                result, is_final = self.algorithm(result, child_result)
+                if is_final:
+                    if request.coverage is not None:
+                        request.coverage.record_decision(child)
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self.check_deadline(request, result, is_final)
+
     def evaluate(self, request) -> Response:
         result = None
-        if self.check_target(request):
-            for item in self.items:
-                item_result = item.evaluate(request)
-                if self.algorithm is not None:
-                    result, is_final = self.algorithm(result, item_result)
-                    if is_final:
-                        # It is a final result - returning result without further processing
-                        break
+        target_matched = self.safe_check_target(request)
+        if target_matched is None:
+            result = Response(request, decision=self.indeterminate_decision)
+        elif target_matched and self.algorithm is not None:
+            items = self.get_request_items(request)
+            executor = getattr(request.PDP, 'executor', None)
+            if executor is not None and len(items) > 1 and not getattr(_worker_state, 'active', False):
+                result = self.combine_concurrently(request, items, executor)
+            else:
+                result = self.combine(request, items)
 
         if result is None:
             result = Response(request, decision=RESULT_NOT_APPLICABLE)
         return result
 
+    async def evaluate_async(self, request, executor: Optional[Executor] = None) -> Response:
+        """
+        Evaluates policy set with children running as asyncio tasks
+        """
+        loop = asyncio.get_running_loop()
+        result = None
+        target_matched = await loop.run_in_executor(executor, self.safe_check_target, request)
+        if target_matched is None:
+            result = Response(request, decision=self.indeterminate_decision)
+        elif target_matched and self.algorithm is not None:
+            result = await self.combine_async(request, self.get_request_items(request), executor)
+
+        if result is None:
+            result = Response(request, decision=RESULT_NOT_APPLICABLE)
+        return result
+
+    def to_json(self):
+        result = Policy.to_json(self)
+        if len(self.items) > 0:
+            result['items'] = [item.to_json() for item in self.items]
+        return result
+
     @property
     def item_count(self):
         if not hasattr(self, 'items') or not self.items or not isinstance(self.items, list):
@@ -92,16 +216,26 @@ class PolicySet(Policy):
             return len(self.items)
 
     def add_item(self, data: Union[dict, Policy, "PolicySet"]):
-        policy_object = None
-        if isinstance(data, dict):
-            policy_object = Policy(json_data=data)
-        elif isinstance(data, (Policy, PolicySet)):
-            policy_object = data
-        else:  # pragma: no cover
-            ValueError('Unknown type (%s) was used as policy.' % data.__class__.__name__)
+        self.add_items([data])
+
+    def add_items(self, data_list: List[Union[dict, Policy, "PolicySet"]]):
+        """
+        Adds several items at once (the items list is copied once for all of them)
+        """
+        policy_objects = []
+        for data in data_list:
+            policy_object = None
+            if isinstance(data, dict):
+                policy_object = Policy(json_data=data)
+            elif isinstance(data, (Policy, PolicySet)):
+                policy_object = data
+            else:  # pragma: no cover
+                ValueError('Unknown type (%s) was used as policy.' % data.__class__.__name__)
+            policy_objects.append(policy_object)
 
         if not hasattr(self, 'items') or not isinstance(self.items, list):
             self.items = []
 
-        self.items.append(policy_object)
+        # Replacing the list instead of appending to it, so concurrent evaluations are not affected
+        self.items = self.items + policy_objects
 # EOF
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parallel streaming runner for policy tests
+
+Tests are read from a JSONL file (one test per line, same format as for PEP.run_tests)
+and distributed in chunks over a process pool. Worker processes are forked after the policies are loaded,
+so they share one loaded PAP. Failures are yielded as soon as their chunk is done.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import itertools
+import json
+import multiprocessing
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# PEP used by worker processes (inherited from the parent process by fork)
+_worker_pep = None
+
+
+@dataclass
+class RunStatistics:
+    total: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    evaluation_time: float = 0.0
+
+    @property
+    def tests_per_second(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def average_evaluation_time(self) -> float:
+        return self.evaluation_time / self.total if self.total else 0.0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'total': self.total,
+            'failed': self.failed,
+            'elapsed': self.elapsed,
+            'tests_per_second': self.tests_per_second,
+            'average_evaluation_time': self.average_evaluation_time,
+        }
+
+
+def iter_tests(file_name: str, encoding: str = 'UTF-8') -> Iterator[dict]:
+    """
+    Reads tests from a JSONL file one by one
+    """
+    with open(file_name, encoding=encoding) as tests_file:
+        for line in tests_file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_chunks(tests: Iterable[dict], chunk_size: int) -> Iterator[Tuple[int, List[dict]]]:
+    """
+    Splits tests into chunks
+    :return: (index of the first test in the chunk, chunk) pairs
+    """
+    iterator = iter(tests)
+    index = 0
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield index, chunk
+        index += len(chunk)
+
+
+def run_chunk(pep, first_index: int, chunk: List[dict]) -> Tuple[List[dict], int, float]:
+    """
+    :return: Failures, number of tests and evaluation time
+    """
+    failures = []
+    started = time.perf_counter()
+    for index, test in enumerate(chunk, start=first_index):
+        failure = pep.run_test(test)
+        if failure is not None:
+            failure['index'] = index
+            failures.append(failure)
+    return failures, len(chunk), time.perf_counter() - started
+
+
+def _run_chunk_in_worker(first_index: int, chunk: List[dict]) -> Tuple[List[dict], int, float, Optional[dict]]:
+    """
+    :return: Same as run_chunk and coverage collected by the worker for this chunk (if coverage is enabled)
+    """
+    failures, count, evaluation_time = run_chunk(_worker_pep, first_index, chunk)
+    coverage = _worker_pep.PDP.coverage
+    coverage_json = None
+    if coverage is not None:
+        coverage_json = coverage.to_json()
+        coverage.reset()
+    return failures, count, evaluation_time, coverage_json
+
+
+class PolicyTestRunner:
+    def __init__(self, pep, processes: Optional[int] = None, chunk_size: int = 500):
+        """
+        :param pep: Policy Enforcement Point with loaded policies
+        :param processes: Number of worker processes (CPU count by default).
+            Tests are run in the current process if it is 1 or the platform does not support fork.
+        :param chunk_size: Number of tests sent to a worker at once
+        """
+        self.pep = pep
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.statistics = RunStatistics()
+
+    def iter_failures(self, tests: Iterable[dict]) -> Iterator[dict]:
+        """
+        Runs tests and yields failures as soon as they are found.
+        Runner statistics are updated while tests are running.
+        """
+        self.statistics = RunStatistics()
+        started = time.perf_counter()
+        for failures, count, evaluation_time in self._iter_chunk_results(tests):
+            self.statistics.total += count
+            self.statistics.failed += len(failures)
+            self.statistics.evaluation_time += evaluation_time
+            self.statistics.elapsed = time.perf_counter() - started
+            for failure in failures:
+                yield failure
+
+    def run_file(self, file_name: str, encoding: str = 'UTF-8') -> Iterator[dict]:
+        """
+        Streams tests from a JSONL file and yields failures
+        """
+        return self.iter_failures(iter_tests(file_name, encoding))
+
+    def _iter_chunk_results(self, tests: Iterable[dict]) -> Iterator[Tuple[List[dict], int, float]]:
+        chunks = iter_chunks(tests, self.chunk_size)
+        if self.processes <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            for first_index, chunk in chunks:
+                yield run_chunk(self.pep, first_index, chunk)
+            return
+
+        global _worker_pep
+        _worker_pep = self.pep
+        coverage = self.pep.PDP.coverage
+        if coverage is not None and coverage.root is not self.pep.PDP.PAP.root_policy_set:
+            # Counters from workers are merged by element paths, so the tree should be bound before
+            coverage.bind(self.pep.PDP.PAP.root_policy_set)
+
+        with multiprocessing.get_context('fork').Pool(self.processes) as pool:
+            # Limiting the number of queued chunks keeps memory usage constant for any number of tests
+            pending = deque()
+            for first_index, chunk in chunks:
+                pending.append(pool.apply_async(_run_chunk_in_worker, (first_index, chunk)))
+                if len(pending) >= self.processes * 2:
+                    yield self._collect_worker_result(pending.popleft().get())
+            while pending:
+                yield self._collect_worker_result(pending.popleft().get())
+
+    def _collect_worker_result(self, result) -> Tuple[List[dict], int, float]:
+        failures, count, evaluation_time, coverage_json = result
+        if coverage_json is not None:
+            self.pep.PDP.coverage.merge_json(coverage_json)
+        return failures, count, evaluation_time
+# EOF
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Decision provenance
+
+Every policy element gets a compact integer ID when it is created.
+During evaluation only (element ID, decision) pairs are recorded,
+human-readable form is built only when it is requested.
+
+IDs are unique within a process. Processes forked from the current one (e.g. shard workers) assign IDs
+in their own namespace (process ID in the high bits), so IDs received from another process are never
+resolved to elements of the current one: describe returns opaque records for them.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import itertools
+import os
+import threading
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Registry does not keep elements alive: elements of reloaded policy trees are removed automatically
+_elements = weakref.WeakValueDictionary()
+_element_ids = itertools.count(1)
+_lock = threading.Lock()
+# Number of low bits of element ID used by the per-process counter
+NAMESPACE_SHIFT = 40
+# Namespace of IDs assigned by the current process (0 for the main process)
+_namespace = 0
+
+
+def _start_namespace() -> None:
+    """
+    Starts a new ID namespace in a forked process
+    """
+    global _element_ids, _lock, _namespace
+    _namespace = os.getpid()
+    _element_ids = itertools.count((_namespace << NAMESPACE_SHIFT) + 1)
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_start_namespace)
+
+
+def register_element(element: Any) -> int:
+    """
+    Assigns a new ID to a policy element
+    """
+    with _lock:
+        element_id = next(_element_ids)
+        _elements[element_id] = element
+    element.element_id = element_id
+    return element_id
+
+
+def register_tree(element: Any) -> None:
+    """
+    Assigns new IDs to an element and all its descendants (e.g. for a copy of a policy tree)
+    """
+    register_element(element)
+    for child in getattr(element, 'children', []):
+        register_tree(child)
+
+
+def get_element(element_id: int) -> Optional[Any]:
+    return _elements.get(element_id)
+
+
+def is_foreign(element_id: int) -> bool:
+    """
+    Checks if the ID was assigned by another process
+    """
+    return element_id not in _elements and element_id >> NAMESPACE_SHIFT != _namespace
+
+
+def describe(records: Iterable[Tuple[int, Any]]) -> List[Dict[str, Any]]:
+    """
+    Converts provenance records to human-readable form
+    :param records: (element ID, decision) pairs
+    :return: List of dicts with element type, description and decision.
+        Elements of other processes are described by their ID and the ID of the process that assigned it.
+    """
+    result = []
+    for element_id, decision in records:
+        if is_foreign(element_id):
+            result.append({
+                'element': None,
+                'description': None,
+                'element_id': element_id,
+                'process': element_id >> NAMESPACE_SHIFT,
+                'result': decision
+            })
+            continue
+        element = get_element(element_id)
+        result.append({
+            'element': getattr(element, 'element_type', None),
+            'description': getattr(element, 'description', None),
+            'result': decision
+        })
+    return result
+# EOF
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Request class
+Request classes
 """
 __author__ = "Yuriy Petrovskiy"
 __copyright__ = "Copyright 2020, SABAC"
@@ -10,22 +10,141 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
+import time
+from collections import ChainMap
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional
+
+from .utils import get_path_accessor
+
+# Value of attributes that could not be resolved from root objects
+_MISSING = object()
+
 
 class Request:
-    def __init__(self, attributes, return_policy_id_list=False):
-        if attributes and isinstance(attributes, dict) and len(attributes) > 0:
-            self.attributes = attributes
+    def __init__(self, attributes, return_policy_id_list=False, deadline: Optional[float] = None):
+        """
+        :param attributes: Request context
+        :param return_policy_id_list: Should response contain a list of policies that were used
+        :param deadline: time.monotonic() value after which evaluation is interrupted
+            and the decision is indeterminate
+        """
+        if attributes and isinstance(attributes, Mapping) and len(attributes) > 0:
+            # Caller data is never modified during evaluation.
+            # Attributes resolved by PIP are stored in a per-request layer over the original context.
+            self.context = attributes
+            self.attributes = ChainMap({}, attributes)
         else:  # pragma: no cover
             raise ValueError("Request should contain attributes: %s given." % attributes)
         self.return_policy_id_list = return_policy_id_list
+        # Results of shared constraints evaluation (see SharedConstraint)
+        self.match_cache = {}
+        # RequestBitmap of targets rejected by the PDP matcher (see bitmap module)
+        self.target_bitmap = None
+        # EvaluationContext that reuses outcomes of the previous requests (see incremental module)
+        self.evaluation_context = None
+        # PolicyCoverage instance if the request is recorded for coverage
+        self.coverage = None
+        self.deadline = deadline
+        # Set when any part of the evaluation was skipped because of the deadline
+        self.deadline_exceeded = False
+
+    def is_expired(self) -> bool:
+        """
+        Checks if the request deadline is exceeded
+        """
+        if self.deadline is not None and not self.deadline_exceeded and time.monotonic() >= self.deadline:
+            self.deadline_exceeded = True
+        return self.deadline_exceeded
+
+    def get_remaining_time(self) -> Optional[float]:
+        """
+        :return: Seconds left before the deadline or None if request has no deadline
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    @property
+    def resolved_attributes(self) -> dict:
+        """
+        Attributes that were resolved during evaluation (absent in the original context)
+        """
+        return self.attributes.maps[0]
 
     def __repr__(self):
-        result = "<Request data:"
-        for key, value in self.attributes.items():
-            result += "\n  %s: %s" % (key, value)
-        result += "\n>"
-        return result
+        lines = ["<Request data:"]
+        lines.extend(f"  {key}: {value}" for key, value in self.attributes.items())
+        lines.append(">")
+        return "\n".join(lines)
 
     def to_json(self):
-        return self.attributes
+        return dict(self.attributes)
+
+
+class ObjectAttributes(Mapping):
+    """
+    Read-only attributes of root objects. Dotted attribute names (e.g. `subject.department.name`)
+    are resolved from the root objects with compiled path accessors (see utils.get_path_accessor)
+    on the first access and memoized. Only names of the root objects are iterated.
+    """
+
+    def __init__(self, roots: Dict[str, Any]):
+        self.roots = roots
+        # Resolved values by attribute name (_MISSING for unresolvable names)
+        self._values: Dict[str, Any] = {}
+
+    def resolve(self, name: str) -> Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        roots = self.roots
+        value = roots.get(name, _MISSING)
+        if value is _MISSING and isinstance(name, str):
+            # Looking for the longest root name that is a prefix of the path
+            position = len(name)
+            while True:
+                position = name.rfind('.', 0, position)
+                if position < 0:
+                    break
+                root_name = name[:position]
+                if root_name in roots:
+                    value = get_path_accessor(name[position + 1:].split('.'))(roots[root_name], _MISSING)
+                    break
+        self._values[name] = value
+        return value
+
+    def __getitem__(self, name: str) -> Any:
+        value = self.resolve(name)
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name: object) -> bool:
+        return self.resolve(name) is not _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.roots)
+
+    def __len__(self) -> int:
+        return len(self.roots)
+
+
+class ObjectRequest(Request):
+    """
+    Request over domain objects (e.g. ObjectRequest(subject=user, resource=document, action='view')).
+    Objects are not serialized: attributes used by policies are resolved from them on demand
+    (see ObjectAttributes), so request is built in constant time.
+    """
+
+    def __init__(self, return_policy_id_list=False, deadline: Optional[float] = None, **roots):
+        """
+        :param return_policy_id_list: Should response contain a list of policies that were used
+        :param deadline: time.monotonic() value after which evaluation is interrupted
+        :param roots: Root objects (and plain attribute values) by name
+        """
+        Request.__init__(
+            self, ObjectAttributes(roots), return_policy_id_list=return_policy_id_list, deadline=deadline
+        )
 # EOF
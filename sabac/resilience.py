@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Protection of PIP from slow or failing information providers
+
+Provider may declare (as class attributes, see InformationProvider):
+- timeout - maximal time of a single fetch. Fetches are run by threads of the provider own executor
+  (max_concurrency threads or the default number), so calls that hang affect only their provider;
+- max_concurrency - maximal number of simultaneous fetches (bulkhead);
+- failure_threshold and recovery_timeout - circuit breaker: after failure_threshold consecutive failures
+  the provider is not called for recovery_timeout seconds, then a single trial call is allowed;
+- failure_outcome and fallback_value - result of a failed, timed out or rejected fetch.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from enum import Enum, auto
+from typing import Any, Callable, Dict, Optional
+
+from .exceptions import AttributeUnavailableException
+
+# Provider failure outcomes
+FAILURE_OUTCOME_FALLBACK = 'fallback'
+FAILURE_OUTCOME_INDETERMINATE = 'indeterminate'
+
+
+class CircuitState(Enum):
+    CLOSED = auto()
+    OPEN = auto()
+    HALF_OPEN = auto()
+
+
+def is_guarded(provider) -> bool:
+    """
+    Checks if provider declares any protection settings
+    """
+    return (
+        provider.timeout is not None
+        or provider.max_concurrency is not None
+        or provider.failure_threshold is not None
+    )
+
+
+class ProviderGuard:
+    """
+    Enforces timeout, concurrency limit and circuit breaker for a single provider
+    """
+
+    def __init__(self, provider, on_state_change: Optional[Callable] = None):
+        """
+        :param provider: InformationProvider subclass
+        :param on_state_change: Callback called as on_state_change(provider, old_state, new_state)
+        """
+        self.provider = provider
+        self.on_state_change = on_state_change
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_progress = False
+        self.counters = {'calls': 0, 'successes': 0, 'failures': 0, 'timeouts': 0, 'rejections': 0}
+        self._lock = threading.Lock()
+        self._semaphore = None
+        if provider.max_concurrency is not None:
+            self._semaphore = threading.BoundedSemaphore(provider.max_concurrency)
+        # Threads used to enforce the timeout (created on the first call)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.provider.max_concurrency,
+                    thread_name_prefix=f"sabac-provider-{self.provider.__name__}"
+                )
+            return self._executor
+
+    def fetch(self, request, attribute_name: str) -> Any:
+        """
+        Fetches value from the provider
+        :return: Provider result or fallback value
+        :raise AttributeUnavailableException: Provider failed and failure outcome is indeterminate
+        """
+        return self.call(lambda: self.provider.fetch(request), attribute_name, self.provider.fallback_value)
+
+    def call(self, function: Callable[[], Any], attribute_name: str, fallback_value: Any = None) -> Any:
+        """
+        Calls provider function (e.g. fetch or fetch_many) with protection
+        :param function: Function without arguments that calls the provider
+        :param attribute_name: Name of fetched attribute (for error messages)
+        :param fallback_value: Result of failed call if provider failure outcome is fallback
+        """
+        if not self._allow_call():
+            return self._fail(attribute_name, 'rejections', "circuit is open", fallback_value)
+
+        if self._semaphore is not None and not self._semaphore.acquire(blocking=False):
+            self._finish_trial()
+            return self._fail(attribute_name, 'rejections', "concurrency limit reached", fallback_value)
+
+        self._count('calls')
+        timed_out = False
+        try:
+            if self.provider.timeout is None:
+                result = self._call(function)
+            else:
+                # Semaphore is released by the call itself, so the limit applies while it is running
+                try:
+                    future = self.get_executor().submit(self._call, function)
+                except Exception:
+                    if self._semaphore is not None:
+                        self._semaphore.release()
+                    raise
+                try:
+                    result = future.result(timeout=self.provider.timeout)
+                except FutureTimeoutError:
+                    if future.done():
+                        # Completed right after the timeout or raised TimeoutError itself
+                        result = future.result()
+                    else:
+                        timed_out = True
+        except Exception as e:
+            self._record_failure()
+            return self._fail(attribute_name, 'failures', f"{e.__class__.__name__}: {e}", fallback_value)
+
+        # Failure is reported outside of the handler above, so AttributeUnavailableException is not counted twice
+        if timed_out:
+            self._record_failure()
+            return self._fail(attribute_name, 'timeouts', f"timeout {self.provider.timeout}s", fallback_value)
+        self._record_success()
+        return result
+
+    def _call(self, function: Callable[[], Any]) -> Any:
+        try:
+            return function()
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _allow_call(self) -> bool:
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.OPEN:
+                if time.monotonic() - self.opened_at < self.provider.recovery_timeout:
+                    return False
+                self._set_state(CircuitState.HALF_OPEN)
+            # Half-open: single trial call
+            if self.trial_in_progress:
+                return False
+            self.trial_in_progress = True
+            return True
+
+    def _finish_trial(self) -> None:
+        with self._lock:
+            self.trial_in_progress = False
+
+    def _record_success(self) -> None:
+        with self._lock:
+            self.counters['successes'] += 1
+            self.consecutive_failures = 0
+            self.trial_in_progress = False
+            if self.state != CircuitState.CLOSED:
+                self._set_state(CircuitState.CLOSED)
+
+    def _record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self.trial_in_progress = False
+            threshold = self.provider.failure_threshold
+            if self.state == CircuitState.HALF_OPEN or (
+                threshold is not None and self.state == CircuitState.CLOSED
+                and self.consecutive_failures >= threshold
+            ):
+                self.opened_at = time.monotonic()
+                self._set_state(CircuitState.OPEN)
+
+    def _set_state(self, state: CircuitState) -> None:
+        # Called with the lock held
+        old_state = self.state
+        self.state = state
+        logging.info(f"Information provider {self.provider.__name__} circuit state: {old_state.name} -> {state.name}.")
+        if self.on_state_change is not None:
+            self.on_state_change(self.provider, old_state, state)
+
+    def _fail(self, attribute_name: str, counter: str, reason: str, fallback_value: Any) -> Any:
+        self._count(counter)
+        message = f"Information provider {self.provider.__name__} failed to fetch `{attribute_name}`: {reason}."
+        if self.provider.failure_outcome == FAILURE_OUTCOME_FALLBACK:
+            logging.debug(message)
+            return fallback_value
+        raise AttributeUnavailableException(attribute_name=attribute_name, message=message)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self.counters)
+            result['state'] = self.state.name
+        return result
+# EOF
@@ -11,11 +11,11 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
-import copy
 from dataclasses import dataclass, field
 from typing import Dict, Any, List
 
 from .constants import *
+from .provenance import describe
 
 
 @dataclass
@@ -33,9 +33,16 @@ class Response:
         self.obligations = []
         # Advices to execute
         self.advices = []
-        # Policies that were involved in the decision
+        # Policies that were involved in the decision: (element ID, decision) pairs, see policy_list
         self.polices = []
 
+    @property
+    def policy_list(self) -> List[Dict[str, Any]]:
+        """
+        Human-readable list of policy elements that were involved in the decision
+        """
+        return describe(self.polices)
+
     def to_json(self) -> Dict[str, Any]:
         result = {
             'decision': self.decision,
@@ -48,16 +55,18 @@ class Response:
             result['advices'] = self.advices
 
         if len(self.polices) > 0:
-            result['polices'] = self.polices
+            result['polices'] = self.policy_list
 
         return result
 
     def copy(self):
         new_copy = Response(self.request)  # Adding reference to a request object
         new_copy.decision = self.decision
-        new_copy.obligations = copy.deepcopy(self.obligations)
-        new_copy.advices = copy.deepcopy(self.advices)
-        new_copy.polices = copy.deepcopy(self.polices)
+        # Actions are shared policy objects and provenance records are immutable tuples,
+        # so copying lists is enough
+        new_copy.obligations = list(self.obligations)
+        new_copy.advices = list(self.advices)
+        new_copy.polices = list(self.polices)
         return new_copy
 
     def join_data(self, other_request, prepend=False):
@@ -79,19 +88,15 @@ class Response:
         self.advices.append(advice)
 
     def __repr__(self):
-        result = f"<Response decision: {self.decision}"
-        if len(self.polices) > 0:
-            result += "\n  Policies: "
-            for policy in self.polices:
-                result += f"\n    {policy}"
-        if len(self.obligations) > 0:
-            result += "\n  Obligations: "
-            for obligation in self.obligations:
-                result += f"\n    {obligation}"
-        if len(self.advices) > 0:
-            result += "\n  Advices: "
-            for advice in self.advices:
-                result += f"\n    {advice}"
-        result += "\n>"
-        return result
+        lines = [f"<Response decision: {self.decision}"]
+        for title, items in (
+            ("Policies", self.policy_list),
+            ("Obligations", self.obligations),
+            ("Advices", self.advices),
+        ):
+            if len(items) > 0:
+                lines.append(f"  {title}: ")
+                lines.extend(f"    {item}" for item in items)
+        lines.append(">")
+        return "\n".join(lines)
 # EOF
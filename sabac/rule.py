@@ -20,30 +20,39 @@ __email__ = "yuriy.petrovskiy@gmail.com"
 
 import logging
 from dataclasses import dataclass
+from collections.abc import Mapping
 from typing import Optional
 
+from .compact import Constraints
 from .constants import *
+from .operator_evaluators import prepare_constraints
 from .policy_element import PolicyElement
 from .response import Response
 from .request import Request
-from .utils import logging_by_level_name
+from .utils import add_slots, logging_by_level_name
 
 
+@add_slots
 @dataclass(init=False)
 class Rule(PolicyElement):
     effect: RuleEvaluationResult = RuleEvaluationResult.INDETERMINATE
-    condition: Optional[dict] = None
+    condition: Optional[Mapping] = None
     debug: Optional[str] = None
 
+    element_type = 'rule'
+
     def __init__(self, json_data=None):
-        super().__init__(json_data=json_data)
+        self.effect = RuleEvaluationResult.INDETERMINATE
+        self.condition = None
+        self.debug = None
+        PolicyElement.__init__(self, json_data=json_data)
 
     def to_json(self):
         result = PolicyElement.to_json(self)
         if self.condition is not None:
-            result['condition'] = self.condition
+            result['condition'] = dict(self.condition)
         if self.effect is not None:
-            result['effect'] = self.effect
+            result['effect'] = self.effect.name
         return result
 
     def update_from_json(self, json_data: dict) -> None:
@@ -59,35 +68,44 @@ class Rule(PolicyElement):
             raise ValueError(f'No effect in rule: {json_data}')
 
         if 'condition' in json_data:
-            self.condition = json_data['condition']
+            condition = json_data['condition']
+            self.condition = Constraints(condition) if isinstance(condition, dict) else condition
+            prepare_constraints(self.condition)
         if 'debug' in json_data:
             self.debug = json_data['debug']
 
+    @property
+    def indeterminate_decision(self) -> RuleEvaluationResult:
+        if self.effect == RESULT_PERMIT:
+            return RESULT_INDETERMINATE_P
+        elif self.effect == RESULT_DENY:
+            return RESULT_INDETERMINATE_D
+        else:
+            logging.error("Incorrect rule effect value: '%s'", self.effect)
+            raise ValueError("Incorrect rule effect value")
+
     def get_conditioned_decision(self, request: Request) -> RuleEvaluationResult:
         result = RuleEvaluationResult.INDETERMINATE
         condition_result = None
         try:
-            condition_result = self.context_match(self.condition, request)
+            if request.evaluation_context is not None:
+                condition_result = request.evaluation_context.match(self.condition, request)
+            else:
+                condition_result = self.context_match(self.condition, request)
         except Exception as e:
             logging.warning(
                 f"Exception occurred while evaluating rule {self} in condition evaluation: {str(e)}"
             )
-
-            if self.effect == RuleEffect.PERMIT:
-                result = RESULT_INDETERMINATE_P
-            elif self.effect == RuleEffect.DENY:
-                result = RESULT_INDETERMINATE_D
-            else:
-                logging.error("Incorrect rule effect value: '%s'", self.effect)
-                raise ValueError("Incorrect rule effect value")
-
-            return result
+            return self.indeterminate_decision
 
         if not isinstance(condition_result, bool):  # pragma: no cover
             raise ValueError(
                 f"Invalid condition evaluation result: ({condition_result.__class__.__name__}){condition_result}"
             )
 
+        if request.coverage is not None:
+            request.coverage.record_condition(self, condition_result)
+
         if condition_result:
             result = self.effect
         elif condition_result:
@@ -99,7 +117,12 @@ class Rule(PolicyElement):
         response = Response(request, decision=RESULT_NOT_APPLICABLE)
 
         # Checking target matches request
-        if self.check_target(request) is True:
+        target_matched = self.safe_check_target(request)
+        if target_matched is None:
+            response.decision = self.indeterminate_decision
+            return response
+
+        if target_matched is True:
             if self.condition is not None:
                 # Condition is checked after target because it may contain dynamic data on both sides
                 # and may be more complex to calculate
@@ -112,11 +135,7 @@ class Rule(PolicyElement):
 
             # Recording rule to id list if required
             if request.return_policy_id_list is True and response.decision != RESULT_NOT_APPLICABLE:
-                response.polices.append({
-                    'element': 'rule',
-                    'description': self.description if hasattr(self, 'description') else self,
-                    'result': response.decision
-                })
+                response.polices.append((self.element_id, response.decision))
         if self.debug:
             logging_by_level_name(self.debug,f"Rule evaluation result: {response}")
         return response
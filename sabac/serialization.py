@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Serialization of requests and responses for PEP - PDP communication across processes
+
+Two encodings are supported:
+- JSON (request_to_json/request_from_json, response_to_json/response_from_json);
+- compact versioned binary format (request_to_bytes/request_from_bytes, response_to_bytes/response_from_bytes).
+
+Binary message layout: magic (b'SBC'), format version (1 byte), message kind (1 byte), message fields.
+Every value is a type tag (1 byte) followed by its payload, lengths and integers are varints.
+Dates and datetimes are written as ISO 8601 text with their own tags and are decoded back to date/datetime.
+Integers are limited to MAX_INT_BITS bits. Values of other types are rejected with ValueError.
+
+JSON encoding keeps types of values that JSON does not support as single-key objects:
+{"$uuid": "<UUID>"}, {"$datetime": "<ISO 8601>"} and {"$date": "<ISO 8601>"}, so such objects
+are reserved and decoded back to UUID, datetime and date values.
+Binary decoding works over a memoryview of the source buffer; bytes values are returned as memoryview slices
+(without copying), so the buffer should not be modified while they are used.
+
+Request deadline is sent as the remaining time and converted back to a local deadline on decoding.
+Provenance is sent as (element ID, decision) pairs: element IDs are meaningful only for processes
+that share the policy tree (e.g. forked workers).
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import datetime
+import json
+import struct
+import time
+import uuid
+from enum import Enum
+from typing import Any, Dict, Tuple, Union
+
+from .action import Advice, Obligation
+from .constants import RuleEvaluationResult
+from .request import Request
+from .response import Response
+
+MAGIC = b'SBC'
+FORMAT_VERSION = 1
+
+KIND_REQUEST = 1
+KIND_RESPONSE = 2
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_NEGATIVE_INT = 4
+TAG_FLOAT = 5
+TAG_STR = 6
+TAG_BYTES = 7
+TAG_LIST = 8
+TAG_DICT = 9
+TAG_UUID = 10
+TAG_DATETIME = 11
+TAG_DATE = 12
+
+# Maximal size of integers (varints are limited accordingly when decoded)
+MAX_INT_BITS = 256
+
+# Keys of JSON objects that encode values of other types
+JSON_TYPE_KEYS = {
+    '$uuid': uuid.UUID,
+    '$datetime': datetime.datetime.fromisoformat,
+    '$date': datetime.date.fromisoformat,
+}
+
+_float = struct.Struct('<d')
+_header = MAGIC + bytes([FORMAT_VERSION])
+
+
+class BinaryEncoder:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write_varint(self, value: int) -> None:
+        buffer = self.buffer
+        while value > 0x7F:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    def write_value(self, value: Any) -> None:
+        buffer = self.buffer
+        # Exact type checks first: they are the fastest for the most common values
+        value_type = type(value)
+        if value_type is str:
+            data = value.encode('UTF-8')
+            buffer.append(TAG_STR)
+            self.write_varint(len(data))
+            buffer += data
+        elif value is None:
+            buffer.append(TAG_NONE)
+        elif value is True:
+            buffer.append(TAG_TRUE)
+        elif value is False:
+            buffer.append(TAG_FALSE)
+        elif isinstance(value, int):
+            if value.bit_length() > MAX_INT_BITS:
+                raise ValueError(f"Integer value could not be serialized: more than {MAX_INT_BITS} bits.")
+            if value >= 0:
+                buffer.append(TAG_INT)
+                self.write_varint(value)
+            else:
+                buffer.append(TAG_NEGATIVE_INT)
+                self.write_varint(-value)
+        elif isinstance(value, float):
+            buffer.append(TAG_FLOAT)
+            buffer += _float.pack(value)
+        elif isinstance(value, dict):
+            buffer.append(TAG_DICT)
+            self.write_varint(len(value))
+            for key, item in value.items():
+                self.write_value(key)
+                self.write_value(item)
+        elif isinstance(value, (list, tuple)):
+            buffer.append(TAG_LIST)
+            self.write_varint(len(value))
+            for item in value:
+                self.write_value(item)
+        elif isinstance(value, str):
+            self.write_value(str(value))
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            data = bytes(value)
+            buffer.append(TAG_BYTES)
+            self.write_varint(len(data))
+            buffer += data
+        elif isinstance(value, uuid.UUID):
+            buffer.append(TAG_UUID)
+            buffer += value.bytes
+        elif isinstance(value, Enum):
+            self.write_value(value.name)
+        elif isinstance(value, (datetime.datetime, datetime.date)):
+            data = value.isoformat().encode('ascii')
+            buffer.append(TAG_DATETIME if isinstance(value, datetime.datetime) else TAG_DATE)
+            self.write_varint(len(data))
+            buffer += data
+        else:
+            raise ValueError(f"Value of type {value.__class__.__name__} could not be serialized.")
+
+
+class BinaryDecoder:
+    def __init__(self, data: Union[bytes, bytearray, memoryview]):
+        self.view = memoryview(data)
+        self.position = 0
+
+    def read_header(self, kind: int) -> None:
+        if len(self.view) < 5 or bytes(self.view[:3]) != MAGIC:
+            raise ValueError("Not a SABAC binary message.")
+        if self.view[3] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported SABAC binary format version: {self.view[3]}.")
+        if self.view[4] != kind:
+            raise ValueError(f"Unexpected SABAC binary message kind: {self.view[4]}.")
+        self.position = 5
+
+    def read_byte(self) -> int:
+        position = self.position
+        if position >= len(self.view):
+            raise ValueError("Truncated SABAC binary message.")
+        self.position = position + 1
+        return self.view[position]
+
+    def read_varint(self) -> int:
+        view = self.view
+        size = len(view)
+        result = 0
+        shift = 0
+        while True:
+            if self.position >= size:
+                raise ValueError("Truncated SABAC binary message.")
+            byte = view[self.position]
+            self.position += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+            if shift >= MAX_INT_BITS + 7:
+                raise ValueError("Too long integer in SABAC binary message.")
+
+    def read_slice(self, length: int) -> memoryview:
+        start = self.position
+        self.position += length
+        if self.position > len(self.view):
+            raise ValueError("Truncated SABAC binary message.")
+        return self.view[start:self.position]
+
+    def read_value(self) -> Any:
+        tag = self.read_byte()
+        if tag == TAG_STR:
+            return str(self.read_slice(self.read_varint()), 'UTF-8')
+        elif tag == TAG_INT:
+            return self.read_varint()
+        elif tag == TAG_DICT:
+            result = {}
+            for _ in range(self.read_varint()):
+                key = self.read_value()
+                result[key] = self.read_value()
+            return result
+        elif tag == TAG_NONE:
+            return None
+        elif tag == TAG_TRUE:
+            return True
+        elif tag == TAG_FALSE:
+            return False
+        elif tag == TAG_LIST:
+            return [self.read_value() for _ in range(self.read_varint())]
+        elif tag == TAG_NEGATIVE_INT:
+            return -self.read_varint()
+        elif tag == TAG_FLOAT:
+            return _float.unpack(self.read_slice(8))[0]
+        elif tag == TAG_BYTES:
+            return self.read_slice(self.read_varint())
+        elif tag == TAG_UUID:
+            return uuid.UUID(bytes=bytes(self.read_slice(16)))
+        elif tag == TAG_DATETIME:
+            return datetime.datetime.fromisoformat(str(self.read_slice(self.read_varint()), 'ascii'))
+        elif tag == TAG_DATE:
+            return datetime.date.fromisoformat(str(self.read_slice(self.read_varint()), 'ascii'))
+        raise ValueError(f"Unknown value tag {tag} in SABAC binary message.")
+
+
+# Conversion to basic types
+
+def request_to_basic(request: Request) -> Tuple[bool, Any, Dict[str, Any]]:
+    """
+    :return: Return policy list flag, remaining time (or None) and attributes
+    """
+    return request.return_policy_id_list, request.get_remaining_time(), dict(request.attributes)
+
+
+def request_from_basic(return_policy_id_list: bool, timeout: Any, attributes: Dict[str, Any]) -> Request:
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    return Request(attributes, return_policy_id_list=return_policy_id_list, deadline=deadline)
+
+
+def response_to_basic(response: Response) -> Tuple[str, list, list, list]:
+    """
+    :return: Decision name, obligations, advices and provenance records
+    """
+    return (
+        response.decision.name,
+        [obligation.to_json() for obligation in response.obligations],
+        [advice.to_json() for advice in response.advices],
+        [[element_id, decision.name] for element_id, decision in response.polices],
+    )
+
+
+def response_from_basic(decision: str, obligations: list, advices: list, polices: list, request=None) -> Response:
+    response = Response(request, decision=RuleEvaluationResult[decision])
+    response.obligations = [Obligation(obligation) for obligation in obligations]
+    response.advices = [Advice(advice) for advice in advices]
+    response.polices = [(element_id, RuleEvaluationResult[decision]) for element_id, decision in polices]
+    return response
+
+
+# JSON
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.name
+    elif isinstance(value, uuid.UUID):
+        return {'$uuid': str(value)}
+    elif isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    elif isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+    elif hasattr(value, 'to_json'):
+        return value.to_json()
+    raise TypeError(f"Value of type {value.__class__.__name__} could not be serialized.")
+
+
+def _json_object_hook(json_object: dict) -> Any:
+    if len(json_object) == 1:
+        key, value = next(iter(json_object.items()))
+        if key in JSON_TYPE_KEYS and isinstance(value, str):
+            return JSON_TYPE_KEYS[key](value)
+    return json_object
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=_json_default)
+
+
+def _loads(data: Union[str, bytes]) -> Any:
+    return json.loads(data, object_hook=_json_object_hook)
+
+
+def request_to_json(request: Request) -> str:
+    return_policy_id_list, timeout, attributes = request_to_basic(request)
+    return _dumps({
+        'version': FORMAT_VERSION,
+        'return_policy_id_list': return_policy_id_list,
+        'timeout': timeout,
+        'attributes': attributes,
+    })
+
+
+def request_from_json(data: Union[str, bytes]) -> Request:
+    json_data = _loads(data)
+    return request_from_basic(json_data['return_policy_id_list'], json_data['timeout'], json_data['attributes'])
+
+
+def response_to_json(response: Response) -> str:
+    decision, obligations, advices, polices = response_to_basic(response)
+    return _dumps({
+        'version': FORMAT_VERSION,
+        'decision': decision,
+        'obligations': obligations,
+        'advices': advices,
+        'polices': polices,
+    })
+
+
+def response_from_json(data: Union[str, bytes], request=None) -> Response:
+    json_data = _loads(data)
+    return response_from_basic(
+        json_data['decision'], json_data['obligations'], json_data['advices'], json_data['polices'], request
+    )
+
+
+# Binary
+
+def request_to_bytes(request: Request) -> bytes:
+    encoder = BinaryEncoder()
+    encoder.buffer += _header
+    encoder.buffer.append(KIND_REQUEST)
+    for value in request_to_basic(request):
+        encoder.write_value(value)
+    return bytes(encoder.buffer)
+
+
+def request_from_bytes(data: Union[bytes, bytearray, memoryview]) -> Request:
+    decoder = BinaryDecoder(data)
+    decoder.read_header(KIND_REQUEST)
+    return request_from_basic(decoder.read_value(), decoder.read_value(), decoder.read_value())
+
+
+def response_to_bytes(response: Response) -> bytes:
+    encoder = BinaryEncoder()
+    encoder.buffer += _header
+    encoder.buffer.append(KIND_RESPONSE)
+    encoder.buffer.append(response.decision.value)
+    encoder.write_value([obligation.to_json() for obligation in response.obligations])
+    encoder.write_value([advice.to_json() for advice in response.advices])
+    # Provenance records are written as flat (element ID, decision value) pairs
+    encoder.write_varint(len(response.polices))
+    for element_id, decision in response.polices:
+        encoder.write_varint(element_id)
+        encoder.buffer.append(decision.value)
+    return bytes(encoder.buffer)
+
+
+def response_from_bytes(data: Union[bytes, bytearray, memoryview], request=None) -> Response:
+    decoder = BinaryDecoder(data)
+    decoder.read_header(KIND_RESPONSE)
+    response = Response(request, decision=RuleEvaluationResult(decoder.read_byte()))
+    response.obligations = [Obligation(obligation) for obligation in decoder.read_value()]
+    response.advices = [Advice(advice) for advice in decoder.read_value()]
+    polices = []
+    for _ in range(decoder.read_varint()):
+        element_id = decoder.read_varint()
+        polices.append((element_id, RuleEvaluationResult(decoder.read_byte())))
+    response.polices = polices
+    return response
+# EOF
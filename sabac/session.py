@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Evaluation sessions specialized for fixed attributes
+
+Web requests often perform many authorization checks for the same subject. Session takes a fixed part
+of the context (usually subject and environment attributes), resolves attributes that depend only on it
+and builds a residual policy tree:
+- target and condition constraints of fixed attributes are decided once and removed;
+- elements with a decided not matching target are replaced with NotApplicableElement placeholders
+  (see policy_element.MAX_PLACEHOLDERS);
+- subtrees without changes are shared with the original tree, so element IDs (provenance) are kept.
+
+A constraint is decided only if its attribute and all attributes referenced by its expressions are fixed.
+Constraints that precede undecided ones keep their order, so indeterminate targets keep their result.
+The residual tree is rebuilt when policies are changed. PDP matcher and coverage are not used by sessions.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import copy
+import logging
+import time
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .compact import Constraints
+from .exceptions import AttributeUnavailableException
+from .policy import Policy
+from .policy_element import MAX_PLACEHOLDERS, NotApplicableElement, PolicyElement
+from .policy_element import get_referenced_attributes, get_references
+from .policy_set import PolicySet
+from .request import Request
+from .response import Response
+from .rule import Rule
+from .utils import freeze
+
+_placeholders = [NotApplicableElement(description="Items pruned by session") for _ in range(MAX_PLACEHOLDERS)]
+
+
+class EvaluationSession:
+    """
+    Evaluation of requests that share fixed attributes (see module description)
+    """
+
+    def __init__(self, pep, fixed_context: dict):
+        """
+        :param pep: Policy Enforcement Point
+        :param fixed_context: Attributes shared by all requests of the session (e.g. subject attributes)
+        """
+        self.pep = pep
+        self.fixed_context = dict(fixed_context)
+        # Fixed and resolved attributes that requests are based on
+        self.attributes: dict = {}
+        self.root_policy_set: Optional[PolicyElement] = None
+        self._policies: Optional[tuple] = None
+        self._request: Optional[Request] = None
+        self.request_attributes: List[str] = []
+
+    def is_fixed(self, attribute_name: str, visited: Optional[Set[str]] = None) -> bool:
+        """
+        Checks if attribute value depends only on fixed attributes
+        """
+        if attribute_name in self.fixed_context:
+            return True
+        if visited is None:
+            visited = set()
+        if attribute_name in visited:
+            return False
+        visited.add(attribute_name)
+        providers = self.pep.PDP.PIP.get_providers(attribute_name)
+        if providers:
+            return all(
+                self.is_fixed(required_attribute, visited)
+                for provider in providers for required_attribute in provider.required_attributes
+            )
+        parts = attribute_name.split('.')
+        return len(parts) > 1 and parts[0] in self.fixed_context
+
+    def build(self) -> None:
+        """
+        Resolves attributes and builds the residual policy tree for current policies
+        """
+        pdp = self.pep.PDP
+        root_policy_set = pdp.PAP.root_policy_set
+        self._policies = (root_policy_set, getattr(pdp.PAP, 'version', None))
+        request = Request(dict(self.fixed_context))
+        request.PDP = pdp
+        self._request = request
+
+        for name in sorted(get_referenced_attributes(root_policy_set)):
+            if name not in request.attributes and self.is_fixed(name):
+                try:
+                    request.attributes[name] = pdp.PIP.get_attribute_value(name, request)
+                except AttributeUnavailableException as e:
+                    logging.warning(f"Attribute of the session is not resolved: {e.message}")
+        self.attributes = dict(request.attributes)
+
+        root = self.specialize(root_policy_set)
+        self.root_policy_set = root if root is not None else _placeholders[0]
+        self._request = None
+        # Attributes that are resolved for every request, attributes required by other ones go first
+        self.request_attributes = sorted(
+            get_referenced_attributes(self.root_policy_set) - self.attributes.keys(),
+            key=lambda name: (len(pdp.PIP.get_attribute_dependencies(name)), name)
+        )
+
+    def decide(self, key: str, constraint: Any) -> Optional[bool]:
+        """
+        :return: Result of the constraint or None if it depends on not fixed attributes
+        """
+        if key not in self.attributes or not get_references(constraint).issubset(self.attributes):
+            return None
+        try:
+            return PolicyElement.context_match({key: constraint}, self._request)
+        except Exception:
+            # Error is reported when the constraint is evaluated for a request
+            return None
+
+    def specialize_requirements(self, requirements: Mapping, prune: bool = True) -> Tuple[bool, Optional[Mapping]]:
+        """
+        :param prune: Should requirements be reported as not matching if a decided constraint does not match
+        :return: Requirements could match, residual requirements (None if all constraints matched)
+        """
+        residual = {}
+        for key, constraint in requirements.items():
+            decision = self.decide(key, constraint)
+            if decision is True:
+                continue
+            if decision is False and prune and not residual:
+                return False, None
+            residual[key] = constraint
+        if len(residual) == len(requirements):
+            return True, requirements
+        return True, Constraints(residual) if residual else None
+
+    def specialize(self, element: PolicyElement) -> Optional[PolicyElement]:
+        """
+        :return: Residual element or None if it is not applicable for the session
+        """
+        target = element.target
+        if target and isinstance(target, Mapping):
+            matched, target = self.specialize_requirements(target)
+            if not matched:
+                return None
+        element_class = type(element)
+        if element_class not in (Rule, Policy, PolicySet):
+            # Other elements (e.g. lazily loaded items) are only pruned
+            return element
+
+        changes = {}
+        if target is not element.target:
+            changes['target'] = target
+        if element_class is Rule:
+            if isinstance(element.condition, Mapping):
+                # Not matching condition makes rule decision indeterminate, so such conditions are kept
+                _, condition = self.specialize_requirements(element.condition, prune=False)
+                if condition is not element.condition:
+                    changes['condition'] = condition
+        else:
+            children = []
+            pruned = 0
+            for child in element.children:
+                residual_child = self.specialize(child)
+                if residual_child is None:
+                    pruned += 1
+                else:
+                    children.append(residual_child)
+            if pruned or any(child is not original for child, original in zip(children, element.children)):
+                changes['children'] = children + _placeholders[:min(pruned, MAX_PLACEHOLDERS)]
+
+        if not changes:
+            return element
+        result = copy.copy(element)
+        for name, value in changes.items():
+            setattr(result, name, value)
+        if element_class is PolicySet:
+            result.index = None
+        return result
+
+    def check_policies(self) -> None:
+        """
+        Rebuilds the session if policies were changed
+        """
+        pap = self.pep.PDP.PAP
+        if self._policies is None or self._policies[0] is not pap.root_policy_set \
+                or self._policies[1] != getattr(pap, 'version', None):
+            self.build()
+
+    def prefetch(self, contexts: List[dict]) -> None:
+        """
+        Fetches provider attributes for several requests at once: every attribute with a single provider
+        is fetched by one fetch_many call for the distinct values of its required attributes.
+        Fetched values are added to the contexts. Attributes that could not be fetched are resolved
+        for every request as usual.
+        """
+        self.check_policies()
+        pip = self.pep.PDP.PIP
+        for name in self.request_attributes:
+            providers = pip.get_providers(name)
+            if len(providers) != 1:
+                continue
+            provider = providers[0]
+            # Required attributes by their values
+            fetches: Dict[Any, dict] = {}
+            keys = []
+            for context in contexts:
+                if name in context:
+                    continue
+                attributes = {}
+                for required_attribute in provider.required_attributes:
+                    if required_attribute in context:
+                        attributes[required_attribute] = context[required_attribute]
+                    elif required_attribute in self.attributes:
+                        attributes[required_attribute] = self.attributes[required_attribute]
+                    else:
+                        break
+                else:
+                    key = tuple(freeze(attributes[required_attribute]) for required_attribute in provider.required_attributes)
+                    try:
+                        fetches.setdefault(key, attributes)
+                    except TypeError:
+                        continue
+                    keys.append((context, key))
+            if not fetches:
+                continue
+            try:
+                values = dict(zip(fetches, pip.fetch_many(provider, name, list(fetches.values()))))
+            except Exception as e:
+                logging.warning(f"Attribute `{name}` was not prefetched: {e.__class__.__name__}: {e}")
+                continue
+            for context, key in keys:
+                context[name] = values[key]
+
+    def get_result(self, context: dict, return_policy_id_list=False, timeout: Optional[float] = None) -> Response:
+        """
+        Evaluates request of the session
+        :param context: Request attributes that are not fixed (e.g. resource attributes and action)
+        :param timeout: Optional evaluation time budget in seconds (see Request.deadline)
+        """
+        self.check_policies()
+        for name in context.keys() & self.attributes.keys():
+            if context[name] != self.attributes[name]:
+                raise ValueError(f"Attribute `{name}` is fixed for the session.")
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        request = Request(
+            attributes={**self.attributes, **context}, return_policy_id_list=return_policy_id_list, deadline=deadline
+        )
+        request.PDP = self.pep.PDP
+        started = time.perf_counter()
+        result = self.root_policy_set.evaluate(request)
+        if self.pep.decision_log is not None:
+            self.pep.decision_log.record(request, result, time.perf_counter() - started)
+        return result
+
+    def evaluate(self, context: dict, return_policy_id_list=False, timeout: Optional[float] = None) -> bool:
+        """
+        Same as PEP.evaluate for the session request
+        :return:
+            True if a policy evaluation result is permit,
+            False if deny
+        """
+        return self.pep.evaluate_result(self.get_result(context, return_policy_id_list, timeout))
+# EOF
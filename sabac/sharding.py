@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tenant-sharded Policy Decision Point
+
+Top-level items of the root policy set are partitioned by the value of a shard key attribute
+(e.g. `tenant.id`) required by their targets. Every shard is evaluated by a separate worker process
+that builds only its part of the policy tree. Items that are not bound to shard key values are kept in all shards.
+
+Items removed from a shard can not be applicable to requests routed to it, so they are replaced
+with at most two NotApplicableElement placeholders: results of implemented algorithms do not depend
+on the number of not applicable results beyond that.
+
+ShardedPDP has the same evaluate interface as PDP, so any PEP may be used as a router in front of it.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import json
+import logging
+import multiprocessing
+import threading
+import zlib
+from typing import Any, List, Optional, Set, Tuple
+
+from .constants import RESULT_INDETERMINATE_DP
+from .exceptions import AttributeUnavailableException
+from .PAP import PAP
+from .PDP import PDP
+from .PIP import PIP
+from .policy_element import MAX_PLACEHOLDERS, NotApplicableElement
+from .policy_set import PolicySet
+from .request import Request
+from .response import Response
+from .serialization import request_from_bytes, request_to_bytes, response_from_bytes, response_to_bytes
+
+
+def normalize_shard_value(value: Any) -> Optional[str]:
+    """
+    Converts shard key value to the string that is hashed. Values that are equal in Python (1, 1.0 and True)
+    are placed to the same shard.
+    :return: String or None if value could not be used as a shard key
+    """
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    return None
+
+
+def get_shard(value: Any, shards: int) -> Optional[int]:
+    """
+    :return: Shard number for a shard key value or None if value could not be used as a shard key
+    """
+    normalized_value = normalize_shard_value(value)
+    if normalized_value is None:
+        return None
+    return zlib.crc32(normalized_value.encode('UTF-8')) % shards
+
+
+def get_item_shards(item_data: dict, shard_key: str, shards: int) -> Optional[Set[int]]:
+    """
+    :return: Shards of the policy item (JSON data) or None if item target is not bound to shard key values
+    """
+    target = item_data.get('target')
+    if not isinstance(target, dict) or shard_key not in target:
+        return None
+    constraint = target[shard_key]
+    if isinstance(constraint, dict) and list(constraint) == ['@in'] and isinstance(constraint['@in'], list):
+        values = constraint['@in']
+    else:
+        values = [constraint]
+    result = set()
+    for value in values:
+        shard = get_shard(value, shards)
+        if shard is None:
+            return None
+        result.add(shard)
+    return result
+
+
+def partition_policies(json_data: dict, shard_key: str, shards: int) -> List[Tuple[dict, int]]:
+    """
+    Splits root policy set JSON into shards
+    :return: (policy set JSON, number of removed items) for every shard
+    """
+    items = json_data.get('items', [])
+    shard_items: List[List[dict]] = [[] for _ in range(shards)]
+    for item_data in items:
+        item_shards = get_item_shards(item_data, shard_key, shards)
+        for shard in range(shards):
+            if item_shards is None or shard in item_shards:
+                shard_items[shard].append(item_data)
+
+    result = []
+    for shard in range(shards):
+        shard_data = dict(json_data)
+        shard_data['items'] = shard_items[shard]
+        result.append((shard_data, len(items) - len(shard_items[shard])))
+    return result
+
+
+def build_shard_pdp(shard_data: dict, removed_items: int, pip_instance: PIP) -> PDP:
+    """
+    Builds PDP for a single shard
+    """
+    policy_set = PolicySet(json_data=shard_data)
+    placeholders = [
+        NotApplicableElement(description="Items of other shards")
+        for _ in range(min(removed_items, MAX_PLACEHOLDERS))
+    ]
+    policy_set.items = policy_set.items + placeholders
+    pap = PAP()
+    pap.root_policy_set = policy_set
+    return PDP(pap_instance=pap, pip_instance=pip_instance)
+
+
+def _run_shard_worker(connection, partitions: list, shard: int, pip_instance) -> None:
+    """
+    Worker process main function: builds the shard and evaluates requests until the connection is closed
+    :param partitions: Result of partition_policies inherited from the router. It is cleared (in the worker copy),
+        so only the shard part of policies is kept.
+    """
+    shard_data, removed_items = partitions[shard]
+    partitions.clear()
+    pdp = build_shard_pdp(shard_data, removed_items, pip_instance)
+    del shard_data
+    while True:
+        try:
+            data = connection.recv_bytes()
+        except EOFError:
+            return
+        if not data:
+            return
+        try:
+            response = pdp.evaluate(request_from_bytes(data))
+        except Exception:
+            logging.exception(f"Shard {shard} request evaluation failed.")
+            response = Response(None, decision=RESULT_INDETERMINATE_DP)
+        connection.send_bytes(response_to_bytes(response))
+
+
+class ShardedPDP:
+    """
+    Policy Decision Point that routes requests to shard worker processes by shard key value.
+    Provenance element IDs of responses refer to elements of the worker processes, so the router describes
+    them only by element ID and worker process ID (see provenance.describe).
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        shard_key: str,
+        shards: int,
+        pip_instance: Optional[PIP] = None,
+        encoding: str = 'UTF-8'
+    ):
+        """
+        :param file_name: JSON file with policies (root policy set)
+        :param shard_key: Attribute whose value selects the shard (e.g. 'tenant.id')
+        :param shards: Number of shards (worker processes)
+        :param pip_instance: Policy Information Point. It is inherited by workers (so providers are
+            available there) and is used by router to resolve shard key if it is absent in the request.
+        :param encoding: File encoding
+        """
+        if shards < 1:
+            raise ValueError("Number of shards should be positive.")
+        self.shard_key = shard_key
+        self.shards = shards
+        self.PIP = pip_instance if pip_instance is not None else PIP()
+        with open(file_name, encoding=encoding) as json_file:
+            partitions = partition_policies(json.load(json_file), shard_key, shards)
+
+        self._connections = []
+        self._locks = []
+        # Numbers of responses that are not received yet (requests that exceeded their deadlines)
+        self._pending: List[int] = []
+        self._processes = []
+        # Shards are evaluated in the current process if the platform does not support fork
+        self._local_pdps: Optional[List[PDP]] = None
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self._local_pdps = [
+                build_shard_pdp(shard_data, removed_items, self.PIP)
+                for shard_data, removed_items in partitions
+            ]
+            return
+
+        context = multiprocessing.get_context('fork')
+        for shard in range(shards):
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_run_shard_worker,
+                args=(child_connection, partitions, shard, self.PIP),
+                name=f"sabac-shard-{shard}",
+                daemon=True
+            )
+            process.start()
+            child_connection.close()
+            self._connections.append(parent_connection)
+            self._locks.append(threading.Lock())
+            self._pending.append(0)
+            self._processes.append(process)
+        # Policies are kept only by the workers
+        partitions.clear()
+
+    def get_request_shard(self, request: Request) -> int:
+        """
+        :return: Shard of the request. Requests without usable shard key value may be evaluated by any shard.
+        """
+        value = self.PIP.get_attribute_value(self.shard_key, request)
+        # Keeping resolved value, so it is sent to the worker with other attributes
+        request.attributes[self.shard_key] = value
+        shard = get_shard(value, self.shards)
+        return shard if shard is not None else 0
+
+    def evaluate(self, request: Request, deadline: Optional[float] = None) -> Response:
+        if deadline is not None:
+            request.deadline = deadline
+        try:
+            shard = self.get_request_shard(request)
+        except AttributeUnavailableException as e:
+            logging.warning(f"Shard of the request could not be determined: {e.message}")
+            return Response(request, decision=RESULT_INDETERMINATE_DP)
+
+        if self._local_pdps is not None:
+            return self._local_pdps[shard].evaluate(request)
+
+        try:
+            data = request_to_bytes(request)
+        except ValueError as e:
+            logging.error(f"Request could not be sent to shard {shard}: {e}")
+            return Response(request, decision=RESULT_INDETERMINATE_DP)
+        try:
+            # Connection is used by one request at a time
+            with self._locks[shard]:
+                connection = self._connections[shard]
+                # Responses to requests that exceeded their deadlines are skipped
+                while self._pending[shard]:
+                    if not connection.poll(request.get_remaining_time()):
+                        return self._expire(request, shard)
+                    connection.recv_bytes()
+                    self._pending[shard] -= 1
+                connection.send_bytes(data)
+                if not connection.poll(request.get_remaining_time()):
+                    self._pending[shard] += 1
+                    return self._expire(request, shard)
+                response_data = connection.recv_bytes()
+        except (EOFError, OSError) as e:
+            logging.error(f"Shard {shard} worker failed: {e.__class__.__name__}: {e}")
+            return Response(request, decision=RESULT_INDETERMINATE_DP)
+        return response_from_bytes(response_data, request)
+
+    @staticmethod
+    def _expire(request: Request, shard: int) -> Response:
+        logging.warning(f"Shard {shard} worker did not respond before the request deadline.")
+        request.deadline_exceeded = True
+        return Response(request, decision=RESULT_INDETERMINATE_DP)
+
+    def close(self) -> None:
+        """
+        Stops worker processes
+        """
+        for connection, lock in zip(self._connections, self._locks):
+            with lock:
+                try:
+                    connection.send_bytes(b'')
+                except OSError:
+                    pass
+                connection.close()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+# EOF
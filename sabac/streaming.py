@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming loading of policy files
+
+The root policy set is read incrementally: items are parsed and built one at a time,
+so the whole JSON document is never kept in memory together with the policy tree.
+
+Items whose JSON is at least `lazy_threshold` bytes long may be loaded lazily: only their description
+and target are kept, the rest is read from the file when the target matches a request for the first time.
+Items of a lazily loaded policy set are loaded the same way, so deep subtrees are materialized level by level.
+Lazily loaded items are read again from the same file, so it should not be modified while the policies are used.
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import codecs
+import io
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Optional, TextIO, Tuple
+
+from .constants import RESULT_NOT_APPLICABLE
+from .policy import Policy
+from .policy_element import PolicyElement
+from .policy_set import PolicySet
+from .response import Response
+from .utils import add_slots
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class JSONStreamReader:
+    """
+    Incremental reader of a JSON object from a text file
+    """
+
+    def __init__(self, json_file: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE, encoding: str = 'UTF-8',
+                 base_offset: int = 0):
+        """
+        :param json_file: File opened in text mode
+        :param chunk_size: Number of characters read at once
+        :param encoding: File encoding (used to calculate byte offsets of values)
+        :param base_offset: Byte offset of the data in the file
+        """
+        self.json_file = json_file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+        self._encoder = codecs.getincrementalencoder(encoding)()
+        # Byte offset of the buffer position that was counted last
+        self._counted_position = 0
+        self._counted_bytes = base_offset
+
+    def get_byte_offset(self, position: int) -> int:
+        # Every character is encoded only once
+        if position > self._counted_position:
+            self._counted_bytes += len(self._encoder.encode(self.buffer[self._counted_position:position]))
+            self._counted_position = position
+        return self._counted_bytes
+
+    def read_more(self, size: Optional[int] = None) -> bool:
+        """
+        Appends data from the file to the buffer and drops the part that was already read
+        :return: False if there is no more data
+        """
+        if self.eof:
+            return False
+        if self.position:
+            self.get_byte_offset(self.position)
+            self.buffer = self.buffer[self.position:]
+            self._counted_position -= self.position
+            self.position = 0
+        data = self.json_file.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
+        return True
+
+    def peek(self) -> str:
+        """
+        Skips whitespace
+        :return: Next character or empty string at the end of data
+        """
+        while True:
+            self.position = _whitespace.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                return ''
+
+    def expect(self, *characters: str) -> str:
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(
+                f"Expected {' or '.join(repr(item) for item in characters)} "
+                f"at byte {self.get_byte_offset(self.position)}, got {character!r}."
+            )
+        self.position += 1
+        return character
+
+    def read_value(self) -> Tuple[Any, int, int]:
+        """
+        :return: Value, its byte offset and byte length
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.position)
+                # Number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    break
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Reading at least as much data as the part of the value that is already buffered
+            self.read_more(max(self.chunk_size, len(self.buffer) - self.position))
+        offset = self.get_byte_offset(self.position)
+        length = self.get_byte_offset(end) - offset
+        self.position = end
+        return value, offset, length
+
+    def iter_object(self, stream_key: str) -> Iterator[Tuple[str, Any, int, int]]:
+        """
+        Reads JSON object. Elements of the `stream_key` list are yielded one by one.
+        :return: Iterator of (key, value, byte offset, byte length) for object members and list elements
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key, _, _ = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError(f"Object key expected, got {key!r}.")
+            self.expect(':')
+            if key == stream_key:
+                self.expect('[')
+                if self.peek() == ']':
+                    self.position += 1
+                else:
+                    while True:
+                        yield (key,) + self.read_value()
+                        if self.expect(',', ']') == ']':
+                            break
+            else:
+                yield (key,) + self.read_value()
+            if self.expect(',', '}') == '}':
+                break
+
+
+class PolicyFileSource:
+    """
+    Policy file that lazily loaded items are read from
+    """
+
+    def __init__(self, file_name: str, encoding: str = 'UTF-8', lazy_threshold: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param lazy_threshold: Minimal JSON size of lazily loaded items in bytes (None - items are not lazy)
+        """
+        self.file_name = file_name
+        self.encoding = encoding
+        self.lazy_threshold = lazy_threshold
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.signature = self.get_signature()
+
+    def get_signature(self) -> Tuple[int, int]:
+        stat = os.stat(self.file_name)
+        return stat.st_size, stat.st_mtime_ns
+
+    def read(self, offset: int, length: int) -> str:
+        if self.get_signature() != self.signature:
+            raise ValueError(f"Policy file `{self.file_name}` was changed after it was loaded.")
+        with open(self.file_name, 'rb') as json_file:
+            json_file.seek(offset)
+            return json_file.read(length).decode(self.encoding)
+
+    def build_item(self, item_data: Any, offset: int, length: int) -> Optional[PolicyElement]:
+        if (
+            self.lazy_threshold is not None and length >= self.lazy_threshold
+            and isinstance(item_data, dict) and item_data.get('target')
+            and ('rules' in item_data or 'items' in item_data)
+        ):
+            return LazyPolicyItem(
+                source=self, offset=offset, length=length, is_policy_set='rules' not in item_data, json_data=item_data
+            )
+        return PolicySet.create_policy_item(item_data)
+
+    def build_policy_set(self, reader: JSONStreamReader) -> PolicySet:
+        """
+        Builds policy set item by item
+        """
+        root_data = {}
+        items = []
+        for key, value, offset, length in reader.iter_object('items'):
+            if key == 'items':
+                items.append(self.build_item(value, offset, length))
+            else:
+                root_data[key] = value
+
+        policy_set = PolicySet()
+        PolicyElement.update_from_json(policy_set, root_data)
+        policy_set.algorithm = PolicySet.get_algorithm_from_json(root_data)
+        policy_set.items = items
+        if not items:  # pragma: no cover
+            logging.warning("Policy set should have at least one policy.")
+        return policy_set
+
+    def __deepcopy__(self, memo):
+        # Source is shared by copies of a policy tree
+        return self
+
+
+@add_slots
+@dataclass(repr=False)
+class LazyPolicyItem(PolicyElement):
+    """
+    Policy or policy set of a policy file that is materialized when its target matches a request
+    """
+    source: Optional[PolicyFileSource] = None
+    offset: int = 0
+    length: int = 0
+    is_policy_set: bool = False
+    element: Optional[PolicyElement] = field(default=None, compare=False)
+
+    element_type = 'lazy_item'
+
+    def update_from_json(self, json_data):
+        # Only data required for target check is kept
+        PolicyElement.update_from_json(
+            self, {key: json_data[key] for key in ('description', 'target') if key in json_data}
+        )
+
+    def materialize(self) -> PolicyElement:
+        element = self.element
+        if element is None:
+            with self.source.lock:
+                element = self.element
+                if element is None:
+                    data = self.source.read(self.offset, self.length)
+                    if self.is_policy_set:
+                        reader = JSONStreamReader(
+                            io.StringIO(data), self.source.chunk_size, self.source.encoding, self.offset
+                        )
+                        element = self.source.build_policy_set(reader)
+                    else:
+                        element = Policy(json_data=json.loads(data))
+                    self.element = element
+        return element
+
+    def evaluate(self, request) -> Response:
+        if self.element is None:
+            # Indeterminate target is reported by the materialized element
+            if self.safe_check_target(request) is False:
+                return Response(request, decision=RESULT_NOT_APPLICABLE)
+        try:
+            element = self.materialize()
+        except (OSError, ValueError) as e:
+            logging.error(f"Policy item {self.description} could not be loaded: {e}")
+            return Response(request, decision=self.indeterminate_decision)
+        return element.evaluate(request)
+
+    def to_json(self):
+        return self.materialize().to_json()
+
+
+def load_policy_set(
+    file_name: str,
+    encoding: str = 'UTF-8',
+    lazy_threshold: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> PolicySet:
+    """
+    Loads root policy set from JSON file without reading the whole file at once
+    :param file_name: JSON file with policies
+    :param encoding: File encoding
+    :param lazy_threshold: Minimal JSON size of lazily loaded items in bytes (None - all items are loaded)
+    :param chunk_size: Number of characters read at once
+    """
+    source = PolicyFileSource(file_name, encoding, lazy_threshold, chunk_size)
+    # Newlines are not translated, so byte offsets match the file
+    with open(file_name, encoding=encoding, newline='') as json_file:
+        return source.build_policy_set(JSONStreamReader(json_file, chunk_size, encoding))
+# EOF
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Lazy multi-tenant Policy Administration Point
+
+Only an index of tenants (tenant key value -> source location) is kept in memory.
+Policies of a tenant are loaded when the first request of the tenant is evaluated
+and are evicted when the number of loaded tenants or their source size exceeds the budget.
+
+Every tenant policy item should be targeted on the tenant key value (e.g. {"tenant.id": 5}),
+so items of other tenants are never applicable to a request. Such items are not loaded:
+they are replaced with NotApplicableElement placeholders (see sharding module), so decisions are identical
+to the fully loaded tree with the same items for order-insensitive root algorithms.
+Tenant items are combined after the global items of the root policy set.
+If optimization is enabled, every tenant item is optimized when it is built (see optimizer.optimize_items).
+"""
+__author__ = "Yuriy Petrovskiy"
+__copyright__ = "Copyright 2020, SABAC"
+__credits__ = ["Yuriy Petrovskiy"]
+__license__ = "LGPL"
+__maintainer__ = "Yuriy Petrovskiy"
+__email__ = "yuriy.petrovskiy@gmail.com"
+
+import copy
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from .algorithm import deny_unless_permit
+from .exceptions import AttributeUnavailableException
+from .optimizer import OptimizationReport, optimize_items
+from .PAP import PAP
+from .policy_element import NotApplicableElement
+from .policy_set import PolicySet
+from .provenance import register_tree
+from .response import Response
+from .sharding import MAX_PLACEHOLDERS, normalize_shard_value
+
+
+@dataclass
+class LoadedTenant:
+    items: list
+    size: int
+
+
+class DirectoryTenantSource:
+    """
+    Tenant policies stored in a directory as `<tenant key value>.json` files with a list of policies or policy sets
+    """
+
+    def __init__(self, directory: str, encoding: str = 'UTF-8'):
+        self.directory = directory
+        self.encoding = encoding
+
+    def get_index(self) -> Dict[str, str]:
+        return {
+            file_name[:-len('.json')]: os.path.join(self.directory, file_name)
+            for file_name in os.listdir(self.directory)
+            if file_name.endswith('.json')
+        }
+
+    def read(self, location: str) -> str:
+        with open(location, encoding=self.encoding) as json_file:
+            return json_file.read()
+
+
+class TenantRootPolicySet(PolicySet):
+    """
+    Root policy set that combines its own (global) items with policies of the request tenant
+    """
+    tenant_pap: Optional["LazyTenantPAP"] = None
+
+    def get_request_items(self, request) -> list:
+        return self.items + self.tenant_pap.get_request_tenant_items(request)
+
+    def evaluate(self, request) -> Response:
+        try:
+            return PolicySet.evaluate(self, request)
+        except AttributeUnavailableException as e:
+            logging.warning(f"Tenant of the request could not be determined: {e.message}")
+            return Response(request, decision=self.indeterminate_decision)
+
+    async def evaluate_async(self, request, executor=None) -> Response:
+        try:
+            return await PolicySet.evaluate_async(self, request, executor)
+        except AttributeUnavailableException as e:
+            logging.warning(f"Tenant of the request could not be determined: {e.message}")
+            return Response(request, decision=self.indeterminate_decision)
+
+
+class LazyTenantPAP(PAP):
+    def __init__(
+        self,
+        tenant_key: str,
+        index: Dict[Any, Any],
+        loader: Callable[[Any], Union[str, bytes]],
+        algorithm=deny_unless_permit,
+        max_tenants: Optional[int] = 1000,
+        max_bytes: Optional[int] = None,
+        preload: Iterable[Any] = (),
+        optimize: bool = False
+    ):
+        """
+        :param tenant_key: Attribute that identifies the tenant (e.g. 'tenant.id')
+        :param index: Source locations by tenant key value
+        :param loader: Function that returns JSON (list of policy items) for a source location
+        :param algorithm: Root policy set algorithm
+        :param max_tenants: Maximal number of loaded tenants (None - not limited)
+        :param max_bytes: Maximal total size of loaded tenant sources (None - not limited)
+        :param preload: Tenants that are loaded immediately (e.g. hot tenants)
+        :param optimize: Optimize tenant items when they are loaded (see optimizer module)
+        """
+        PAP.__init__(self, algorithm=algorithm)
+        self.root_policy_set = TenantRootPolicySet(algorithm=algorithm)
+        self.root_policy_set.tenant_pap = self
+        self.tenant_key = tenant_key
+        self.loader = loader
+        self.max_tenants = max_tenants
+        self.max_bytes = max_bytes
+        self.optimize_on_load = optimize
+        # Changes made by optimizer in all loaded tenants
+        self.optimization_report = OptimizationReport()
+        self.statistics = {'hits': 0, 'loads': 0, 'evictions': 0}
+        self._index = {normalize_shard_value(tenant): location for tenant, location in index.items()}
+        self._tenants: "OrderedDict[str, LoadedTenant]" = OrderedDict()
+        self._loaded_bytes = 0
+        # Numbers of tenant items (see get_placeholders). They matter only if there are at most MAX_PLACEHOLDERS
+        # tenants, so they are counted when the index is built in this case.
+        self._item_counts: Dict[str, int] = {}
+        if len(self._index) <= MAX_PLACEHOLDERS:
+            for key in self._index:
+                self._item_counts[key] = self.count_items(key)
+        self._loading: Dict[str, threading.Event] = {}
+        self._tenant_lock = threading.Lock()
+        self._placeholders = [
+            NotApplicableElement(description="Policies of other tenants") for _ in range(MAX_PLACEHOLDERS)
+        ]
+        self.preload(preload)
+
+    @classmethod
+    def from_directory(cls, directory: str, tenant_key: str, encoding: str = 'UTF-8', **kwargs) -> "LazyTenantPAP":
+        """
+        Creates PAP for tenant policies stored as `<tenant key value>.json` files
+        """
+        source = DirectoryTenantSource(directory, encoding)
+        return cls(tenant_key, source.get_index(), source.read, **kwargs)
+
+    def preload(self, tenants: Iterable[Any]) -> None:
+        for tenant in tenants:
+            self.get_tenant_items(tenant)
+
+    def get_request_tenant_items(self, request) -> list:
+        """
+        :return: Policy items of the request tenant followed by placeholders for items of other tenants
+        """
+        tenant = request.PDP.PIP.get_attribute_value(self.tenant_key, request)
+        request.attributes[self.tenant_key] = tenant
+        return self.get_tenant_items(tenant) + self.get_placeholders(normalize_shard_value(tenant))
+
+    def get_placeholders(self, key: Optional[str]) -> list:
+        """
+        Returns placeholders for items of tenants other than the given one.
+        Only the number of not applicable items up to MAX_PLACEHOLDERS matters.
+        """
+        if len(self._index) - (key in self._index) >= MAX_PLACEHOLDERS:
+            # Every tenant has at least one item
+            return self._placeholders
+        count = sum(self._item_counts[other_key] for other_key in self._index if other_key != key)
+        return self._placeholders[:min(count, MAX_PLACEHOLDERS)]
+
+    def get_tenant_items(self, tenant: Any) -> list:
+        """
+        :return: Policy items of the tenant (loading them if required)
+        """
+        key = normalize_shard_value(tenant)
+        if key is None or key not in self._index:
+            return []
+        return self._load_tenant(key)
+
+    def _load_tenant(self, key: str) -> list:
+        while True:
+            with self._tenant_lock:
+                loaded_tenant = self._tenants.get(key)
+                if loaded_tenant is not None:
+                    self._tenants.move_to_end(key)
+                    self.statistics['hits'] += 1
+                    return loaded_tenant.items
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    break
+            # Tenant is being loaded by another thread
+            loading.wait()
+
+        try:
+            loaded_tenant = self.build_tenant(key)
+        except BaseException:
+            with self._tenant_lock:
+                del self._loading[key]
+                loading.set()
+            raise
+        with self._tenant_lock:
+            # Tenant is added before waiters are woken up, so they do not load it again
+            self.statistics['loads'] += 1
+            replaced_tenant = self._tenants.pop(key, None)
+            if replaced_tenant is not None:
+                self._loaded_bytes -= replaced_tenant.size
+            self._tenants[key] = loaded_tenant
+            self._loaded_bytes += loaded_tenant.size
+            self._evict()
+            del self._loading[key]
+            loading.set()
+        return loaded_tenant.items
+
+    def read_items_data(self, key: str) -> tuple:
+        """
+        :return: Source data of the tenant and JSON of its items
+        """
+        data = self.loader(self._index[key])
+        items_data = json.loads(data)
+        if isinstance(items_data, dict):
+            items_data = [items_data]
+        return data, items_data
+
+    def count_items(self, key: str) -> int:
+        return len(self.read_items_data(key)[1])
+
+    def build_tenant(self, key: str) -> LoadedTenant:
+        data, items_data = self.read_items_data(key)
+        items = []
+        for item_data in items_data:
+            target = item_data.get('target')
+            if not isinstance(target, dict) or normalize_shard_value(target.get(self.tenant_key)) != key:
+                raise ValueError(f"Policy of tenant `{key}` should be targeted on {self.tenant_key} = {key}.")
+            items.append(PolicySet.create_policy_item(item_data))
+        if not items:
+            raise ValueError(f"Tenant `{key}` has no policies.")
+        if self.optimize_on_load:
+            report = optimize_items(items)
+            with self._tenant_lock:
+                self.optimization_report.merge(report)
+        return LoadedTenant(items=items, size=len(data))
+
+    def _evict(self) -> None:
+        # Called with the tenant lock held. The most recently loaded tenant is never evicted.
+        while len(self._tenants) > 1 and (
+            (self.max_tenants is not None and len(self._tenants) > self.max_tenants)
+            or (self.max_bytes is not None and self._loaded_bytes > self.max_bytes)
+        ):
+            _, evicted_tenant = self._tenants.popitem(last=False)
+            self._loaded_bytes -= evicted_tenant.size
+            self.statistics['evictions'] += 1
+
+    def get_statistics(self) -> Dict[str, Any]:
+        with self._tenant_lock:
+            result = dict(self.statistics)
+            result['loaded_tenants'] = len(self._tenants)
+            result['loaded_bytes'] = self._loaded_bytes
+            result['indexed_tenants'] = len(self._index)
+        return result
+
+    @property
+    def loaded_tenants(self) -> List[str]:
+        """Tenants that are currently loaded (least recently used first)"""
+        with self._tenant_lock:
+            return list(self._tenants)
+
+    def optimize(self) -> OptimizationReport:
+        """
+        Replaces global items with their optimized copies and enables optimization of tenant items.
+        Loaded tenants are dropped, so they are optimized when they are loaded again.
+        :return: Report of the changes made by optimizer in global items
+        """
+        with self._lock:
+            items = copy.deepcopy(self.root_policy_set.items)
+            for item in items:
+                register_tree(item)
+            report = optimize_items(items)
+            self.root_policy_set.items = items
+            self.optimize_on_load = True
+            self.version += 1
+        with self._tenant_lock:
+            self._tenants.clear()
+            self._loaded_bytes = 0
+        return report
+# EOF
@@ -10,8 +10,10 @@ __license__ = "LGPL"
 __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
+import dataclasses
 import logging
-from typing import Any, List
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 # def get_object_by_path(root_object, path_parts, prefix=None):
 #     """
@@ -57,6 +59,46 @@ from typing import Any, List
 #     )
 
 
+# Compiled path accessors by path
+_path_accessors: Dict[Tuple[str, ...], Callable[..., Any]] = {}
+
+
+def get_path_accessor(path_parts: Sequence[str]) -> Callable[..., Any]:
+    """
+    Returns compiled accessor of a path: function(root_object, default=None) that resolves the path
+    for a root object. Dict keys and object attributes are treated as path parts, path parts after a list
+    are resolved for every list item. Accessors are cached by path.
+    :param path_parts: List of strings
+    :return: Accessor that returns the default if path resolution failed
+    """
+    path = tuple(path_parts)
+    accessor = _path_accessors.get(path)
+    if accessor is not None:
+        return accessor
+
+    def accessor(root_object: Any, default: Any = None) -> Any:
+        obj = root_object
+        for index, part in enumerate(path):
+            try:
+                obj = getattr(obj, part)
+            except AttributeError:
+                if isinstance(obj, list):
+                    item_accessor = get_path_accessor(path[index:])
+                    results = []
+                    for item in obj:
+                        result = item_accessor(item)
+                        if result is not None:
+                            results.append(result)
+                    return results
+                try:
+                    obj = obj[part]
+                except (TypeError, KeyError):
+                    return default
+        return obj
+
+    return _path_accessors.setdefault(path, accessor)
+
+
 def get_object_by_path(root_object: Any, path_parts: List[str]) -> Any:
     """
     Returns an object using the provided path and root object.
@@ -64,25 +106,51 @@ def get_object_by_path(root_object: Any, path_parts: List[str]) -> Any:
     :param path_parts: List of strings
     :return: Value of an object that if found by a given path or None if path resolution failed.
     """
-    obj = root_object
-    for index, part in enumerate(path_parts):
-        try:
-            obj = getattr(obj, part)
-        except AttributeError:
-            if isinstance(obj, list):
-                results = []
-                for item in obj:
-                    result = get_object_by_path(item, path_parts[index:])
-                    if result is not None:
-                        results.append(result)
-                obj = results
-                break
-            else:
-                try:
-                    obj = obj[part]
-                except (TypeError, KeyError):
-                    return None
-    return obj
+    return get_path_accessor(path_parts)(root_object)
+
+
+def freeze(value: Any) -> Any:
+    """
+    Returns hashable representation of JSON-like value.
+    Value types are kept, so 1, 1.0 and True are different constants.
+    """
+    if isinstance(value, Mapping):
+        return dict, tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return list, tuple(freeze(item) for item in value)
+    return value.__class__, value
+
+
+def add_slots(cls: Optional[type] = None, weakref: bool = False):
+    """
+    Class decorator that recreates a dataclass with __slots__ for its own fields,
+    so instances have no __dict__ (dataclass(slots=True) is not available before Python 3.10).
+    Methods of the class should not use zero-argument super(): it refers to the original class.
+    :param cls: Dataclass
+    :param weakref: Add __weakref__ slot (if base classes do not have it)
+    """
+    if cls is None:
+        # Used as @add_slots(weakref=True)
+        return lambda cls_: add_slots(cls_, weakref=weakref)
+
+    inherited_slots = set()
+    for base in cls.__mro__[1:]:
+        inherited_slots.update(base.__dict__.get('__slots__', ()))
+    field_names = tuple(
+        field.name for field in dataclasses.fields(cls)
+        if field.name in cls.__dict__.get('__annotations__', {}) and field.name not in inherited_slots
+    )
+    slots = field_names
+    if weakref and not any('__weakref__' in base.__dict__ for base in cls.__mro__[1:]):
+        slots += ('__weakref__',)
+
+    class_dict = dict(cls.__dict__)
+    for name in field_names + ('__dict__', '__weakref__'):
+        # Field defaults are kept by dataclass fields, class attributes would conflict with slots
+        class_dict.pop(name, None)
+    class_dict['__slots__'] = slots
+    return type(cls)(cls.__name__, cls.__bases__, class_dict)
+
 
 def logging_by_level_name(level_name,**kwargs):
     if level_name == 'DEBUG':
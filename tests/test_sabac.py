@@ -11,13 +11,37 @@ __maintainer__ = "Yuriy Petrovskiy"
 __email__ = "yuriy.petrovskiy@gmail.com"
 
 # Standard library imports
+import asyncio
+import datetime
+import itertools
 import json
 import os
 import logging
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 # 3rd party imports
 import pytest
 # Local source imports
-from sabac import PDP, FilePAP, PIP, InformationProvider, DenyBiasedPEP, Request
+from sabac import PDP, PAP, FilePAP, PIP, InformationProvider, DenyBiasedPEP, PermitBiasedPEP, Request, AdaptiveOrdering
+from sabac import ObjectRequest
+from sabac import PolicyTestRunner, PolicyCoverage, DecisionLog, JSONLWriter, BinaryWriter, ShardedPDP, LazyTenantPAP
+from sabac import SQLitePAP, BitmapMatcher, EvaluationContext
+from sabac.audit import read_binary_log
+from sabac.constants import RESULT_PERMIT, RESULT_DENY, RESULT_INDETERMINATE_DP
+from sabac.response import Response
+from sabac.exceptions import AttributeUnavailableException
+from sabac.sharding import partition_policies
+from sabac.streaming import load_policy_set, LazyPolicyItem
+from sabac.operator_evaluators import MAX_COMPILED_PATTERNS, compile_pattern, _compile_pattern
+from sabac.resilience import ProviderGuard
+from sabac.index import ItemIndex, PrefixTrieIndex, IntervalIndex
+from sabac.serialization import request_to_bytes, request_from_bytes, response_to_bytes, response_from_bytes
+from sabac.serialization import request_to_json, request_from_json, response_to_json, response_from_json
+from sabac.serialization import TAG_INT
 
 
 @pytest.fixture(scope="module")
@@ -377,4 +401,1254 @@ def test_sub_value_evaluation(pdp_instance):
         }
     }, True, debug=True)
     assert permit
+
+
+def test_request_context_not_modified(pdp_instance):
+    """
+    Evaluation should not write resolved attributes back to the caller context
+    """
+    context = {
+        'resource': {'type': 'user', 'id': 5},
+        'action': 'update',
+        'subject.id': 1,
+        'subject.attribute.roles': ['test', 'admin']
+    }
+    context_copy = json.loads(json.dumps(context))
+    request = Request(attributes=context)
+    pdp_instance.evaluate(request)
+
+    assert context == context_copy
+    assert 'resource.type' in request.resolved_attributes
+    assert 'resource.type' not in context
+
+
+def test_concurrent_evaluation(pdp_instance):
+    """
+    Single PDP instance should give the same results when used from many threads
+    """
+    test_pep = DenyBiasedPEP(pdp_instance)
+    contexts = [
+        {'resource': {'type': 'user', 'id': subject_id}, 'action': 'view', 'subject': {'id': 2}}
+        for subject_id in range(1, 5)
+    ] * 50
+    expected = [test_pep.evaluate(context) for context in contexts]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(test_pep.evaluate, contexts))
+
+    assert results == expected
+    assert expected[:4] == [False, True, False, False]
+
+
+def test_concurrent_policy_set_children(pdp_instance):
+    """
+    Policy set children evaluated by executor should give the same decisions as sequential evaluation
+    """
+    contexts = [
+        {'resource': {'type': 'user', 'id': 2}, 'action': 'view', 'subject': {'id': 2}},
+        {'resource': {'type': 'user', 'id': 1}, 'action': 'update', 'subject': {'id': 2}},
+        {'subject': None, 'subject.id': None, 'action': 'login'},
+    ]
+    expected = [pdp_instance.evaluate(Request(context)).decision for context in contexts]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        concurrent_pdp = PDP(pap_instance=pdp_instance.PAP, pip_instance=pdp_instance.PIP, executor=executor)
+        results = [concurrent_pdp.evaluate(Request(context)).decision for context in contexts]
+
+        async def evaluate_all():
+            return [(await concurrent_pdp.evaluate_async(Request(context))).decision for context in contexts]
+
+        async_results = asyncio.run(evaluate_all())
+
+    assert results == expected
+    assert async_results == expected
+
+
+def test_optimized_policies(pdp_instance):
+    """
+    Optimized policy tree should give the same results for policy tests
+    """
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    optimized_pap = FilePAP(f"{script_dir}/test_policies.json", optimize=True)
+    optimized_pdp = PDP(pap_instance=optimized_pap, pip_instance=pdp_instance.PIP)
+    with open(f"{script_dir}/policy_tests.json") as json_file:
+        test_json_data = json.load(json_file)
+
+    assert DenyBiasedPEP(optimized_pdp).run_tests(test_json_data) == []
+
+
+def test_optimizer_report():
+    target = {'resource.type': 'document', 'resource.id': {'@in': [{'@STR': 1}, {'@STR': 2}]}}
+    pap = PAP()
+    for description in ('Readers', 'Writers', 'Other'):
+        pap.add_item({
+            'description': description,
+            'target': dict(target) if description != 'Other' else {'resource.type': 'other'},
+            'algorithm': 'DENY_UNLESS_PERMIT',
+            'rules': [
+                {'effect': 'PERMIT', 'target': {'action': 'read'}},
+                {'effect': 'PERMIT'},
+                {'effect': 'DENY', 'target': {'action': 'write'}},
+            ]
+        })
+    report = pap.optimize()
+    policies = pap.root_policy_set.items
+
+    assert report.removed_elements == 3
+    assert report.merged_policies == 1
+    assert report.folded_expressions == 4
+    assert [policy.description for policy in policies] == ['Readers; Writers', 'Other']
+    assert policies[0].target['resource.id'] == {'@in': ['1', '2']}
+    assert policies[0].rules[0].target is policies[1].rules[0].target
+
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap))
+    assert test_pep.evaluate({'resource.type': 'document', 'resource.id': '2', 'action': 'write'})
+    assert not test_pep.evaluate({'resource.type': 'document', 'resource.id': '3', 'action': 'write'})
+
+
+def test_adaptive_ordering(monkeypatch):
+    """
+    Frequently decisive rules should be moved to the beginning of policies without actions
+    """
+    # Every timer reading advances by one, so measured costs do not depend on the machine load
+    monkeypatch.setattr('sabac.ordering.time', SimpleNamespace(perf_counter=itertools.count().__next__))
+    pap = PAP()
+    for advices in ([], [{'action': 'log', 'fulfill_on': 'PERMIT', 'attributes': {}}]):
+        pap.add_item({
+            'algorithm': 'DENY_UNLESS_PERMIT',
+            'rules': [
+                {'description': action, 'effect': 'PERMIT', 'target': {'action': action}, 'advices': advices}
+                for action in ('create', 'update', 'view')
+            ]
+        })
+    ordering = AdaptiveOrdering(reorder_interval=10)
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, ordering=ordering))
+    for _ in range(10):
+        assert test_pep.evaluate({'action': 'view'})
+
+    reorderable_policy, other_policy = pap.root_policy_set.items
+    assert reorderable_policy.rules[0].description == 'view'
+    assert [rule.description for rule in other_policy.rules] == ['create', 'update', 'view']
+    assert ordering.get_statistics(reorderable_policy)[0]['evaluations'] == 0
+    assert test_pep.evaluate({'action': 'create'})
+    assert not test_pep.evaluate({'action': 'delete'})
+    # Replaced children are checked again
+    assert ordering.is_reorderable(reorderable_policy)
+    reorderable_policy.rules = reorderable_policy.rules + other_policy.rules[:1]
+    assert not ordering.is_reorderable(reorderable_policy)
+    reorderable_policy.rules = reorderable_policy.rules[:3]
+    assert ordering.is_reorderable(reorderable_policy)
+
+    # Coverage counters follow reordered rules
+    coverage = PolicyCoverage()
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, ordering=AdaptiveOrdering(reorder_interval=5), coverage=coverage))
+    for action in ['update'] * 10 + ['create']:
+        assert test_pep.evaluate({'action': action})
+    rules = pap.root_policy_set.items[0].rules
+    assert rules[0].description == 'update'
+    annotated_rules = coverage.annotate()['items'][0]['rules']
+    assert {rule['description']: rule['_coverage']['decisive'] for rule in annotated_rules} == \
+        {'update': 10, 'view': 0, 'create': 1}
+    elements = coverage.to_json()['elements']
+    for position, rule in enumerate(rules):
+        assert elements[f"#/items/0/rules/{position}"]['description'] == rule.description
+    assert f"#/items/0/rules/{[rule.description for rule in rules].index('view')}" in coverage.get_uncovered()
+
+
+def test_decision_provenance(pdp_instance):
+    context = {
+        'resource': {'type': 'user', 'id': 2},
+        'action': 'view',
+        'subject': {'id': 2},
+    }
+    response = pdp_instance.evaluate(Request(attributes=context, return_policy_id_list=True))
+
+    assert all(isinstance(element_id, int) for element_id, _ in response.polices)
+    assert response.policy_list[-2:] == [
+        {'element': 'rule', 'description': 'User  can view his/her own profile', 'result': response.decision},
+        {'element': 'policy', 'description': 'Identified user', 'result': response.decision},
+    ]
+
+    request = Request(attributes=context)
+    assert pdp_instance.evaluate(request).polices == []
+    assert pdp_instance.explain(request).policy_list == response.policy_list
+
+
+def test_parallel_test_runner(pdp_instance, tmp_path):
+    """
+    Tests are streamed from JSONL file and run by worker processes
+    """
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(f"{script_dir}/policy_tests.json") as json_file:
+        tests = json.load(json_file)
+    tests.append({
+        "description": "Wrong expectation",
+        "context": {"subject": {"id": 2}, "action": "update", "resource": {"type": "user", "id": 1}},
+        "result": "Permit"
+    })
+    tests_file_name = tmp_path / 'tests.jsonl'
+    tests_file_name.write_text('\n'.join(json.dumps(test) for test in tests))
+
+    runner = PolicyTestRunner(DenyBiasedPEP(pdp_instance), processes=2, chunk_size=2)
+    failures = list(runner.run_file(str(tests_file_name)))
+
+    assert len(failures) == 1
+    assert failures[0]['index'] == len(tests) - 1
+    assert failures[0]['message'] == 'Test failed'
+    assert failures[0]['trace'][-1]['description'] == 'Identified user'
+    assert runner.statistics.total == len(tests)
+    assert runner.statistics.failed == 1
+
+
+def test_policy_coverage(pdp_instance):
+    """
+    Coverage collected by parallel test runner should be the same as collected in the current process
+    """
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(f"{script_dir}/policy_tests.json") as json_file:
+        tests = json.load(json_file)
+
+    reports = []
+    for processes in (1, 2):
+        coverage = PolicyCoverage()
+        coverage_pdp = PDP(pap_instance=pdp_instance.PAP, pip_instance=pdp_instance.PIP, coverage=coverage)
+        runner = PolicyTestRunner(DenyBiasedPEP(coverage_pdp), processes=processes, chunk_size=2)
+        assert list(runner.iter_failures(tests)) == []
+        reports.append(coverage.to_json())
+
+    assert reports[0] == reports[1]
+    assert reports[0]['sampled_requests'] == len(tests)
+    elements = reports[0]['elements']
+    assert elements['#/items/0']['target_matched'] == 2
+    assert elements['#/items/0/rules/1']['decisive'] == 1
+    assert elements['#/items/2/rules/2']['condition_true'] == 2
+    assert elements['#/items/2/rules/2']['condition_false'] == 1
+
+    merged = PolicyCoverage()
+    merged.bind(pdp_instance.PAP.root_policy_set)
+    merged.merge_json(reports[0])
+    merged.merge(coverage)
+    annotated = merged.annotate()
+    assert annotated['items'][0]['_coverage']['target_matched'] == 4
+    assert '#/items/0/rules/0' in merged.get_uncovered()
+
+
+def test_decision_log(pdp_instance, tmp_path):
+    contexts = [
+        {'resource': {'type': 'user', 'id': 2}, 'action': 'view', 'subject': {'id': 2}},
+        {'resource': {'type': 'user', 'id': 1}, 'action': 'view', 'subject': {'id': 2}},
+    ] * 5
+
+    jsonl_log = DecisionLog(JSONLWriter(str(tmp_path / 'decisions.jsonl')), batch_size=3)
+    test_pep = DenyBiasedPEP(pdp_instance, decision_log=jsonl_log)
+    results = [test_pep.evaluate(context, return_policy_id_list=True) for context in contexts]
+    jsonl_log.close()
+
+    with open(tmp_path / 'decisions.jsonl') as log_file:
+        records = [json.loads(line) for line in log_file]
+    assert [record['decision'] == 'PERMIT' for record in records] == results
+    assert records[0]['attributes']['resource.type'] == 'user'
+    assert records[0]['polices'][-1][1] == 'PERMIT'
+
+    binary_log = DecisionLog(
+        BinaryWriter(str(tmp_path / 'decisions.bin'), max_bytes=1, backup_count=1),
+        capacity=1,
+        backpressure='block',
+        batch_size=1
+    )
+    test_pep = DenyBiasedPEP(pdp_instance, decision_log=binary_log)
+    for context in contexts:
+        test_pep.evaluate(context)
+    binary_log.close()
+
+    assert binary_log.written == len(contexts) and binary_log.dropped == 0
+    assert [record['decision'] for record in read_binary_log(str(tmp_path / 'decisions.bin'))] == ['DENY']
+    assert [record['decision'] for record in read_binary_log(str(tmp_path / 'decisions.bin.1'))] == ['PERMIT']
+
+
+def test_decision_log_writer_errors(pdp_instance, tmp_path):
+    """
+    Failing writer should not stop the log or block evaluation, only used attributes are logged
+    """
+    class FailingWriter(JSONLWriter):
+        def write_batch(self, records):
+            self.batches = getattr(self, 'batches', 0) + 1
+            if self.batches % 2:
+                raise OSError("Disk is full")
+            JSONLWriter.write_batch(self, records)
+
+    decision_log = DecisionLog(
+        FailingWriter(str(tmp_path / 'decisions.jsonl')), capacity=1, batch_size=1, backpressure='block'
+    )
+    test_pep = DenyBiasedPEP(pdp_instance, decision_log=decision_log)
+    context = {'resource': {'type': 'user', 'id': 2}, 'action': 'view', 'subject': {'id': 2}, 'unused': object()}
+    for _ in range(6):
+        test_pep.evaluate(context)
+    decision_log.close()
+
+    assert decision_log.errors > 0 and decision_log.written + decision_log.errors == 6
+    assert decision_log.record(Request(context), Response(Request(context), RESULT_DENY)) is False
+    with open(tmp_path / 'decisions.jsonl') as log_file:
+        attributes = json.loads(log_file.readline())['attributes']
+    assert attributes['resource.type'] == 'user' and 'unused' not in attributes
+
+
+def test_provider_circuit_breaker():
+    """
+    Failing provider should be isolated and its attributes should give deny (or fallback values)
+    """
+    pap = PAP()
+    pap.add_item({
+        'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [
+            {'effect': 'PERMIT', 'target': {'subject.role': 'admin'}},
+            {'effect': 'PERMIT', 'target': {'action': 'view', 'subject.department': 'sales'}},
+        ]
+    })
+    calls = []
+    state_changes = []
+
+    class RoleProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.role']
+        failure_threshold = 2
+        recovery_timeout = 60
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            calls.append(attributes['subject'])
+            raise ConnectionError("directory is down")
+
+    class DepartmentProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.department']
+        timeout = 0.05
+        failure_outcome = 'fallback'
+        fallback_value = 'sales'
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            time.sleep(0.5)
+            return 'support'
+
+    test_pip = PIP(on_provider_state_change=lambda provider, old, new: state_changes.append(new.name))
+    test_pip.add_provider(RoleProvider)
+    test_pip.add_provider(DepartmentProvider)
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, pip_instance=test_pip))
+
+    for _ in range(4):
+        assert not test_pep.evaluate({'subject': 1, 'action': 'update'})
+    assert len(calls) == 2
+    assert state_changes == ['OPEN']
+    with pytest.raises(AttributeUnavailableException):
+        test_pip.fetch_attribute('subject.role', Request({'subject': 1}))
+
+    # Timed out provider gives its fallback value
+    assert test_pep.evaluate({'subject': 1, 'action': 'view'})
+    metrics = test_pip.get_provider_metrics()
+    assert metrics['RoleProvider']['state'] == 'OPEN'
+    assert metrics['RoleProvider']['rejections'] == 4
+    assert metrics['DepartmentProvider']['timeouts'] == 1
+
+
+def test_provider_timeout_isolation():
+    """
+    Hung calls of one provider should not make other providers time out
+    """
+    released = threading.Event()
+
+    class HungProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.role']
+        timeout = 0.01
+        max_concurrency = 2
+        failure_outcome = 'fallback'
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            released.wait(5)
+            return 'admin'
+
+    class HealthyProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.department']
+        timeout = 1
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            return 'sales'
+
+    hung_guard = ProviderGuard(HungProvider)
+    healthy_guard = ProviderGuard(HealthyProvider)
+    request = Request({'subject': 1})
+    try:
+        assert [hung_guard.fetch(request, 'subject.role') for _ in range(4)] == [None] * 4
+        assert hung_guard.get_metrics()['timeouts'] == 2 and hung_guard.get_metrics()['rejections'] == 2
+        assert [healthy_guard.fetch(request, 'subject.department') for _ in range(20)] == ['sales'] * 20
+    finally:
+        released.set()
+
+    # Semaphore is released when the call could not be submitted
+    hung_guard.get_executor().shutdown()
+    assert [hung_guard.fetch(request, 'subject.role') for _ in range(3)] == [None] * 3
+    hung_guard._executor = None
+    assert hung_guard.fetch(request, 'subject.role') == 'admin'
+
+
+def test_provider_timeout_indeterminate():
+    """
+    Timed out fetch with indeterminate outcome should be counted as a single failure
+    """
+    released = threading.Event()
+
+    class SlowProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.role']
+        timeout = 0.01
+        failure_threshold = 2
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            released.wait(5)
+            return 'admin'
+
+    guard = ProviderGuard(SlowProvider)
+    try:
+        with pytest.raises(AttributeUnavailableException) as exception_info:
+            guard.fetch(Request({'subject': 1}), 'subject.role')
+    finally:
+        released.set()
+    assert 'timeout 0.01s' in exception_info.value.message
+    metrics = guard.get_metrics()
+    assert metrics['state'] == 'CLOSED' and metrics['timeouts'] == 1 and metrics['failures'] == 0
+    assert guard.consecutive_failures == 1
+
+
+def test_evaluation_deadline():
+    """
+    Evaluation that exceeds its time budget should be indeterminate and enforced according to PEP type
+    """
+    pap = PAP()
+    pap.add_item({
+        'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [
+            {'effect': 'PERMIT', 'target': {'action': 'create'}},
+            {'effect': 'PERMIT', 'target': {'subject.role': 'admin'}},
+            {'effect': 'PERMIT', 'target': {'action': 'view'}},
+        ]
+    })
+
+    class SlowRoleProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.role']
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            time.sleep(0.05)
+            return 'user'
+
+    test_pip = PIP()
+    test_pip.add_provider(SlowRoleProvider)
+    test_pdp = PDP(pap_instance=pap, pip_instance=test_pip)
+    context = {'subject': 1, 'action': 'view'}
+
+    assert DenyBiasedPEP(test_pdp).evaluate(context, timeout=1)
+    assert not DenyBiasedPEP(test_pdp).evaluate(context, timeout=0.01)
+    assert PermitBiasedPEP(test_pdp).evaluate({'subject': 1, 'action': 'delete'}, timeout=0.01)
+
+    request = Request(context)
+    response = test_pdp.evaluate(request, deadline=time.monotonic())
+    assert response.decision == RESULT_INDETERMINATE_DP
+    assert request.deadline_exceeded and 'subject.role' not in request.attributes
+
+    # Final decision found before the deadline is kept
+    request = Request({'subject': 1, 'action': 'create'}, deadline=time.monotonic() + 1)
+    assert test_pdp.evaluate(request).decision == RESULT_PERMIT
+
+
+def test_provider_fetch_coalescing():
+    """
+    Identical concurrent fetches should share one provider call, different ones should be batched
+    """
+    pap = PAP()
+    pap.add_item({
+        'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [
+            {'effect': 'PERMIT', 'target': {'subject.role': 'admin'}},
+            {'effect': 'PERMIT', 'target': {'subject.department': 'sales'}},
+        ]
+    })
+    role_calls = []
+    department_batches = []
+    release = threading.Event()
+
+    class RoleProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.role']
+        coalesce = True
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            role_calls.append(attributes['subject'])
+            release.wait(5)
+            return 'admin' if attributes['subject']['id'] == 1 else 'user'
+
+    class DepartmentProvider(InformationProvider):
+        required_attributes = ['subject']
+        provided_attributes = ['subject.department']
+        batch_window = 5
+        max_batch_size = 3
+
+        @classmethod
+        def fetch_many(cls, attributes_list):
+            department_batches.append([attributes['subject']['id'] for attributes in attributes_list])
+            return ['sales' if attributes['subject']['id'] == 2 else 'support' for attributes in attributes_list]
+
+    test_pip = PIP()
+    test_pip.add_provider(RoleProvider)
+    test_pip.add_provider(DepartmentProvider)
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, pip_instance=test_pip))
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = [executor.submit(test_pep.evaluate, {'subject': {'id': 1}}) for _ in range(10)]
+        while test_pip.get_provider_metrics()['RoleProvider']['fetches'] < 10:
+            time.sleep(0.01)
+        release.set()
+        assert all(future.result() for future in futures)
+    assert len(role_calls) == 1
+    assert test_pip.get_provider_metrics()['RoleProvider']['coalesced'] == 9
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(test_pep.evaluate, [{'subject': {'id': subject_id}} for subject_id in (2, 3, 4)]))
+    assert results == [True, False, False]
+    assert len(department_batches) == 1 and sorted(department_batches[0]) == [2, 3, 4]
+    assert len(role_calls) == 4
+
+    # Batch leader does not wait for the batch window after its deadline
+    started = time.monotonic()
+    request = Request({'subject': {'id': 2}}, deadline=time.monotonic() + 0.05)
+    assert test_pep.PDP.evaluate(request).decision != RESULT_PERMIT
+    assert request.deadline_exceeded and time.monotonic() - started < 1
+    while test_pip.get_provider_metrics()['DepartmentProvider']['batches'] < 2:
+        time.sleep(0.01)
+    assert department_batches[-1] == [2]
+
+
+def test_unresolvable_attribute_diagnostics(caplog):
+    pap = PAP()
+    pap.add_item({'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'PERMIT', 'target': {'role': 'admin'}}]})
+    test_pip = PIP()
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, pip_instance=test_pip))
+
+    with caplog.at_level(logging.WARNING):
+        for _ in range(5):
+            assert not test_pep.evaluate({'subject': 1})
+        assert test_pip._unresolvable_attributes == {'role': pap.version}
+        pap.add_item({'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'PERMIT', 'target': {'action': 'x'}}]})
+        assert not test_pep.evaluate({'subject': 1})
+
+    assert test_pip._unresolvable_attributes['role'] == pap.version
+    missing = test_pip.diagnostics.get_missing_attributes()
+    assert missing['role']['count'] == 6
+    assert missing['role']['first_context'] == ['subject']
+    assert len([record for record in caplog.records if "attribute 'role'" in record.getMessage()]) == 1
+
+
+def test_request_serialization():
+    context = {
+        'subject': {'id': 1, 'roles': ['admin', 'user'], 'uuid': uuid.UUID(int=7)},
+        'balance': -12345678901234567890,
+        'score': 0.5,
+        'active': True,
+        'comment': None,
+        'text': 'Ünïcode',
+        'token': b'\x00\x01',
+        'created': datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+        'day': datetime.date(2020, 1, 2),
+    }
+    request = Request(context, return_policy_id_list=True, deadline=time.monotonic() + 10)
+
+    data = request_to_bytes(request)
+    decoded = request_from_bytes(memoryview(data))
+    assert isinstance(decoded.attributes['token'], memoryview)
+    assert bytes(decoded.attributes['token']) == context['token']
+    assert {key: value for key, value in decoded.attributes.items() if key != 'token'} == \
+        {key: value for key, value in context.items() if key != 'token'}
+    assert decoded.return_policy_id_list and 9 < decoded.get_remaining_time() <= 10
+
+    del context['token']
+    assert len(request_to_bytes(Request(context))) < len(request_to_json(Request(context)))
+    decoded = request_from_json(request_to_json(Request(context)))
+    assert dict(decoded.attributes) == context and decoded.deadline is None
+
+    for value in (object(), 1 << 300):
+        with pytest.raises(ValueError):
+            request_to_bytes(Request({'value': value}))
+    for end in range(len(data)):
+        with pytest.raises(ValueError):
+            request_from_bytes(data[:end])
+    with pytest.raises(ValueError):
+        request_from_bytes(data[:6] + bytes([TAG_INT]) + b'\x80' * 100)
+
+
+def test_response_serialization(pdp_instance):
+    context = {'resource.type': 'user', 'resource.id': 1, 'action': 'erase_personal_data', 'subject.id': 1}
+    response = pdp_instance.evaluate(Request(attributes=context, return_policy_id_list=True))
+    assert len(response.advices) == 1 and len(response.polices) > 0
+
+    for decoded in (
+        response_from_bytes(response_to_bytes(response)),
+        response_from_json(response_to_json(response)),
+    ):
+        assert decoded.decision == response.decision
+        assert decoded.advices == response.advices
+        assert decoded.obligations == response.obligations
+        assert decoded.polices == response.polices
+        assert decoded.policy_list == response.policy_list
+    assert json.loads(response_to_json(response))['decision'] == 'PERMIT'
+    data = response_to_bytes(response)
+    for end in range(len(data)):
+        with pytest.raises(ValueError):
+            response_from_bytes(data[:end])
+
+
+def test_sharded_pdp(tmp_path):
+    policies = {
+        'algorithm': 'DENY_UNLESS_PERMIT',
+        'items': [
+            {
+                'target': {'tenant.id': tenant_id},
+                'algorithm': 'DENY_UNLESS_PERMIT',
+                'items': [{
+                    'algorithm': 'DENY_UNLESS_PERMIT',
+                    'rules': [{'effect': 'PERMIT', 'target': {'action': 'view', 'subject.id': tenant_id * 10}}]
+                }]
+            }
+            for tenant_id in range(1, 7)
+        ] + [
+            {'target': {'tenant.id': {'@in': [7, 8]}}, 'algorithm': 'DENY_UNLESS_PERMIT',
+             'rules': [{'effect': 'DENY'}]},
+            {'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'PERMIT', 'target': {'action': 'login'}}]},
+        ]
+    }
+    file_name = str(tmp_path / 'tenant_policies.json')
+    with open(file_name, 'w') as json_file:
+        json.dump(policies, json_file)
+
+    shards = partition_policies(policies, 'tenant.id', 3)
+    assert sum(len(shard_data['items']) for shard_data, _ in shards) == 6 + 2 + 3
+    assert all(len(shard_data['items']) + removed == 8 for shard_data, removed in shards)
+
+    contexts = [
+        {'tenant': {'id': tenant_id}, 'subject.id': subject_id, 'action': action}
+        for tenant_id in (1, 3, 6, 7, 9)
+        for subject_id in (10, 30, 60)
+        for action in ('view', 'login', 'update')
+    ] + [{'subject.id': 10, 'action': 'login'}, {'subject.id': 10, 'action': 'view'}]
+
+    expected = [PDP(pap_instance=FilePAP(file_name)).evaluate(Request(context)).decision for context in contexts]
+    with ShardedPDP(file_name, shard_key='tenant.id', shards=3) as sharded_pdp:
+        assert [sharded_pdp.evaluate(Request(context)).decision for context in contexts] == expected
+        assert DenyBiasedPEP(sharded_pdp).evaluate({'tenant.id': 1, 'subject.id': 10, 'action': 'view'})
+        assert DenyBiasedPEP(sharded_pdp).evaluate(
+            {'tenant.id': 1, 'subject.id': 10, 'action': 'view', 'time': datetime.datetime.now()}
+        )
+        assert sharded_pdp.evaluate(Request({'tenant.id': 1, 'value': object()})).decision == RESULT_INDETERMINATE_DP
+        response = sharded_pdp.evaluate(
+            Request({'tenant.id': 1, 'subject.id': 10, 'action': 'view'}, return_policy_id_list=True)
+        )
+        assert response.polices
+        worker_ids = {process.pid for process in sharded_pdp._processes}
+        assert all(
+            record['element'] is None and record['process'] in worker_ids for record in response.policy_list
+        )
+        assert 'Policies' in repr(response)
+        test_pep = DenyBiasedPEP(sharded_pdp)
+        failures = test_pep.run_tests([
+            {'context': {'tenant.id': 1, 'subject.id': 10, 'action': 'view'}, 'result': 'Permit'},
+            {'context': {'tenant.id': 1, 'subject.id': 10, 'action': 'view'}, 'result': 'Deny'},
+        ])
+        assert len(failures) == 1 and failures[0]['trace']
+
+
+def test_sharded_pdp_deadline(tmp_path):
+    """
+    Router should not wait for a slow worker after the request deadline
+    """
+    class SlowRoleProvider(InformationProvider):
+        required_attributes = ['subject.id']
+        provided_attributes = ['subject.role']
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            time.sleep(0.3)
+            return 'admin'
+
+    policies = {'algorithm': 'DENY_UNLESS_PERMIT', 'items': [{
+        'target': {'tenant.id': 1}, 'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [{'effect': 'PERMIT', 'target': {'subject.role': 'admin'}}]
+    }]}
+    file_name = str(tmp_path / 'slow_policies.json')
+    with open(file_name, 'w') as json_file:
+        json.dump(policies, json_file)
+    slow_pip = PIP()
+    slow_pip.add_provider(SlowRoleProvider)
+    context = {'tenant.id': 1, 'subject.id': 1}
+
+    with ShardedPDP(file_name, shard_key='tenant.id', shards=1, pip_instance=slow_pip) as sharded_pdp:
+        started = time.monotonic()
+        request = Request(context, deadline=time.monotonic() + 0.05)
+        assert sharded_pdp.evaluate(request).decision == RESULT_INDETERMINATE_DP
+        assert request.deadline_exceeded and time.monotonic() - started < 0.25
+        # Late response of the previous request is skipped
+        assert sharded_pdp.evaluate(Request(context)).decision == RESULT_PERMIT
+
+
+def test_lazy_tenant_pap(tmp_path):
+    def tenant_policies(tenant_id, rules_count):
+        return [
+            {
+                'target': {'tenant.id': tenant_id},
+                'algorithm': 'DENY_UNLESS_PERMIT',
+                'rules': [{'effect': 'PERMIT', 'target': {'action': 'view', 'subject.id': tenant_id * 10 + index}}]
+            }
+            for index in range(rules_count)
+        ]
+
+    global_items = [{'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'PERMIT', 'target': {'action': 'login'}}]}]
+    contexts = [
+        {'tenant': {'id': tenant_id}, 'subject.id': subject_id, 'action': action}
+        for tenant_id in (1, 2, 3, 9)
+        for subject_id in (10, 11, 20, 30)
+        for action in ('view', 'login')
+    ]
+    for tenants, with_global_items in (({1: 1, 2: 2, 3: 1}, True), ({1: 2}, False), ({1: 1, 2: 2}, False)):
+        directory = tmp_path / f"tenants_{len(tenants)}_{with_global_items}"
+        directory.mkdir()
+        full_pap = PAP()
+        for item in (global_items if with_global_items else []):
+            full_pap.add_item(item)
+        for tenant_id, rules_count in tenants.items():
+            with open(directory / f"{tenant_id}.json", 'w') as json_file:
+                json.dump(tenant_policies(tenant_id, rules_count), json_file)
+            for item in tenant_policies(tenant_id, rules_count):
+                full_pap.add_item(item)
+        lazy_pap = LazyTenantPAP.from_directory(str(directory), 'tenant.id', max_tenants=1)
+        for item in (global_items if with_global_items else []):
+            lazy_pap.add_item(item)
+
+        full_pdp = PDP(pap_instance=full_pap)
+        lazy_pdp = PDP(pap_instance=lazy_pap)
+        for context in contexts:
+            assert lazy_pdp.evaluate(Request(context)).decision == full_pdp.evaluate(Request(context)).decision
+        # Loaded tenants are dropped and loaded again optimized
+        lazy_pap.optimize()
+        assert lazy_pap.loaded_tenants == [] and lazy_pap.optimize_on_load
+        for context in contexts:
+            assert lazy_pdp.evaluate(Request(context)).decision == full_pdp.evaluate(Request(context)).decision
+
+    assert len(lazy_pap.loaded_tenants) == 1
+    statistics = lazy_pap.get_statistics()
+    assert statistics['indexed_tenants'] == 2 and statistics['evictions'] > 0
+
+    lazy_pap = LazyTenantPAP.from_directory(str(directory), 'tenant.id', max_tenants=2, preload=[2])
+    assert lazy_pap.loaded_tenants == ['2']
+    assert DenyBiasedPEP(PDP(pap_instance=lazy_pap)).evaluate({'tenant.id': 2, 'subject.id': 21, 'action': 'view'})
+    assert lazy_pap.get_statistics()['hits'] == 1
+
+    # Tenant loaded by another thread is not loaded again by waiting threads
+    loads = []
+    data = json.dumps(tenant_policies(1, 1))
+
+    def slow_loader(location):
+        loads.append(location)
+        time.sleep(0.05)
+        return data
+
+    lazy_pap = LazyTenantPAP('tenant.id', {1: 'tenant_1'}, slow_loader)
+    # Items of small indexes are counted when the index is built, so placeholders do not load tenants
+    assert loads == ['tenant_1'] and len(lazy_pap.get_placeholders('2')) == 1
+    assert lazy_pap.loaded_tenants == []
+    loads.clear()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(list(executor.map(lambda _: lazy_pap.get_tenant_items(1), range(4))))
+    assert loads == ['tenant_1'] and lazy_pap.get_statistics()['loaded_bytes'] == len(data)
+
+
+def test_compact_policy_representation():
+    def rule(action, role):
+        return {
+            'effect': 'PERMIT',
+            'target': {'action': action, 'subject.role': role},
+            'advices': [{'action': 'log', 'fulfill_on': 'PERMIT', 'attributes': {'level': 'info'}}],
+        }
+
+    policy_data = {'target': {'resource.type': 'document'}, 'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [
+        rule(''.join(['vi', 'ew']), 'reader'), rule('update', ''.join(['edi', 'tor'])),
+    ]}
+    pap = PAP()
+    pap.add_item(policy_data)
+    pap.add_item(json.loads(json.dumps(policy_data)))
+    first, second = [policy.rules for policy in pap.root_policy_set.items]
+
+    assert not hasattr(first[0], '__dict__') and not hasattr(pap.root_policy_set, '__dict__')
+    assert first[0].advices[0] is first[1].advices[0] is second[0].advices[0]
+    assert first[0].target.names is second[1].target.names
+    assert first[0].target['action'] is second[0].target['action'] is sys.intern('view')
+    items = first[0].target.items()
+    assert list(items) == list(items) == [('action', 'view'), ('subject.role', 'reader')] and len(items) == 2
+    assert pap.root_policy_set.items[0].to_json() == policy_data
+
+    response = PDP(pap_instance=pap).evaluate(
+        Request({'resource.type': 'document', 'action': 'view', 'subject.role': 'reader'})
+    )
+    assert response.decision == RESULT_PERMIT and len(response.advices) == 1
+
+
+def test_streaming_policy_loading(tmp_path):
+    file_name = str(tmp_path / 'policies.json')
+    policy_data = {'description': 'Ünicode', 'algorithm': 'DENY_UNLESS_PERMIT', 'items': [
+        {'target': {'action': 'view'}, 'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'PERMIT'}]},
+        {'target': {'action': 'update'}, 'algorithm': 'DENY_UNLESS_PERMIT', 'items': [
+            {'target': {'subject.id': 1}, 'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'PERMIT'}]},
+            {'target': {'subject.id': 2}, 'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'DENY'}]},
+        ]},
+    ]}
+    with open(file_name, 'w', encoding='UTF-8', newline='') as json_file:
+        json_file.write(json.dumps(policy_data, ensure_ascii=False, indent=2).replace('\n', '\r\n'))
+
+    for chunk_size in (1, 7, 4096):
+        assert load_policy_set(file_name, chunk_size=chunk_size).to_json() == policy_data
+        assert load_policy_set(file_name, chunk_size=chunk_size, lazy_threshold=0).to_json() == policy_data
+
+    pap = FilePAP(file_name, lazy_threshold=0)
+    view_item, update_item = pap.root_policy_set.items
+    assert isinstance(view_item, LazyPolicyItem) and view_item.element is None
+    pdp = PDP(pap_instance=pap)
+    assert pdp.evaluate(Request({'action': 'update', 'subject.id': 2})).decision == RESULT_DENY
+    assert view_item.element is None
+    first_item, second_item = update_item.element.items
+    assert first_item.element is None and second_item.element is not None
+    assert pdp.evaluate(Request({'action': 'view', 'subject.id': 2})).decision == RESULT_PERMIT
+
+
+def test_sqlite_pap(tmp_path):
+    items = [
+        {
+            'target': {'action': action, 'subject.role': role} if action else {'resource.type': 'document'},
+            'algorithm': 'DENY_UNLESS_PERMIT',
+            'rules': [{'effect': 'DENY' if role == 'guest' else 'PERMIT', 'target': {'subject.id': subject_id}}],
+        }
+        for subject_id, (action, role) in enumerate(itertools.product([None, 'view', 'update'], ['guest', 'editor']))
+    ]
+    contexts = [
+        {'action': action, 'subject.role': role, 'subject.id': subject_id, 'resource.type': resource_type}
+        for action in ('view', 'update', 'delete')
+        for role in ('guest', 'editor', 'admin')
+        for subject_id in range(len(items))
+        for resource_type in ('document', 'folder')
+    ] + [{'action': 'view', 'subject.id': 2}]
+    full_pap = PAP()
+    full_pap.add_items(items)
+    assert full_pap.version == 1 and len(full_pap.root_policy_set.items) == len(items)
+    database = str(tmp_path / 'policies.sqlite')
+    database_pap = SQLitePAP(database, max_cached=2)
+    assert database_pap.import_json({'items': items}) == len(items)
+
+    full_pdp = PDP(pap_instance=full_pap)
+    database_pdp = PDP(pap_instance=database_pap)
+    for context in contexts:
+        assert database_pdp.evaluate(Request(context)).decision == full_pdp.evaluate(Request(context)).decision
+    statistics = database_pap.get_statistics()
+    assert statistics['candidates'] < statistics['queries'] * len(items) and statistics['cached_items'] == 2
+    # Cached items are dropped and loaded again optimized
+    database_pap.optimize()
+    assert database_pap.get_statistics()['cached_items'] == 0
+    for context in contexts:
+        assert database_pdp.evaluate(Request(context)).decision == full_pdp.evaluate(Request(context)).decision
+
+    with pytest.raises(RuntimeError):
+        with database_pap.transaction():
+            database_pap.remove_item(2)
+            raise RuntimeError()
+    assert database_pap.export_json()['items'] == items
+    policy_id = database_pap.add_item(items[0])
+    database_pap.update_item(policy_id, items[1])
+    assert len(set(database_pap.add_items(items[:2]))) == 2
+    database_pap.close()
+
+    database_pap = SQLitePAP(database)
+    assert [data for _, data in database_pap.iter_items()] == items + [items[1]] + items[:2]
+
+
+def test_pattern_operators_and_prefix_index():
+    constraints = [
+        {'@startswith': '/projects/1/'}, {'@startswith': ['/projects/2/', '/archive/']}, '/projects/3/readme',
+        {'@glob': '/projects/*/docs/*.md'}, {'@glob': '/users/[ab]?/*'}, {'@regex': '^/projects/4/(src|test)/'},
+        {'@regex': 'secret'}, {'@in': ['/projects/5/a', '/projects/5/b']}, {'@not': {'@startswith': '/projects/'}},
+    ]
+    pap = PAP()
+    for constraint in constraints:
+        for effect in ('PERMIT', 'DENY'):
+            pap.add_item({
+                'target': {'resource.path': constraint}, 'algorithm': 'DENY_UNLESS_PERMIT',
+                'rules': [{'effect': effect, 'target': {'action': 'update' if effect == 'DENY' else 'view'}}]
+            })
+    reference_pap = PAP()
+    reference_pap.root_policy_set.items = list(pap.root_policy_set.items)
+    reference_pap.root_policy_set.index = ItemIndex(reference_pap.root_policy_set.items)
+
+    paths = [
+        '/projects/1/a', '/projects/2/b', '/archive/x', '/projects/3/readme', '/projects/3/readme2',
+        '/projects/9/docs/a.md', '/projects/9/docs/a.txt', '/users/ax/1', '/users/cx/1', '/projects/4/src/x',
+        '/x/projects/4/src/', '/a/secret/b', '/projects/5/b', '/other', 7, None,
+    ]
+    pdp = PDP(pap_instance=pap)
+    reference_pdp = PDP(pap_instance=reference_pap)
+    for path in paths:
+        for action in ('view', 'update'):
+            request = Request({'resource.path': path, 'action': action})
+            assert pdp.evaluate(request).decision == reference_pdp.evaluate(Request(dict(request.attributes))).decision
+    assert PermitBiasedPEP(pdp).evaluate({'resource.path': '/users/b1/x', 'action': 'view'})
+    assert not PermitBiasedPEP(pdp).evaluate({'resource.path': '/projects/7/x', 'action': 'view'})
+
+    index = pap.root_policy_set.index
+    assert isinstance(index, PrefixTrieIndex) and index.attribute == 'resource.path'
+    request = Request({'resource.path': '/projects/1/a'})
+    request.PDP = pdp
+    assert len(index.get_request_items(request)) < len(index.items)
+
+    with pytest.raises(ValueError):
+        pap.add_item({'target': {'resource.path': {'@regex': '('}}, 'rules': [{'effect': 'PERMIT'}]})
+
+    # Patterns from request attributes do not grow the cache without bound
+    for number in range(MAX_COMPILED_PATTERNS + 10):
+        assert compile_pattern('@glob', f"/projects/{number}/*").match(f"/projects/{number}/a")
+    assert _compile_pattern.cache_info().currsize == MAX_COMPILED_PATTERNS
+
+
+def test_range_operators_and_interval_index():
+    constraints = [
+        {'@gt': 3}, {'@gte': 5}, {'@lt': 2}, {'@lte': 1.5}, {'@between': [2, 4]}, {'@between': [7, 7]}, 6,
+        {'@in': [8, 9]}, {'@gt': 'b'}, {'@between': [[1, 2], [1, 10]]}, {'@not': {'@gt': 4}},
+    ]
+    pap = PAP()
+    for constraint in constraints:
+        for effect in ('PERMIT', 'DENY'):
+            pap.add_item({
+                'target': {'subject.clearance': constraint}, 'algorithm': 'DENY_UNLESS_PERMIT',
+                'rules': [{'effect': effect, 'target': {'action': 'update' if effect == 'DENY' else 'view'}}]
+            })
+    reference_pap = PAP()
+    reference_pap.root_policy_set.items = list(pap.root_policy_set.items)
+    reference_pap.root_policy_set.index = ItemIndex(reference_pap.root_policy_set.items)
+
+    pdp = PDP(pap_instance=pap)
+    reference_pdp = PDP(pap_instance=reference_pap)
+    for clearance in (0, 1.5, 2, 3, 3.5, 4, 5, 6, 7, 8, 10, True, 'a', 'c', [1, 5], [2], None):
+        for action in ('view', 'update'):
+            context = {'subject.clearance': clearance, 'action': action}
+            assert pdp.evaluate(Request(context)).decision == reference_pdp.evaluate(Request(context)).decision
+    assert isinstance(pap.root_policy_set.index, IntervalIndex)
+
+    request = Request({'subject.clearance': 7})
+    request.PDP = pdp
+    assert len(pap.root_policy_set.index.get_request_items(request)) < len(pap.root_policy_set.items)
+    request = Request({'subject': {'clearance': 7}})
+    request.PDP = pdp
+    assert len(pap.root_policy_set.index.get_request_items(request)) < len(pap.root_policy_set.items)
+
+    # Index does not fetch attributes from providers
+    calls = []
+
+    class ClearanceProvider(InformationProvider):
+        required_attributes = ['subject.id']
+        provided_attributes = ['subject.clearance']
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            calls.append(attributes['subject.id'])
+            return 7
+
+    provider_pip = PIP()
+    provider_pip.add_provider(ClearanceProvider)
+    request = Request({'subject.id': 1})
+    request.PDP = PDP(pap_instance=pap, pip_instance=provider_pip)
+    assert pap.root_policy_set.index.get_request_items(request) is pap.root_policy_set.items and calls == []
+
+    for operand in ({'@gt': None}, {'@gt': []}, {'@between': [5, 1]}, {'@between': [1, 'z']}, {'@lte': True}):
+        with pytest.raises(ValueError):
+            pap.add_item({'target': {'subject.clearance': operand}, 'rules': [{'effect': 'PERMIT'}]})
+
+
+def test_bitmap_matcher():
+    """
+    Bitmap matching should skip rejected targets without changing decisions
+    """
+    class DirectoryProvider(InformationProvider):
+        required_attributes = ['subject.id']
+        provided_attributes = ['subject.status']
+        failure_threshold = 1000
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            raise ConnectionError("directory is down")
+
+    constraints = ['view', {'@in': ['view', 'update']}, {'!=': 'delete'}, {'==': None}, {'@in': []}, {'@contains': 'x'}]
+    pap = PAP()
+    for index, (action, role) in enumerate(itertools.product(constraints, ['reader', {'@in': ['editor', 1]}])):
+        target = {'action': action, 'subject.role': role}
+        if index % 3 == 0:
+            # Unavailable attribute before the known ones makes the target indeterminate
+            target = {'subject.status': 'active', **target}
+        pap.add_item({
+            'target': target, 'algorithm': 'PERMIT_UNLESS_DENY',
+            'rules': [
+                {'effect': 'DENY', 'target': {'resource.owner': {'!=': 'self'}, 'action': 'delete'}},
+                {'effect': 'PERMIT', 'target': {'resource.owner': 'self'}},
+            ]
+        })
+    matcher = BitmapMatcher()
+    pip = PIP()
+    pip.add_provider(DirectoryProvider)
+    pdp = PDP(pap_instance=pap, pip_instance=pip, matcher=matcher)
+    reference_pdp = PDP(pap_instance=pap, pip_instance=pip)
+
+    rejected = 0
+    for action, role, owner in itertools.product(
+        ['view', 'update', 'delete', None, ['view']], ['reader', 'editor', True, 1], ['self', 'other']
+    ):
+        context = {'subject.id': 1, 'action': action, 'subject.role': role, 'resource.owner': owner}
+        request = Request(context)
+        assert pdp.evaluate(request).decision == reference_pdp.evaluate(Request(context)).decision
+        if request.target_bitmap is not None:
+            rejected += 1
+    assert rejected > 0
+
+    # Bitmaps are rebuilt for changed policies
+    bitmaps = matcher.get_bitmaps(pap.root_policy_set, pap.version)
+    pap.add_item({'target': {'action': 'share'}, 'rules': [{'effect': 'PERMIT'}]})
+    assert pdp.evaluate(Request({'action': 'share', 'subject.role': 'reader'})).decision == RESULT_PERMIT
+    assert matcher.get_bitmaps(pap.root_policy_set, pap.version) is not bitmaps
+
+
+def test_incremental_evaluation():
+    """
+    Evaluation context should reuse outcomes that do not depend on changed attributes
+    """
+    calls = []
+
+    class RoleProvider(InformationProvider):
+        required_attributes = ['subject.id']
+        provided_attributes = ['subject.role']
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            calls.append(attributes['subject.id'])
+            return 'editor' if attributes['subject.id'] == 1 else 'reader'
+
+    pap = PAP()
+    pap.add_item({
+        'target': {'subject.role': {'@in': ['editor', 'reader']}}, 'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [
+            {'effect': 'PERMIT', 'target': {'subject.role': 'editor', 'action': 'update'}},
+            {'effect': 'PERMIT', 'target': {'action': 'view'}, 'condition': {'resource.owner': {'@': 'subject.id'}}},
+            {'effect': 'PERMIT', 'target': {'resource.public': True}},
+        ]
+    })
+    pip = PIP()
+    pip.add_provider(RoleProvider)
+    pdp = PDP(pap_instance=pap, pip_instance=pip)
+    reference_pdp = PDP(pap_instance=pap, pip_instance=pip)
+    evaluation_context = EvaluationContext(pdp)
+
+    contexts = [
+        {'subject.id': subject, 'action': action, 'resource.owner': owner, 'resource.public': public}
+        for subject in (1, 2) for action in ('view', 'update') for owner in (1, 2, 3) for public in (False, True)
+    ]
+    for context in contexts:
+        decision = evaluation_context.evaluate(Request(dict(context))).decision
+        assert decision == reference_pdp.evaluate(Request(dict(context))).decision
+    # Role is resolved once per subject by the context (and for every request by the reference PDP)
+    assert len(calls) == 2 + len(contexts)
+    assert evaluation_context.reused > evaluation_context.evaluated
+
+    test_pep = DenyBiasedPEP(pdp)
+    assert test_pep.evaluate(contexts[0], evaluation_context=evaluation_context)
+    # Outcomes are dropped when policies are changed
+    evaluated = evaluation_context.evaluated
+    pap.add_item({'target': {'action': 'view'}, 'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'DENY'}]})
+    assert test_pep.evaluate(contexts[0], evaluation_context=evaluation_context)
+    assert evaluation_context.evaluated > evaluated + 1
+
+
+def test_evaluation_session():
+    """
+    Session should decide constraints of fixed attributes once and give the same decisions as PEP
+    """
+    calls = []
+
+    class RoleProvider(InformationProvider):
+        required_attributes = ['subject.id']
+        provided_attributes = ['subject.role']
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            calls.append(attributes['subject.id'])
+            return 'editor' if attributes['subject.id'] == 1 else 'reader'
+
+    pap = PAP()
+    pap.add_item({
+        'target': {'subject.role': 'editor'}, 'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [{'effect': 'PERMIT', 'target': {'action': {'@in': ['view', 'update']}}}]
+    })
+    pap.add_item({
+        'target': {'subject.role': 'reader', 'action': 'view'}, 'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [{'effect': 'PERMIT'}]
+    })
+    pap.add_item({
+        'target': {'resource.type': 'document'}, 'algorithm': 'PERMIT_UNLESS_DENY',
+        'rules': [
+            {'effect': 'DENY', 'target': {'subject.department': {'!=': 'legal'}, 'resource.confidential': True}},
+            {'effect': 'DENY', 'target': {'action': 'delete'}, 'condition': {'resource.owner': {'@': 'subject.id'}}},
+        ]
+    })
+    pip = PIP()
+    pip.add_provider(RoleProvider)
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, pip_instance=pip))
+
+    for subject in ({'subject.id': 1, 'subject.department': 'legal'}, {'subject.id': 2, 'subject.department': 'sales'}):
+        session = test_pep.session(subject)
+        # Policy for the other role is pruned
+        assert len([item for item in session.root_policy_set.items if item.target is not None]) < 3
+        for action, resource_type, confidential, owner in itertools.product(
+            ['view', 'update', 'delete'], ['document', 'report'], [False, True], [1, 2]
+        ):
+            context = {
+                'action': action, 'resource.type': resource_type, 'resource.confidential': confidential,
+                'resource.owner': owner
+            }
+            assert session.evaluate(context) == test_pep.evaluate({**subject, **context})
+    # Role is resolved once per session
+    assert calls.count(1) == 1 + 24
+
+    with pytest.raises(ValueError):
+        session.evaluate({'subject.id': 1, 'action': 'view'})
+    pap.add_item({'target': {'action': 'share'}, 'algorithm': 'DENY_UNLESS_PERMIT', 'rules': [{'effect': 'PERMIT'}]})
+    assert session.evaluate({'action': 'share', 'resource.type': 'report'})
+
+
+def test_pep_filter():
+    """
+    PEP filter should lazily yield permitted items fetching provider attributes in bulk
+    """
+    batches = []
+
+    class OwnerProvider(InformationProvider):
+        required_attributes = ['resource.id']
+        provided_attributes = ['resource.owner']
+
+        @classmethod
+        def fetch_value(cls, attributes):  # pragma: no cover
+            raise AssertionError("Owners should be fetched in bulk")
+
+        @classmethod
+        def fetch_many(cls, attributes_list):
+            batches.append(len(attributes_list))
+            return [attributes['resource.id'] % 3 for attributes in attributes_list]
+
+    pap = PAP()
+    pap.add_item({
+        'target': {'action': 'view'}, 'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [
+            {'effect': 'PERMIT', 'target': {'resource.owner': {'==': {'@': 'subject.id'}}}},
+            {'effect': 'PERMIT', 'target': {'resource.public': True}},
+        ]
+    })
+    pip = PIP()
+    pip.add_provider(OwnerProvider)
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, pip_instance=pip))
+
+    def item_to_context(item):
+        return {'action': 'view', 'resource.id': item, 'resource.public': item % 10 == 0}
+
+    permitted = list(test_pep.filter(range(1000), {'subject.id': 1}, item_to_context, chunk_size=250))
+    assert permitted == [item for item in range(1000) if item % 3 == 1 or item % 10 == 0]
+    assert batches == [250] * 4
+
+    # Items are read lazily
+    first_items = list(itertools.islice(test_pep.filter(itertools.count(), {'subject.id': 2}, item_to_context), 3))
+    assert first_items == [0, 2, 5]
+
+
+def test_object_request():
+    """
+    Object request should resolve attributes from domain objects on demand
+    """
+    reads = []
+
+    class Group:
+        def __init__(self, name):
+            self.name = name
+
+    class User:
+        def __init__(self, user_id, department, groups):
+            self.id = user_id
+            self.profile = {'department': department}
+            self.groups = [Group(name) for name in groups]
+
+        @property
+        def email(self):  # pragma: no cover
+            reads.append('email')
+            return 'user@example.com'
+
+        @property
+        def level(self):
+            reads.append('level')
+            return self.id * 10
+
+    class Document:
+        def __init__(self, owner, public):
+            self.owner = owner
+            self.public = public
+
+    class ClearanceProvider(InformationProvider):
+        required_attributes = ['subject.level']
+        provided_attributes = ['subject.clearance']
+
+        @classmethod
+        def fetch_value(cls, attributes):
+            return 'high' if attributes['subject.level'] >= 20 else 'low'
+
+    pap = PAP()
+    pap.add_item({
+        'target': {'subject.profile.department': 'legal'}, 'algorithm': 'DENY_UNLESS_PERMIT',
+        'rules': [
+            {'effect': 'PERMIT', 'target': {'resource.owner.id': {'==': {'@': 'subject.id'}}}},
+            {'effect': 'PERMIT', 'target': {'subject.groups.name': {'@contains': 'auditors'}, 'action': 'view'}},
+            {'effect': 'PERMIT', 'target': {'subject.clearance': 'high', 'subject.level': {'@gt': 25}}},
+        ]
+    })
+    pip = PIP()
+    pip.add_provider(ClearanceProvider)
+    test_pep = DenyBiasedPEP(PDP(pap_instance=pap, pip_instance=pip))
+
+    users = [User(1, 'legal', ['auditors']), User(2, 'legal', []), User(3, 'legal', ['staff']), User(4, 'sales', [])]
+    for user, owner, action in itertools.product(users, users, ['view', 'update']):
+        document = Document(owner, False)
+        reads.clear()
+        decision = test_pep.evaluate(ObjectRequest(subject=user, resource=document, action=action))
+        # Attributes are read at most once, unused ones are never read
+        assert reads.count('level') <= 1 and 'email' not in reads
+        context = {
+            'subject.id': user.id, 'subject.profile.department': user.profile['department'],
+            'subject.groups.name': [group.name for group in user.groups], 'subject.level': user.id * 10,
+            'resource.owner.id': owner.id, 'action': action,
+        }
+        assert decision == test_pep.evaluate(context)
+
+    request = ObjectRequest(subject=users[0], action='view')
+    assert 'subject.profile.department' in request.attributes and 'subject.missing' not in request.attributes
+    assert request.attributes['subject.groups.name'] == ['auditors']
+    assert dict(request.attributes) == {'subject': users[0], 'action': 'view'}
 # EOF